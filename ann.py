@@ -0,0 +1,177 @@
+import numpy as np
+import scipy.sparse as sp
+import time
+
+class RandomProjectionLSH:
+    """Approximate nearest-neighbour index for L2-normalised vectors.
+
+    Each of n_tables hash tables projects the vectors onto n_bits random
+    hyperplanes and keeps the sign pattern as an integer code; vectors with a
+    small angle between them tend to share codes. Candidates are the rows
+    sharing a bucket with the query in any table, optionally also probing the
+    buckets one bit flip away (n_probes), and are re-scored exactly.
+
+    More tables or probes raise recall at the cost of latency; more bits make
+    buckets smaller and queries faster but lower recall.
+    """
+
+    def __init__(self, n_tables=8, n_bits=None, n_probes=0, seed=42):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.seed = seed
+        self.matrix = None
+        self.planes = None
+        # Per table: bucket code of every row, and the rows sorted by code
+        self.codes = None
+        self.orders = None
+        self.sorted_codes = None
+
+    def fit(self, matrix):
+        """Hash every row of a (sparse or dense) L2-normalised matrix"""
+        self.matrix = matrix
+        n_rows, n_dims = matrix.shape
+        if self.n_bits is None:
+            # Aim for buckets of a few hundred rows, which keeps recall@10 high
+            self.n_bits = int(min(max(np.log2(max(n_rows, 1) / 256), 1), 62))
+        rng = np.random.default_rng(self.seed)
+        # All tables' hyperplanes side by side so hashing is a single product
+        self.planes = rng.standard_normal((n_dims, self.n_tables * self.n_bits)).astype(np.float32)
+        self.codes = self._hash(matrix)
+        self._sort_codes()
+        return self
+
+    def _sort_codes(self):
+        self.orders = np.argsort(self.codes, axis=1, kind='stable')
+        self.sorted_codes = np.take_along_axis(self.codes, self.orders, axis=1)
+
+    def _hash(self, vectors):
+        """Bucket codes of some vectors in every table, shape (n_tables, n_vectors)"""
+        projected = vectors @ self.planes
+        projected = np.asarray(projected.todense() if sp.issparse(projected) else projected)
+        bits = (projected > 0).reshape(len(projected), self.n_tables, self.n_bits).astype(np.uint64)
+        return (bits @ (np.uint64(1) << np.arange(self.n_bits, dtype=np.uint64))).T
+
+    def candidates(self, vector):
+        """Row positions sharing a (probed) bucket with a single query vector"""
+        vector = vector.reshape(1, -1) if not sp.issparse(vector) else vector
+        found = []
+        codes = self._hash(vector)[:, 0]
+        for table, code in enumerate(codes):
+            probes = [code] + [code ^ (np.uint64(1) << np.uint64(bit)) for bit in range(min(self.n_probes, self.n_bits))]
+            for probe in probes:
+                lo = np.searchsorted(self.sorted_codes[table], probe, side='left')
+                hi = np.searchsorted(self.sorted_codes[table], probe, side='right')
+                found.append(self.orders[table][lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def query(self, vector, k=10, exclude=None):
+        """Approximate top-k rows by cosine similarity: (rows, scores), best first"""
+        rows = self.candidates(vector)
+        if exclude is not None:
+            rows = rows[rows != exclude]
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        scores = self.matrix[rows] @ (vector.T if sp.issparse(vector) else np.ravel(vector))
+        scores = np.asarray(scores.todense() if sp.issparse(scores) else scores).ravel()
+        top = np.argsort(-scores, kind='stable')[:k]
+        return rows[top], scores[top]
+
+    def neighbor_index(self, k, chunk_size=256):
+        """Approximate top-k neighbours of every row, built bucket by bucket.
+
+        Only rows that share a bucket are compared, so the cost grows with
+        n_rows * bucket size rather than n_rows ** 2. Rows with fewer than k
+        candidates are padded with index -1 and score 0.
+        """
+        n_rows = self.matrix.shape[0]
+        best_indices = np.full((n_rows, k), -1, dtype=np.int32)
+        best_scores = np.full((n_rows, k), -np.inf, dtype=np.float32)
+        for table in range(self.n_tables):
+            boundaries = np.flatnonzero(np.diff(self.sorted_codes[table])) + 1
+            for bucket in np.split(self.orders[table], boundaries):
+                if len(bucket) < 2:
+                    continue
+                bucket_vectors = self.matrix[bucket]
+                for start in range(0, len(bucket), chunk_size):
+                    rows = bucket[start:start + chunk_size]
+                    sims = bucket_vectors[start:start + chunk_size] @ bucket_vectors.T
+                    sims = np.asarray(sims.todense() if sp.issparse(sims) else sims, dtype=np.float32)
+                    # Drop self matches and pairs an earlier table already found
+                    known = (best_indices[rows][:, :, None] == bucket[None, None, :]).any(axis=1)
+                    sims[known | (rows[:, None] == bucket[None, :])] = -np.inf
+                    candidates = np.hstack([best_indices[rows], np.broadcast_to(bucket, (len(rows), len(bucket)))])
+                    scores = np.hstack([best_scores[rows], sims])
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    top_scores = np.take_along_axis(scores, top, axis=1)
+                    order = np.argsort(-top_scores, axis=1)
+                    best_indices[rows] = np.take_along_axis(np.take_along_axis(candidates, top, axis=1), order, axis=1)
+                    best_scores[rows] = np.take_along_axis(top_scores, order, axis=1)
+        missing = ~np.isfinite(best_scores)
+        best_indices[missing] = -1
+        best_scores[missing] = 0.0
+        return best_indices, best_scores
+
+    def recall_at_k(self, k=10, n_queries=100, seed=0):
+        """Compare approximate and exact top-k for sampled rows of the indexed matrix.
+
+        Returns mean recall@k plus mean per-query latency of both searches.
+        """
+        n_rows = self.matrix.shape[0]
+        rng = np.random.default_rng(seed)
+        queries = rng.choice(n_rows, size=min(n_queries, n_rows), replace=False)
+        recalls, ann_times, exact_times = [], [], []
+        for row in queries:
+            vector = self.matrix[row]
+            start = time.perf_counter()
+            approx, _ = self.query(vector, k, exclude=row)
+            ann_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            exact_scores = self.matrix @ (vector.T if sp.issparse(vector) else np.ravel(vector))
+            exact_scores = np.asarray(exact_scores.todense() if sp.issparse(exact_scores) else exact_scores).ravel()
+            exact_scores[row] = -np.inf
+            exact = np.argpartition(-exact_scores, min(k, n_rows - 1) - 1)[:k]
+            exact_times.append(time.perf_counter() - start)
+
+            relevant = exact[exact_scores[exact] > 0]
+            if len(relevant):
+                recalls.append(len(np.intersect1d(approx, relevant)) / len(relevant))
+        return {
+            'k': k,
+            'queries': len(queries),
+            'recall': float(np.mean(recalls)) if recalls else 1.0,
+            'ann_ms': 1000 * float(np.mean(ann_times)) if ann_times else 0.0,
+            'exact_ms': 1000 * float(np.mean(exact_times)) if exact_times else 0.0
+        }
+
+    def with_rows(self, matrix, rows):
+        """Copy of the index over a new matrix, re-hashing only the given (new or changed) rows"""
+        index = RandomProjectionLSH(self.n_tables, self.n_bits, self.n_probes, self.seed)
+        index.matrix = matrix
+        index.planes = self.planes
+        codes = np.zeros((self.n_tables, matrix.shape[0]), dtype=np.uint64)
+        codes[:, :self.codes.shape[1]] = self.codes[:, :matrix.shape[0]]
+        codes[:, rows] = self._hash(matrix[rows])
+        index.codes = codes
+        index._sort_codes()
+        return index
+
+    def save(self, path):
+        """Write the hyperplanes and bucket codes (not the vectors) to an .npz file"""
+        np.savez(path, planes=self.planes, codes=self.codes,
+                 params=np.array([self.n_tables, self.n_bits, self.n_probes, self.seed]))
+
+    @classmethod
+    def load(cls, path, matrix):
+        """Load a saved index and attach it to the matrix it was built from"""
+        data = np.load(path)
+        n_tables, n_bits, n_probes, seed = (int(value) for value in data['params'])
+        index = cls(n_tables=n_tables, n_bits=n_bits, n_probes=n_probes, seed=seed)
+        index.matrix = matrix
+        index.planes = data['planes']
+        index.codes = data['codes']
+        index._sort_codes()
+        return index
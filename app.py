@@ -1,6 +1,6 @@
 from flask import Flask, render_template, abort, request, session, redirect, url_for, jsonify
 from dotenv import load_dotenv
-from search import TMDBClient
+from search import get_client
 import database
 import os
 import requests
@@ -10,7 +10,10 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from chatbot import get_chatbot_response, clean_response
 import uuid
 import joblib
-from model import MovieRecommender
+from model import ModelManager, RecommendationCache
+from fallback import FallbackCandidatePool
+from tmdb_cache import ResponseCache
+from genres import GenreRefresher
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -18,33 +21,46 @@ load_dotenv()
 
 search_client = None
 movies = []
-recommender = None
+# Owns the live recommendation model; rebuilds happen on its background thread, and
+# gunicorn workers share one memory-mapped copy published under MODEL_ARTIFACT_DIR
+model_manager = ModelManager(artifact_dir=os.getenv("MODEL_ARTIFACT_DIR", "model_artifacts"),
+                             poll_interval=float(os.getenv("MODEL_POLL_INTERVAL", "5")),
+                             update_delay=float(os.getenv("MODEL_UPDATE_DELAY", "2")),
+                             cf_weight=float(os.getenv("CF_BLEND_WEIGHT", "0.2")),
+                             embedding_dim=int(os.getenv("MODEL_EMBEDDING_DIM", "0")) or None)
+# Recent per-user results, keyed by model version and the user's rating watermark
+recommendation_cache = RecommendationCache(maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024")))
+# TMDB responses, cached per process and shared between workers through the database
+tmdb_response_cache = ResponseCache(maxsize=int(os.getenv("TMDB_CACHE_SIZE", "1024")))
+# Genre names are read from the genres table, which a background thread refreshes from TMDB
+genre_refresher = GenreRefresher(refresh_interval=int(os.getenv("GENRE_REFRESH_INTERVAL", str(24 * 60 * 60))))
+# Cold-start titles fetched from TMDB in the background; recommendations only read the stored pool
+fallback_pool = FallbackCandidatePool(refresh_interval=int(os.getenv("FALLBACK_REFRESH_INTERVAL", str(6 * 60 * 60))))
 
 # Run once at the start to fetch data from TMDB API
 def init_app():
-    global search_client, database, recommender
+    global search_client, database
 
     # Initialize the database
     database = database.MovieRankerDB()
 
-    # Initialize the TMDB client with the API key from environment variables
-    api_key = os.getenv("TMDB_API_KEY")
-    
-    print(f"Loaded API key: '{api_key}'")
-
-    search_client = TMDBClient(api_key=api_key)
+    # The one TMDB client every request shares, keyed from TMDB_API_KEY
+    search_client = get_client(cache=tmdb_response_cache, rate_limit=float(os.getenv("TMDB_RATE_LIMIT", "40")))
+    if search_client is None:
+        raise ValueError("TMDB_API_KEY not found.")
     print(f"TMDBClient created with key: {search_client.api_key}")
-    search_client.fetch_genres()
     # Run the initialization of the database to create tables if they don't exist
     database.init_db()
+    database.add_rating_listener(recommendation_cache.invalidate)
+    genre_refresher.start(search_client)
+    fallback_pool.start(search_client)
     
     # Initialize the recommendation model
     try:
-        recommender = MovieRecommender()
+        model_manager.load()
         print("Movie recommendation model initialized successfully")
     except Exception as e:
         print(f"Error initializing recommendation model: {e}")
-        recommender = None
 
 init_app()
 
@@ -98,18 +114,41 @@ def get_chat_history(user_id):
     conn.close()
     return [{'role': r, "message": m} for r, m in history]
 
+def get_genre_filters():
+    """Genre include/exclude filters from the query string, e.g. ?genre=28&exclude_genre=27"""
+    return request.args.getlist('genre', type=int), request.args.getlist('exclude_genre', type=int)
+
+def filter_by_genres(media, include_genres, exclude_genres):
+    """Apply genre filters to TMDB results, which carry their own genre_ids"""
+    include, exclude = set(include_genres), set(exclude_genres)
+    return [
+        item for item in media
+        if (not include or include & set(item.get('genre_ids', []))) and not exclude & set(item.get('genre_ids', []))
+    ]
+
+def genre_filter_context(include_genres, exclude_genres):
+    """Template variables for the genre filter form"""
+    genres = getattr(search_client, 'genre_map', {}) if search_client else {}
+    return {
+        'genres': sorted(genres.items(), key=lambda item: item[1]),
+        'include_genres': include_genres,
+        'exclude_genres': exclude_genres
+    }
+
 @app.route("/")
 def search():
     global movies
     query = request.args.get('query')
+    include_genres, exclude_genres = get_genre_filters()
+    filters = genre_filter_context(include_genres, exclude_genres)
     if query:
-        movies = search_client.search_media(title=query)
-        return render_template("search.html", movies=movies, query=query,is_discover=False)
+        movies = filter_by_genres(search_client.search_media(title=query), include_genres, exclude_genres)
+        return render_template("search.html", movies=movies, query=query,is_discover=False, **filters)
     else:
         page = request.args.get('page', 1, type=int)
-        movies = search_client.discover_mixed_media(page=page)
+        movies = filter_by_genres(search_client.discover_mixed_media(page=page), include_genres, exclude_genres)
         next_page = page + 1
-        return render_template("search.html", movies=movies, query=None, is_discover=True, next_page=next_page)
+        return render_template("search.html", movies=movies, query=None, is_discover=True, next_page=next_page, **filters)
 
 
 @app.route("/login", methods=["GET","POST"])
@@ -190,23 +229,16 @@ def rate_movie(movie_id):
             else:
                 # Try to fetch from TMDB API by movie ID
                 try:
-                    from search import TMDBClient
-                    import os
-                    from dotenv import load_dotenv
-                    
-                    load_dotenv()
-                    api_key = os.getenv("TMDB_API_KEY")
-                    if api_key:
-                        tmdb_client = TMDBClient(api_key=api_key)
+                    if search_client:
                         # Fetch movie by ID directly
-                        movie_data = tmdb_client._make_request(f"/movie/{movie_id}")
+                        movie_data = search_client._make_request(f"/movie/{movie_id}")
                         if movie_data and 'id' in movie_data:
                             movie = movie_data
                         else:
                             print(f"Movie {movie_id} not found in TMDB API")
                             return redirect(url_for("movie_detail", movie_id=movie_id))
                     else:
-                        print("TMDB API key not available")
+                        print("TMDB client not available")
                         return redirect(url_for("movie_detail", movie_id=movie_id))
                 except Exception as e:
                     print(f"Error fetching movie {movie_id}: {e}")
@@ -218,9 +250,15 @@ def rate_movie(movie_id):
                 database.add_media(movie)
                 database.add_user_movies_by_id(session["user_id"], movie_id, rating)
                 
-                # Refresh the recommendation model when new ratings are added
+                # Patch the user's cached profile instead of rebuilding it
+                recommender = model_manager.recommender
+                if recommender is not None:
+                    recommender.update_user_rating(session["user_id"], movie_id, float(rating),
+                                                   database.get_rating_watermark(session["user_id"]))
+                
+                # Fold the rated movie into the recommendation model
                 try:
-                    refresh_model()
+                    refresh_model(movie_ids=[movie_id])
                     print(f"Recommendation model refreshed after rating movie {movie_id}")
                 except Exception as e:
                     print(f"Error refreshing recommendation model: {e}")
@@ -250,16 +288,9 @@ def movie_detail(movie_id):
         else:
             # Try to fetch from TMDB API by movie ID
             try:
-                from search import TMDBClient
-                import os
-                from dotenv import load_dotenv
-                
-                load_dotenv()
-                api_key = os.getenv("TMDB_API_KEY")
-                if api_key:
-                    tmdb_client = TMDBClient(api_key=api_key)
+                if search_client:
                     # Fetch movie by ID directly
-                    movie_data = tmdb_client._make_request(f"/movie/{movie_id}")
+                    movie_data = search_client._make_request(f"/movie/{movie_id}")
                     if movie_data and 'id' in movie_data:
                         movie = movie_data
                         # Add to database
@@ -314,7 +345,24 @@ def movie_detail(movie_id):
         except Exception as e:
             print(f"Error getting user rating for movie {movie_id}: {e}")
     
-    return render_template("movie_detail.html", movie=movie)
+    # "More like this", precomputed whenever the recommendation model is built
+    try:
+        similar_movies = [dict(row) for row in database.get_movie_neighbors(movie_id, limit=8)]
+    except Exception as e:
+        print(f"Error getting similar movies for movie {movie_id}: {e}")
+        similar_movies = []
+    
+    return render_template("movie_detail.html", movie=movie, similar_movies=similar_movies)
+
+@app.route("/movie/<int:movie_id>/similar.json")
+def movie_similar_json(movie_id):
+    """Precomputed similar titles for a movie, for loading "More like this" lazily"""
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    try:
+        return {"results": [dict(row) for row in database.get_movie_neighbors(movie_id, limit=limit)]}
+    except Exception as e:
+        print(f"Error in movie_similar_json for movie {movie_id}: {e}")
+        return {"results": []}
 
 
 @app.route("/movie/<int:movie_id>/videos.json")
@@ -352,6 +400,16 @@ def movie_videos_json(movie_id):
         print(f"Error in movie_videos_json for movie {movie_id}: {e}")
         return {"results": []}
 
+@app.route("/tmdb_cache_stats.json")
+def tmdb_cache_stats_json():
+    """Hit rates of this worker's TMDB response cache"""
+    return tmdb_response_cache.stats()
+
+@app.route("/tmdb_client_stats.json")
+def tmdb_client_stats_json():
+    """Request coalescing and rate limiting metrics of this worker's TMDB client"""
+    return search_client.stats() if search_client else {}
+
 @app.route("/chat", methods=["GET"])
 def chat_page():
     return render_template("chat.html")
@@ -397,13 +455,13 @@ def chat():
 
 @app.route("/recommendations")
 def recommendations():
-    global recommender
-    
     if not session.get("user_id"):
         return redirect(url_for("login"))
+    include_genres, exclude_genres = get_genre_filters()
+    filters = genre_filter_context(include_genres, exclude_genres)
     
     # Check if we have fresh recommendations from a refresh
-    if 'fresh_recommendations' in session:
+    if 'fresh_recommendations' in session and not (include_genres or exclude_genres):
         user_recommendations = session['fresh_recommendations']
         # Clear the fresh recommendations from session after use
         del session['fresh_recommendations']
@@ -424,20 +482,42 @@ def recommendations():
                              recommendations=user_recommendations, 
                              user_name=session.get("username"),
                              last_update=session.get("last_model_update"),
-                             fresh_recommendations_loaded=True)
+                             fresh_recommendations_loaded=True,
+                             **filters)
     
-    if recommender is None:
+    # Use the offline batch results when the user has them, otherwise score live.
+    # Genre-filtered lists are always scored live: the model masks the filtered-out
+    # genres before picking the top movies, which stored or cached lists cannot do.
+    user_recommendations = []
+    if not (include_genres or exclude_genres):
         try:
-            recommender = MovieRecommender()
+            user_recommendations = [dict(row) for row in database.get_user_recommendations(session["user_id"], limit=10)]
         except Exception as e:
-            return render_template("recommendations.html", 
-                                 recommendations=[], 
-                                 user_name=session.get("username"),
-                                 error="Recommendation model not available. Please try again later.")
+            print(f"Error reading precomputed recommendations: {e}")
+    
+    # Serve from whichever model version is live right now, even if a rebuild is running
+    recommender = model_manager.recommender
+    if recommender is None and not user_recommendations:
+        model_manager.request_rebuild()
+        return render_template("recommendations.html", 
+                             recommendations=[], 
+                             user_name=session.get("username"),
+                             error="Recommendation model not available. Please try again later.",
+                             **filters)
     
     try:
-        # Get personalized recommendations for the user (minimum 5, maximum 10)
-        user_recommendations = recommender.recommend_for_user(session["user_id"], top_n=10)
+        if include_genres or exclude_genres:
+            user_recommendations = recommender.recommend_for_user(
+                session["user_id"], top_n=10, watermark=database.get_rating_watermark(session["user_id"]),
+                include_genres=include_genres, exclude_genres=exclude_genres
+            )
+        elif not user_recommendations:
+            watermark = database.get_rating_watermark(session["user_id"])
+            user_recommendations = recommendation_cache.get(session["user_id"], recommender.version, watermark)
+            if user_recommendations is None:
+                # Get personalized recommendations for the user (minimum 5, maximum 10)
+                user_recommendations = recommender.recommend_for_user(session["user_id"], top_n=10, watermark=watermark)
+                recommendation_cache.put(session["user_id"], recommender.version, watermark, user_recommendations)
         
         # Log the number of recommendations we got
         print(f"Generated {len(user_recommendations)} recommendations for user")
@@ -459,14 +539,21 @@ def recommendations():
         return render_template("recommendations.html", 
                              recommendations=user_recommendations, 
                              user_name=session.get("username"),
-                             last_update=session.get("last_model_update"))
+                             last_update=session.get("last_model_update"),
+                             **filters)
     except Exception as e:
         print(f"Error generating recommendations: {e}")
         return render_template("recommendations.html", 
                              recommendations=[], 
                              user_name=session.get("username"),
                              error=f"Error generating recommendations: {str(e)}",
-                             last_update=session.get("last_model_update"))
+                             last_update=session.get("last_model_update"),
+                             **filters)
+
+@app.route("/recommendations/cache_stats")
+def recommendation_cache_stats():
+    """Hit/miss counters for the per-user recommendation cache"""
+    return jsonify(recommendation_cache.stats())
 
 @app.route("/retrain_model", methods=["POST"])
 def retrain_model():
@@ -474,11 +561,10 @@ def retrain_model():
     if not session.get("user_id"):
         return jsonify({"success": False, "error": "Not logged in"})
     
-    global recommender
     try:
-        # Rebuild the model with current database data
-        recommender = MovieRecommender()
-        return jsonify({"success": True, "message": "Model retrained successfully"})
+        # Rebuild the model with current database data in the background
+        model_manager.request_rebuild()
+        return jsonify({"success": True, "message": "Model retraining started"})
     except Exception as e:
         print(f"Error retraining model: {e}")
         return jsonify({"success": False, "error": str(e)})
@@ -489,15 +575,14 @@ def refresh_recommendations():
     if not session.get("user_id"):
         return redirect(url_for("login"))
     
-    global recommender
     try:
-        # Force rebuild the model with current database data
+        # Rebuild the model with current database data in the background
+        model_manager.request_rebuild()
+        recommender = model_manager.recommender
         if recommender is None:
-            recommender = MovieRecommender()
-        else:
-            recommender.force_rebuild()
+            return redirect(url_for("recommendations"))
         
-        # Generate fresh recommendations with new randomization
+        # Generate fresh recommendations with new randomization from the live model
         fresh_recommendations = recommender.get_fresh_recommendations(session["user_id"], top_n=10)
         
         # Store fresh recommendations in session for immediate use
@@ -519,22 +604,14 @@ def add_popular_movies():
         return redirect(url_for("login"))
     
     try:
-        from search import TMDBClient
-        import os
-        from dotenv import load_dotenv
-        
-        load_dotenv()
-        api_key = os.getenv("TMDB_API_KEY")
-        if api_key:
-            tmdb_client = TMDBClient(api_key=api_key)
-            
+        if search_client:
             # Search for specific popular movies
             popular_search_terms = ['Avengers', 'Batman', 'Spider-Man', 'Iron Man', 'Captain America', 'Wonder Woman', 'Black Panther', 'Thor']
             added_count = 0
             
             for search_term in popular_search_terms:
                 try:
-                    search_results = tmdb_client.search_media(title=search_term)
+                    search_results = search_client.search_media(title=search_term)
                     for movie in search_results[:2]:  # Get top 2 results for each search
                         # Add to database
                         movie_data = {
@@ -554,10 +631,8 @@ def add_popular_movies():
             
             print(f"Added {added_count} popular movies to database")
             
-            # Rebuild the recommendation model
-            global recommender
-            if recommender:
-                recommender.force_rebuild()
+            # Rebuild the recommendation model in the background
+            model_manager.request_rebuild()
             
             # Store the last update time in session
             from datetime import datetime
@@ -568,15 +643,19 @@ def add_popular_movies():
     
     return redirect(url_for("recommendations"))
 
-def refresh_model():
-    """Refresh the recommendation model - called when new movies are added"""
-    global recommender
+def refresh_model(movie_ids=None):
+    """Refresh the recommendation model - called when new movies are added
+
+    When movie_ids is given only those movies are folded into the existing model;
+    the recommender decides itself when a full refit is due. Either way the work
+    happens on the model manager's background thread.
+    """
     try:
-        if recommender is None:
-            recommender = MovieRecommender()
+        if movie_ids:
+            model_manager.request_update(movie_ids)
         else:
-            recommender.force_rebuild()
-        print("Recommendation model refreshed successfully")
+            model_manager.request_rebuild()
+        print("Recommendation model refresh scheduled")
         # Store the last update time in session
         from datetime import datetime
         session['last_model_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation and scaling benchmark for the recommendation model.
+
+Builds MovieRecommender on synthetic catalogs of increasing size and records
+build time, peak memory, recommend_for_user latency and recall@k on held-out
+ratings, then writes the results as JSON so runs on different commits can be
+compared (--baseline).
+
+    python benchmark.py --sizes 1000,10000,100000 --output bench.json
+    python benchmark.py --sizes 1000,10000 --baseline bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+DEFAULT_SIZES = (1000, 5000, 20000, 100000, 500000)
+# Metrics compared against a baseline run (recall_at_k is the only one where higher is better)
+COMPARED_METRICS = ('build_seconds', 'peak_rss_mb', 'p50_ms', 'p99_ms', 'recall_at_k')
+
+def make_synthetic_db(db_path, n_movies, n_users=None, ratings_per_user=20, holdout_users=200, seed=0):
+    """Fill db_path using generate_data.generate() and return the held-out ratings.
+
+    Users favour one niche of titles, whose templated overviews share their story words.
+    One liked title of each of up to holdout_users users is kept out of the
+    database and returned as {user_id: movie_id} for recall@k.
+    """
+    from generate_data import generate
+    n_users = n_users or max(min(n_movies // 10, 20000), holdout_users)
+    held_out = {}
+    generate(db_path, n_movies=n_movies, n_users=n_users, ratings_per_user=ratings_per_user, chat_share=0,
+             seed=seed, holdout_users=holdout_users, held_out=held_out)
+    return held_out
+
+def evaluate(recommender, held_out, k=10):
+    """recommend_for_user latency percentiles and recall@k of the held-out movies.
+
+    Each user is queried once, so the latency includes building their profile.
+    recommend_for_user samples from its top candidates, so every query is
+    seeded with the user id to keep runs comparable.
+    """
+    latencies, hits = [], 0
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for user_id, movie_id in held_out.items():
+            start = time.perf_counter()
+            recommendations = recommender.recommend_for_user(user_id, top_n=k, random_seed=user_id)
+            latencies.append(time.perf_counter() - start)
+            hits += any(movie['id'] == movie_id for movie in recommendations)
+    return {
+        'queries': len(latencies),
+        'p50_ms': 1000 * float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'p99_ms': 1000 * float(np.percentile(latencies, 99)) if latencies else 0.0,
+        'recall_at_k': hits / len(held_out) if held_out else 0.0
+    }
+
+def run_size(options):
+    """Build the model on an already generated database and evaluate it.
+
+    Runs in its own process when isolated, so peak_rss_mb covers the model
+    build and the queries only, not generating the data.
+    """
+    from model import MovieRecommender
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        recommender = MovieRecommender(db_path=options['db_path'], n_neighbors=options['neighbors'],
+                                       ann_tables=options['ann_tables'], embedding_dim=options['embedding_dim'])
+        build_seconds = time.perf_counter() - start
+    result = {'size': options['size'], 'build_seconds': build_seconds}
+    result.update(evaluate(recommender, options['held_out'], k=options['k']))
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS); it covers this whole process
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+def run_benchmark(sizes, isolate=True, **options):
+    """Benchmark every size; isolate builds each size in a fresh process so peak memory is its own.
+
+    The synthetic database is generated here, in the calling process, and
+    only its path is handed to the process that builds the model.
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'bench.db')
+            start = time.perf_counter()
+            held_out = make_synthetic_db(db_path, size, ratings_per_user=options['ratings_per_user'],
+                                         holdout_users=options['queries'], seed=options['seed'])
+            generate_seconds = time.perf_counter() - start
+            job = dict(options, size=size, db_path=db_path, held_out=held_out)
+            if isolate:
+                import multiprocessing
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    result = pool.apply(run_size, (job,))
+            else:
+                result = run_size(job)
+        result['generate_seconds'] = generate_seconds
+        print(f"{size} titles: built in {result['build_seconds']:.1f}s, p50 {result['p50_ms']:.2f}ms, "
+              f"p99 {result['p99_ms']:.2f}ms, recall@{options['k']} {result['recall_at_k']:.3f}, "
+              f"peak {result['peak_rss_mb']:.0f}MB")
+        results.append(result)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Relative change of each metric against a baseline run, per size present in both"""
+    baseline_by_size = {result['size']: result for result in baseline['results']}
+    changes = {}
+    for result in results:
+        previous = baseline_by_size.get(result['size'])
+        if previous is None:
+            continue
+        changes[result['size']] = {
+            metric: (result[metric] - previous[metric]) / previous[metric] if previous[metric] else None
+            for metric in COMPARED_METRICS
+        }
+    return changes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommendation model scaling benchmark")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated catalog sizes to benchmark")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write results to")
+    parser.add_argument('--baseline', default=None, help="Earlier results file to compare against")
+    parser.add_argument('--k', type=int, default=10, help="Recommendations per query (the k in recall@k)")
+    parser.add_argument('--queries', type=int, default=200, help="Users with a held-out rating to query")
+    parser.add_argument('--ratings-per-user', type=int, default=20, help="Ratings per synthetic user")
+    parser.add_argument('--neighbors', type=int, default=50, help="Neighbours kept per movie")
+    parser.add_argument('--ann-tables', type=int, default=0, help="Build with an LSH index of this many tables")
+    parser.add_argument('--embedding-dim', type=int, default=None, help="Build SVD embeddings of this size")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic data")
+    args = parser.parse_args(argv)
+
+    options = {'k': args.k, 'queries': args.queries, 'ratings_per_user': args.ratings_per_user,
+               'neighbors': args.neighbors, 'ann_tables': args.ann_tables,
+               'embedding_dim': args.embedding_dim, 'seed': args.seed}
+    results = run_benchmark([int(size) for size in args.sizes.split(',')], **options)
+    report = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'python': platform.python_version(), 'options': options, 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['changes'] = compare(results, json.load(f))
+        for size, changes in report['changes'].items():
+            formatted = ', '.join(f"{metric} {change:+.1%}" for metric, change in changes.items() if change is not None)
+            print(f"{size} titles vs baseline: {formatted}")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import numpy as np
+import os
+import time
+
+# Catalog columns in the order rows are read from the movies table (see model.MOVIE_COLUMNS)
+CATALOG_FIELDS = ('id', 'title', 'overview', 'vote_average', 'vote_count', 'popularity', 'poster_path', 'media_type')
+# Fields of the movie dicts handed back by the recommender
+RESULT_FIELDS = ('id', 'title', 'overview', 'vote_average', 'vote_count', 'popularity', 'poster_path')
+NUMERIC_FIELDS = {'id': np.int64, 'vote_average': np.float64, 'vote_count': np.int64, 'popularity': np.float64}
+# Stored in place of NULL; vote_count is a count, so a missing one is 0
+MISSING_VALUES = {'id': 0, 'vote_average': np.nan, 'vote_count': 0, 'popularity': np.nan}
+
+def movie_content(title, overview):
+    """Text a movie is vectorised from"""
+    return f"{title} {overview or ''}"
+
+class TextColumn:
+    """Read-only text column stored as one UTF-8 byte buffer plus row offsets.
+
+    Unlike an object array it can be saved as plain .npy files and memory-mapped
+    back, so every process maps one copy; strings are decoded on access. NULLs
+    are marked in `missing` and read back as None.
+    """
+
+    dtype = np.dtype(object)
+
+    def __init__(self, data, offsets, missing):
+        self.data = data
+        self.offsets = offsets
+        self.missing = missing
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [b'' if value is None else str(value).encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets, np.array([value is None for value in values], dtype=bool))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, rows):
+        if np.ndim(rows) == 0 and not isinstance(rows, slice):
+            return self[np.array([rows])][0]
+        rows = np.arange(len(self))[rows]
+        buffer = memoryview(self.data)
+        starts, ends = self.offsets[rows].tolist(), self.offsets[rows + 1].tolist()
+        values = np.empty(len(rows), dtype=object)
+        values[:] = [None if missing else str(buffer[start:end], 'utf-8')
+                     for start, end, missing in zip(starts, ends, self.missing[rows].tolist())]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:]
+
+    def tolist(self):
+        return self[:].tolist()
+
+class MovieRecord:
+    """Read-only view of one catalog row; attribute access reads straight from the column arrays"""
+
+    __slots__ = ('_catalog', 'row')
+
+    def __init__(self, catalog, row):
+        self._catalog = catalog
+        self.row = row
+
+    def __getattr__(self, name):
+        if name in CATALOG_FIELDS:
+            value = self._catalog.columns[name][self.row]
+            return value.item() if isinstance(value, np.generic) else value
+        raise AttributeError(name)
+
+    def to_dict(self, fields=RESULT_FIELDS):
+        return {field: getattr(self, field) for field in fields}
+
+    def __repr__(self):
+        return f"MovieRecord(id={self.id}, title={self.title!r})"
+
+class MovieCatalog:
+    """Columnar movie metadata: one NumPy array per field plus id and title lookups.
+
+    Numeric fields are typed arrays, text fields object arrays (or TextColumns
+    once saved and loaded). Row positions match the rows of the TF-IDF matrix,
+    so results are assembled by indexing the columns with row positions.
+    Catalogs are never modified in place; with_rows() returns an updated copy.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.ids = columns['id']
+        self.id_to_row = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        self._title_to_row = None
+
+    @property
+    def title_to_row(self):
+        """First row with each title, for title-based lookups; built on first use"""
+        if self._title_to_row is None:
+            title_to_row = {}
+            for row, title in enumerate(self.columns['title'].tolist()):
+                title_to_row.setdefault(title, row)
+            self._title_to_row = title_to_row
+        return self._title_to_row
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from row tuples in CATALOG_FIELDS order"""
+        values = list(zip(*rows)) if rows else [()] * len(CATALOG_FIELDS)
+        columns = {}
+        for field, column in zip(CATALOG_FIELDS, values):
+            if field in NUMERIC_FIELDS:
+                missing = MISSING_VALUES[field]
+                columns[field] = np.array([missing if value is None else value for value in column],
+                                          dtype=NUMERIC_FIELDS[field])
+            else:
+                array = np.empty(len(column), dtype=object)
+                array[:] = column
+                columns[field] = array
+        return cls(columns)
+
+    def save(self, directory):
+        """Write every column as .npy files (text columns as bytes, offsets and NULL mask)"""
+        for field in CATALOG_FIELDS:
+            column = self.columns[field]
+            if field in NUMERIC_FIELDS:
+                np.save(os.path.join(directory, f"catalog_{field}.npy"), np.ascontiguousarray(column))
+                continue
+            if not isinstance(column, TextColumn):
+                column = TextColumn.from_values(column.tolist())
+            for part in ('data', 'offsets', 'missing'):
+                np.save(os.path.join(directory, f"catalog_{field}_{part}.npy"), np.ascontiguousarray(getattr(column, part)))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Map a catalog written by save() back in without copying its columns"""
+        def load_array(name):
+            return np.load(os.path.join(directory, f"catalog_{name}.npy"), mmap_mode=mmap_mode)
+        columns = {}
+        for field in CATALOG_FIELDS:
+            if field in NUMERIC_FIELDS:
+                columns[field] = load_array(field)
+            else:
+                columns[field] = TextColumn(*(load_array(f"{field}_{part}") for part in ('data', 'offsets', 'missing')))
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, movie_id):
+        return movie_id in self.id_to_row
+
+    def row_of(self, movie_id):
+        """Row position of a movie id, or None"""
+        return self.id_to_row.get(movie_id)
+
+    def record(self, row):
+        return MovieRecord(self, row)
+
+    def get(self, movie_id):
+        """Record view for a movie id, or None"""
+        row = self.id_to_row.get(movie_id)
+        return None if row is None else MovieRecord(self, row)
+
+    def records(self, rows, fields=RESULT_FIELDS):
+        """Result dicts for the given rows, built column by column"""
+        rows = np.asarray(rows, dtype=np.int64)
+        values = [self.columns[field][rows].tolist() for field in fields]
+        return [dict(zip(fields, row_values)) for row_values in zip(*values)]
+
+    def content(self, row):
+        """Text the movie at a row is vectorised from"""
+        return movie_content(self.columns['title'][row], self.columns['overview'][row])
+
+    def with_rows(self, rows, positions):
+        """Copy with the given row tuples written at `positions`; positions past the end are appended"""
+        n_rows = max(len(self), max(positions) + 1 if len(positions) else 0)
+        columns = {}
+        for index, field in enumerate(CATALOG_FIELDS):
+            column = np.asarray(self.columns[field])
+            updated = np.empty(n_rows, dtype=column.dtype)
+            updated[:len(column)] = column
+            for row, position in zip(rows, positions):
+                value = row[index]
+                updated[position] = MISSING_VALUES[field] if value is None and field in NUMERIC_FIELDS else value
+            columns[field] = updated
+        return MovieCatalog(columns)
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({field: np.asarray(self.columns[field]) for field in CATALOG_FIELDS})
+
+def benchmark_catalog(catalog, n_results=10, repeats=1000, seed=0):
+    """Time assembling result rows and looking up movie ids: DataFrame path vs the columnar catalog.
+
+    Returns the mean microseconds per call of each path.
+    """
+    import pandas as pd
+    movies_df = catalog.to_dataframe()
+    id_index = pd.Index(movies_df['id'])
+    rng = np.random.default_rng(seed)
+    queries = [rng.choice(len(catalog), size=min(n_results, len(catalog)), replace=False)
+               for _ in range(repeats)]
+    lookup_ids = catalog.ids[np.concatenate(queries)].tolist()[:repeats]
+    columns = list(RESULT_FIELDS)
+
+    def per_call(function, calls):
+        start = time.perf_counter()
+        for call in calls:
+            function(call)
+        return 1e6 * (time.perf_counter() - start) / len(calls)
+
+    return {
+        'movies': len(catalog),
+        'results_per_call': n_results,
+        'dataframe_records_us': per_call(lambda rows: movies_df.iloc[rows][columns].to_dict(orient='records'), queries),
+        'catalog_records_us': per_call(catalog.records, queries),
+        'dataframe_lookup_us': per_call(id_index.get_loc, lookup_ids),
+        'catalog_lookup_us': per_call(catalog.id_to_row.__getitem__, lookup_ids)
+    }
@@ -0,0 +1,214 @@
+import numpy as np
+import scipy.sparse as sp
+import sqlite3
+import threading
+from model import rating_weight
+
+class CollaborativeRecommender:
+    """Item-item collaborative filtering over the user_movies ratings matrix.
+
+    Ratings are turned into a sparse (users x movies) CSR matrix of rating
+    weights (distance from the 1-10 midpoint, as for content profiles). Item
+    similarities are the cosine between movie columns, computed a block of
+    movies at a time with a sparse product so the work follows the number of
+    co-ratings rather than users x movies, and pruned to the n_neighbors most
+    similar movies per movie.
+    """
+
+    def __init__(self, db_path='movie_ranker.db', n_neighbors=50, chunk_size=1024):
+        self.db_path = db_path
+        self.n_neighbors = n_neighbors
+        self.chunk_size = chunk_size
+        self.item_ids = np.empty(0, dtype=np.int64)
+        self.item_index = {}
+        self.user_index = {}
+        # Ratings kept per user and per movie as (indices, weights) array pairs, plus every
+        # movie column's squared norm, so a single rating change only touches its own
+        # user and movie rather than the whole ratings matrix
+        self.user_ratings = []
+        self.item_ratings = []
+        self.item_sq_norms = np.empty(0, dtype=np.float64)
+        # Top-k item neighbours, padded with -1 / -inf where a movie has fewer co-rated movies
+        self.neighbor_indices = np.empty((0, n_neighbors), dtype=np.int32)
+        self.neighbor_scores = np.empty((0, n_neighbors), dtype=np.float32)
+        self._lock = threading.RLock()
+        self._build_model()
+
+    def _build_model(self):
+        """Build item-item similarities from every rating in the database"""
+        print("Building collaborative filtering model...")
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT user_id, movie_id, rating FROM user_movies").fetchall()
+        conn.close()
+
+        with self._lock:
+            self.item_index = {}
+            self.user_index = {}
+            users, items, weights = [], [], []
+            for user_id, movie_id, rating in rows:
+                users.append(self.user_index.setdefault(user_id, len(self.user_index)))
+                items.append(self.item_index.setdefault(movie_id, len(self.item_index)))
+                weights.append(rating_weight(rating))
+            self.item_ids = np.array(list(self.item_index), dtype=np.int64)
+            ratings = sp.csr_matrix(
+                (np.array(weights, dtype=np.float64), (np.array(users, dtype=np.int64), np.array(items, dtype=np.int64))),
+                shape=(len(self.user_index), len(self.item_index))
+            )
+            self.user_ratings = self._split_rows(ratings)
+            self.item_ratings = self._split_rows(ratings.T.tocsr())
+            self.item_sq_norms = np.asarray(ratings.multiply(ratings).sum(axis=0), dtype=np.float64).ravel()
+
+            n_items = len(self.item_ids)
+            self.neighbor_indices = np.full((n_items, self.n_neighbors), -1, dtype=np.int32)
+            self.neighbor_scores = np.full((n_items, self.n_neighbors), -np.inf, dtype=np.float32)
+            normalized_t = (ratings @ sp.diags(1.0 / self._item_norms())).T.tocsr()
+            for start in range(0, n_items, self.chunk_size):
+                end = min(start + self.chunk_size, n_items)
+                # (chunk x items), only non-zero where movies share a rater
+                block = (normalized_t[start:end] @ normalized_t.T).tocsr()
+                for offset in range(end - start):
+                    item = start + offset
+                    cols = block.indices[block.indptr[offset]:block.indptr[offset + 1]]
+                    sims = block.data[block.indptr[offset]:block.indptr[offset + 1]]
+                    self._set_neighbors(item, cols, sims)
+        print(f"Collaborative model built from {len(rows)} ratings over {len(self.item_ids)} movies")
+
+    @staticmethod
+    def _split_rows(matrix):
+        """Every row of a CSR matrix as an (indices, weights) pair of arrays"""
+        matrix.sort_indices()
+        return [
+            (matrix.indices[start:end].astype(np.int64), matrix.data[start:end].astype(np.float64))
+            for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])
+        ]
+
+    @staticmethod
+    def _set_entry(rows, row, key, weight):
+        """Set (or, for weight None, remove) key in rows[row]; returns its previous weight (0 if absent)"""
+        keys, weights = rows[row]
+        found = np.flatnonzero(keys == key)
+        old_weight = float(weights[found[0]]) if len(found) else 0.0
+        if len(found):
+            keys, weights = np.delete(keys, found), np.delete(weights, found)
+        if weight is not None:
+            keys, weights = np.append(keys, key), np.append(weights, weight)
+        rows[row] = (keys, weights)
+        return old_weight
+
+    def _item_norms(self):
+        norms = np.sqrt(self.item_sq_norms)
+        norms[norms == 0] = 1.0
+        return norms
+
+    def _item_similarities(self, item):
+        """Cosine similarity of one movie column with every movie, from the ratings of its raters only"""
+        users, weights = self.item_ratings[item]
+        if not len(users):
+            return np.zeros(len(self.item_ids), dtype=np.float32)
+        co_rated = [self.user_ratings[user] for user in users.tolist()]
+        co_items = np.concatenate([items for items, _ in co_rated])
+        co_weights = np.concatenate([item_weights for _, item_weights in co_rated])
+        co_weights *= np.repeat(weights, [len(items) for items, _ in co_rated])
+        dots = np.bincount(co_items, weights=co_weights, minlength=len(self.item_ids))
+        norms = self._item_norms()
+        return (dots / (norms * norms[item])).astype(np.float32)
+
+    def _set_neighbors(self, item, cols, sims):
+        """Store the top-k positive similarities of one movie"""
+        keep = (cols != item) & (sims > 0)
+        cols, sims = cols[keep], sims[keep]
+        if len(cols) > self.n_neighbors:
+            top = np.argpartition(-sims, self.n_neighbors - 1)[:self.n_neighbors]
+            cols, sims = cols[top], sims[top]
+        order = np.argsort(-sims)
+        self.neighbor_indices[item] = -1
+        self.neighbor_scores[item] = -np.inf
+        self.neighbor_indices[item, :len(cols)] = cols[order]
+        self.neighbor_scores[item, :len(cols)] = sims[order]
+
+    def add_rating(self, user_id, movie_id, rating):
+        """Apply one new, changed or removed (rating=None) rating incrementally.
+
+        Only the rated movie's column changes, so only its similarities move:
+        they are recomputed from the ratings of the movie's own raters, its
+        neighbour list is rebuilt from them and the entry for it is patched
+        into every other movie's list. The cost follows the movie's co-ratings,
+        not the total number of ratings.
+        """
+        with self._lock:
+            user = self.user_index.get(user_id)
+            item = self.item_index.get(movie_id)
+            if rating is None and (user is None or item is None):
+                return
+            if user is None:
+                user = self.user_index[user_id] = len(self.user_index)
+                self.user_ratings.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)))
+            if item is None:
+                item = self.item_index[movie_id] = len(self.item_index)
+                self.item_ids = np.append(self.item_ids, np.int64(movie_id))
+                self.item_ratings.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)))
+                self.item_sq_norms = np.append(self.item_sq_norms, 0.0)
+                self.neighbor_indices = np.vstack([
+                    self.neighbor_indices, np.full((1, self.n_neighbors), -1, dtype=np.int32)
+                ])
+                self.neighbor_scores = np.vstack([
+                    self.neighbor_scores, np.full((1, self.n_neighbors), -np.inf, dtype=np.float32)
+                ])
+
+            weight = rating_weight(rating) if rating is not None else None
+            old_weight = self._set_entry(self.user_ratings, user, item, weight)
+            self._set_entry(self.item_ratings, item, user, weight)
+            self.item_sq_norms[item] = max(self.item_sq_norms[item] + (weight or 0.0) ** 2 - old_weight ** 2, 0.0)
+
+            sims = self._item_similarities(item)
+            self._set_neighbors(item, np.arange(len(sims)), sims)
+
+            # Patch this movie into (or out of) every other movie's list, all affected lists at once
+            sims[item] = -np.inf
+            contains = (self.neighbor_indices == item).any(axis=1)
+            affected = np.flatnonzero(contains | (sims > np.maximum(self.neighbor_scores[:, -1], 0)))
+            affected = affected[affected != item]
+            if not len(affected):
+                return
+            cols = np.hstack([self.neighbor_indices[affected], np.full((len(affected), 1), item, dtype=np.int32)])
+            scores = np.hstack([self.neighbor_scores[affected], sims[affected, None]])
+            # Drop the movie's old entry and anything no longer positive, as _set_neighbors() does
+            scores[:, :-1][cols[:, :-1] == item] = -np.inf
+            scores[~(scores > 0)] = -np.inf
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :self.n_neighbors]
+            cols = np.take_along_axis(cols, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+            cols[np.isneginf(scores)] = -1
+            self.neighbor_indices[affected] = cols
+            self.neighbor_scores[affected] = scores
+
+    def neighbor_matrix(self):
+        """Item-item similarities as a sparse (movies x movies) matrix"""
+        with self._lock:
+            valid = self.neighbor_indices >= 0
+            rows = np.repeat(np.arange(len(self.item_ids)), valid.sum(axis=1))
+            n_items = len(self.item_ids)
+            return sp.csr_matrix(
+                (self.neighbor_scores[valid], (rows, self.neighbor_indices[valid])),
+                shape=(n_items, n_items)
+            )
+
+    def score_ratings(self, ratings):
+        """Score movies for a {movie_id: rating} dict.
+
+        Returns (movie_ids, scores): each movie's rating-weighted similarity to the
+        rated movies, divided by the total absolute weight.
+        """
+        with self._lock:
+            item_ids = self.item_ids
+            rated = [(self.item_index[movie_id], rating_weight(rating))
+                     for movie_id, rating in ratings.items() if movie_id in self.item_index]
+            if not rated:
+                return item_ids, np.zeros(len(item_ids))
+            items = np.array([item for item, _ in rated])
+            weights = np.array([weight for _, weight in rated])
+            scores = np.zeros(len(item_ids))
+            cols = self.neighbor_indices[items]
+            valid = cols >= 0
+            np.add.at(scores, cols[valid], (self.neighbor_scores[items] * weights[:, None])[valid])
+        return item_ids, scores / np.abs(weights).sum()
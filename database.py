@@ -1,11 +1,15 @@
 import sqlite3
 
 class MovieRankerDB:
+    # Callbacks run with a user id whenever that user's ratings change in this process
+    rating_listeners = []
+
     def __init__(self, db_path='movie_ranker.db'):
+        self.db_path = db_path
         self.init_db()
 
     def db_connect(self):
-        conn = sqlite3.connect('movie_ranker.db')
+        conn = sqlite3.connect(self.db_path, timeout=30)
         conn.row_factory = sqlite3.Row
         return conn
 
@@ -74,6 +78,74 @@ class MovieRankerDB:
         )
         """)
 
+        # Bumped on every rating change so caches can tell a user's ratings moved on
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_rating_watermarks (
+            user_id INTEGER PRIMARY KEY,
+            watermark INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """)
+
+        # Precomputed recommendations written by the offline batch job (model.py batch-recommend)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_recommendations (
+            user_id INTEGER,
+            rank INTEGER,
+            movie_id INTEGER,
+            score REAL NOT NULL,
+            generated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, rank),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (movie_id) REFERENCES movies(id)
+        )
+        """)
+
+        # Most similar titles of each movie ("More like this"); building a model never writes it,
+        # store_changed_neighbors() does when ModelManager or build-artifacts publishes a model
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS movie_neighbors (
+            movie_id INTEGER,
+            rank INTEGER,
+            neighbor_id INTEGER,
+            score REAL NOT NULL,
+            PRIMARY KEY (movie_id, rank),
+            FOREIGN KEY (movie_id) REFERENCES movies(id),
+            FOREIGN KEY (neighbor_id) REFERENCES movies(id)
+        )
+        """)
+
+        # TMDB genre names by media type, refreshed in the background by genres.py
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS genres (
+            id INTEGER,
+            media_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            refreshed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, media_type)
+        )
+        """)
+
+        # Shared tier of the TMDB response cache (tmdb_cache.py), keyed by endpoint and parameters
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tmdb_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        """)
+
+        # Cold-start candidates kept fresh by a background job (fallback.py), best first
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fallback_candidates (
+            movie_id INTEGER PRIMARY KEY,
+            rank INTEGER NOT NULL,
+            source TEXT,
+            refreshed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (movie_id) REFERENCES movies(id)
+        )
+        """)
+
         conn.commit()
         conn.close()
 
@@ -136,8 +208,10 @@ class MovieRankerDB:
         INSERT OR REPLACE INTO user_movies (user_id, movie_id, rating)
         VALUES (?, ?, ?)
         """, (user_id, movie_id, rating))
+        self._ratings_changed(cursor, user_id)
         conn.commit()
         conn.close()
+        self._notify_rating_listeners(user_id)
 
     def add_user_movies_by_name(self, user_name, movie_id, rating):
         conn = self.db_connect()
@@ -146,8 +220,42 @@ class MovieRankerDB:
         INSERT OR REPLACE INTO user_movies (user_id, movie_id, rating)
         VALUES ((SELECT id FROM users WHERE name = ?), ?, ?)
         """, (user_name, movie_id, rating))
+        user = cursor.execute("SELECT id FROM users WHERE name = ?", (user_name,)).fetchone()
+        if user:
+            self._ratings_changed(cursor, user['id'])
         conn.commit()
         conn.close()
+        if user:
+            self._notify_rating_listeners(user['id'])
+
+    @classmethod
+    def add_rating_listener(cls, callback):
+        '''Register callback(user_id) to run after a user's ratings change.'''
+        cls.rating_listeners.append(callback)
+
+    def _ratings_changed(self, cursor, user_id):
+        # Precomputed recommendations no longer reflect this user's ratings
+        cursor.execute("DELETE FROM user_recommendations WHERE user_id = ?", (user_id,))
+        cursor.execute("""
+        INSERT INTO user_rating_watermarks (user_id, watermark) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET watermark = watermark + 1
+        """, (user_id,))
+
+    def _notify_rating_listeners(self, user_id):
+        for callback in self.rating_listeners:
+            try:
+                callback(user_id)
+            except Exception as e:
+                print(f"Error in rating listener for user {user_id}: {e}")
+
+    def get_rating_watermark(self, user_id):
+        '''Counter that increases every time the user's ratings change.'''
+        conn = self.db_connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT watermark FROM user_rating_watermarks WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+        return result['watermark'] if result else 0
 
     def add_genre(self, movie_id, genre_id):
         conn = self.db_connect()
@@ -225,8 +333,13 @@ class MovieRankerDB:
         DELETE FROM user_movies
         WHERE user_id = (SELECT id FROM users WHERE name = ?) AND movie_id = ?
         """, (user_name, movie_id))
+        user = cursor.execute("SELECT id FROM users WHERE name = ?", (user_name,)).fetchone()
+        if user:
+            self._ratings_changed(cursor, user['id'])
         conn.commit()
         conn.close()
+        if user:
+            self._notify_rating_listeners(user['id'])
 
     def rm_user_movie_by_id(self, user_id, movie_id):
         conn = self.db_connect()
@@ -235,8 +348,10 @@ class MovieRankerDB:
         DELETE FROM user_movies
         WHERE user_id = ? AND movie_id = ?
         """, (user_id, movie_id))
+        self._ratings_changed(cursor, user_id)
         conn.commit()
         conn.close()
+        self._notify_rating_listeners(user_id)
 
     def rm_movie(self, movie_id):
         conn = self.db_connect()
@@ -245,6 +360,106 @@ class MovieRankerDB:
         conn.commit()
         conn.close()
 
+    def get_user_recommendations(self, user_id, limit=10):
+        '''Get the precomputed recommendations for a user, best first.'''
+        conn = self.db_connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT m.id, m.title, m.overview, m.vote_average, m.vote_count, m.popularity, m.poster_path, ur.score
+            FROM user_recommendations ur
+            JOIN movies m ON ur.movie_id = m.id
+            WHERE ur.user_id = ?
+            ORDER BY ur.rank ASC
+            LIMIT ?
+        """, (user_id, limit))
+        results = cursor.fetchall()
+        conn.close()
+        return results
+
+    def get_movie_neighbors(self, movie_id, limit=10):
+        '''Get the precomputed most similar titles for a movie, best first.'''
+        # SQLite reads a negative LIMIT as no limit at all
+        limit = max(limit, 1)
+        conn = self.db_connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT m.id, m.title, m.overview, m.vote_average, m.vote_count, m.popularity, m.poster_path, m.media_type, mn.score
+            FROM movie_neighbors mn
+            JOIN movies m ON mn.neighbor_id = m.id
+            WHERE mn.movie_id = ?
+            ORDER BY mn.rank ASC
+            LIMIT ?
+        """, (movie_id, limit))
+        results = cursor.fetchall()
+        conn.close()
+        return results
+
+    def replace_fallback_candidates(self, candidates):
+        '''Store (media_data, source) pairs as the new cold-start pool, best first, in one transaction.'''
+        conn = self.db_connect()
+        with conn:
+            conn.executemany("""
+            INSERT OR IGNORE INTO movies (id, backdrop_path, poster_path, original_language, title, overview, release_date, vote_average, vote_count, popularity, media_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                media['id'], media.get('backdrop_path'), media.get('poster_path'),
+                media.get('original_language', 'en'), media.get('title') or media.get('name'),
+                media.get('overview'), media.get('release_date') or media.get('first_air_date'),
+                media.get('vote_average', 0), media.get('vote_count', 0), media.get('popularity', 0),
+                media.get('media_type', 'movie')
+            ) for media, _ in candidates])
+            conn.executemany(
+                "INSERT OR IGNORE INTO genre_map (movie_id, genre_id) VALUES (?, ?)",
+                [(media['id'], genre_id) for media, _ in candidates for genre_id in media.get('genre_ids', [])]
+            )
+            conn.execute("DELETE FROM fallback_candidates")
+            conn.executemany(
+                "INSERT OR IGNORE INTO fallback_candidates (movie_id, rank, source) VALUES (?, ?, ?)",
+                [(media['id'], rank, source) for rank, (media, source) in enumerate(candidates)]
+            )
+        conn.close()
+
+    def get_fallback_refreshed_at(self):
+        '''When the cold-start pool was last refreshed (UTC text), or None if it never was.'''
+        conn = self.db_connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(refreshed_at) AS refreshed_at FROM fallback_candidates")
+        result = cursor.fetchone()
+        conn.close()
+        return result['refreshed_at']
+
+    def replace_genres(self, movie_genres, tv_genres):
+        '''Store {genre_id: name} maps for movies and TV as the new genre list, in one transaction.'''
+        conn = self.db_connect()
+        with conn:
+            conn.execute("DELETE FROM genres")
+            conn.executemany(
+                "INSERT INTO genres (id, media_type, name) VALUES (?, ?, ?)",
+                [(genre_id, 'movie', name) for genre_id, name in movie_genres.items()] +
+                [(genre_id, 'tv', name) for genre_id, name in tv_genres.items()]
+            )
+        conn.close()
+
+    def get_genres(self):
+        '''Stored genres as ({genre_id: name} for movies, {genre_id: name} for TV).'''
+        conn = self.db_connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, media_type, name FROM genres")
+        results = cursor.fetchall()
+        conn.close()
+        movie_genres = {row['id']: row['name'] for row in results if row['media_type'] == 'movie'}
+        tv_genres = {row['id']: row['name'] for row in results if row['media_type'] == 'tv'}
+        return movie_genres, tv_genres
+
+    def get_genres_refreshed_at(self):
+        '''When the genre list was last refreshed (UTC text), or None if it never was.'''
+        conn = self.db_connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(refreshed_at) AS refreshed_at FROM genres")
+        result = cursor.fetchone()
+        conn.close()
+        return result['refreshed_at']
+
     def get_movie_genres(self, movie_id):
         '''Get genre IDs for a specific movie from the genre_map table.'''
         conn = self.db_connect()
@@ -0,0 +1,54 @@
+import database
+from refresher import PeriodicRefresher
+
+# Searched on every refresh so well-known titles are always in the pool
+POPULAR_SEARCH_TERMS = ['Avengers', 'Batman', 'Spider-Man', 'Iron Man', 'Captain America', 'Wonder Woman']
+
+class FallbackCandidatePool(PeriodicRefresher):
+    """Locally stored pool of popular TMDB titles for topping up short recommendation lists.
+
+    A daemon thread refreshes the fallback_candidates table (and adds its movies
+    to the movies table) every refresh_interval seconds, so recommendation
+    requests only ever read the table and never wait on TMDB. An empty fetch
+    keeps the current pool and is retried with backoff (see PeriodicRefresher).
+    """
+
+    description = 'fallback pool'
+    thread_name = 'fallback-pool'
+
+    def __init__(self, db_path='movie_ranker.db', refresh_interval=6 * 60 * 60, discover_pages=1,
+                 search_terms=POPULAR_SEARCH_TERMS, results_per_term=2, retry_delay=30, max_retry_delay=15 * 60):
+        super().__init__(db_path, refresh_interval, retry_delay, max_retry_delay)
+        self.discover_pages = discover_pages
+        self.search_terms = search_terms
+        self.results_per_term = results_per_term
+
+    def fetch_candidates(self, client):
+        """Popular movies from TMDB discover, then the top hits for each search term, deduplicated"""
+        candidates = []
+        seen = set()
+        for page in range(1, self.discover_pages + 1):
+            for movie in client.discover_movies(page=page):
+                if movie['id'] not in seen:
+                    seen.add(movie['id'])
+                    candidates.append((movie, 'discover'))
+        for search_term in self.search_terms:
+            for movie in client.search_media(title=search_term)[:self.results_per_term]:
+                if movie['id'] not in seen:
+                    seen.add(movie['id'])
+                    candidates.append((movie, f"search:{search_term}"))
+        return candidates
+
+    def refresh(self, client):
+        """Replace the stored pool with a fresh fetch; returns the number of candidates stored"""
+        candidates = self.fetch_candidates(client)
+        if not candidates:
+            # Keep serving the previous pool when TMDB is unreachable
+            print("Fallback pool refresh returned no candidates, keeping the current pool")
+            return 0
+        database.MovieRankerDB(self.db_path).replace_fallback_candidates(candidates)
+        print(f"Fallback pool refreshed with {len(candidates)} candidates")
+        return len(candidates)
+
+    def refreshed_at(self):
+        return database.MovieRankerDB(self.db_path).get_fallback_refreshed_at()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Synthetic catalog and ratings generator for load and scale testing.
+
+Fills a SQLite file with the app's schema (MovieRankerDB.init_db): movies and
+TV shows with templated overviews, their genres in genre_map, users,
+Zipf-distributed user_movies ratings and chat history. Every user favours one
+niche (a genre's stories about one kind of protagonist), so content-based
+recommendations have something to find; benchmark.py uses the same generator
+and holds some of those liked ratings out.
+
+    python generate_data.py --db load_test.db --movies 500000 --users 200000 --ratings-per-user 25
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+import uuid
+import numpy as np
+import database
+
+# TMDB genre ids, as stored in genre_map
+GENRES = {
+    28: 'Action', 12: 'Adventure', 16: 'Animation', 35: 'Comedy', 80: 'Crime', 99: 'Documentary',
+    18: 'Drama', 10751: 'Family', 14: 'Fantasy', 36: 'History', 27: 'Horror', 10402: 'Music',
+    9648: 'Mystery', 10749: 'Romance', 878: 'Science Fiction', 53: 'Thriller', 10752: 'War', 37: 'Western'
+}
+
+# Per genre: who the story follows, what they are after, and where it happens
+GENRE_STORIES = {
+    28: (['ex-soldier', 'bodyguard', 'getaway driver', 'rogue agent'],
+         ['take down an arms cartel', 'rescue a kidnapped diplomat', 'stop a hijacked train'],
+         ['on the streets of Hong Kong', 'across a war-torn border', 'inside a locked-down skyscraper']),
+    12: (['treasure hunter', 'young explorer', 'ship captain', 'cartographer'],
+         ['find a lost city', 'cross an uncharted ocean', 'recover a stolen relic'],
+         ['deep in the Amazon', 'beyond the northern ice', 'among forgotten islands']),
+    16: (['talking fox', 'little robot', 'curious dragon', 'runaway toy'],
+         ['find the way home', 'save the enchanted forest', 'win the great race'],
+         ['in a kingdom of clouds', 'under the sea', 'in a city of toys']),
+    35: (['hapless groom', 'struggling comedian', 'overworked dad', 'odd couple of roommates'],
+         ['survive a disastrous wedding weekend', 'fake a perfect family holiday', 'win back an ex'],
+         ['in suburban New Jersey', 'at a chaotic summer camp', 'on a cruise gone wrong']),
+    80: (['detective', 'getaway driver', 'crime boss', 'undercover cop'],
+         ['pull off one last heist', 'bring down a crime family', 'solve a string of murders'],
+         ['in 1970s New York', 'in the Chicago underworld', 'on the docks of Marseille']),
+    99: (['filmmaker', 'marine biologist', 'former athlete', 'investigative journalist'],
+         ['uncover the truth behind a scandal', 'document a vanishing species', 'retrace a historic journey'],
+         ['across five continents', 'inside a secretive industry', 'in a remote village']),
+    18: (['grieving widow', 'young teacher', 'estranged son', 'immigrant family'],
+         ['rebuild a broken family', 'fight for justice', 'come to terms with the past'],
+         ['in a small mining town', 'in post-war London', 'in a struggling inner-city school']),
+    10751: (['family of five', 'lonely boy', 'spirited grandmother', 'rescue dog'],
+            ['save the family farm', 'reunite for the holidays', 'win the school talent show'],
+            ['in a snowy mountain town', 'on a cross-country road trip', 'in a sleepy seaside village']),
+    14: (['young wizard', 'exiled princess', 'blacksmith', 'reluctant chosen one'],
+         ['defeat an ancient sorcerer', 'reclaim a stolen throne', 'break a centuries-old curse'],
+         ['in a realm of dragons', 'beyond the enchanted wall', 'in a kingdom on the brink of war']),
+    36: (['queen', 'general', 'scientist', 'resistance leader'],
+         ['change the course of a nation', 'win an impossible campaign', 'defy the church'],
+         ['in Tudor England', 'during the French Revolution', 'in ancient Rome']),
+    27: (['babysitter', 'paranormal investigator', 'young couple', 'group of campers'],
+         ['survive the night', 'escape a cursed house', 'stop a vengeful spirit'],
+         ['in an abandoned asylum', 'in a remote cabin in the woods', 'in a haunted Victorian manor']),
+    10402: (['aspiring singer', 'washed-up rock star', 'jazz pianist', 'garage band'],
+            ['make it to the big stage', 'record one last album', 'win a national competition'],
+            ['in 1960s Memphis', 'on a European tour', 'in the Seattle club scene']),
+    9648: (['amateur sleuth', 'journalist', 'retired inspector', 'insurance investigator'],
+           ['find a missing heiress', 'decode a cryptic message', 'expose a hidden killer'],
+           ['in a fog-bound coastal town', 'aboard a luxury train', 'at an isolated country estate']),
+    10749: (['bookshop owner', 'wedding planner', 'widowed chef', 'pair of pen pals'],
+            ['find love again', 'choose between two suitors', 'win back a first love'],
+            ['in Paris in the spring', 'on a Tuscan vineyard', 'in a snowed-in Vermont inn']),
+    878: (['astronaut', 'android', 'rogue scientist', 'starship crew'],
+          ['make first contact', 'stop a rogue AI', 'save a dying planet'],
+          ['on a distant space station', 'in a dystopian megacity', 'at the edge of the galaxy']),
+    53: (['whistleblower', 'hostage negotiator', 'air traffic controller', 'stalked novelist'],
+         ['expose a government conspiracy', 'stop a bombing', 'outwit a ruthless blackmailer'],
+         ['in a city under lockdown', 'in a high-security prison', 'during a presidential election']),
+    10752: (['platoon', 'field medic', 'fighter pilot', 'codebreaker'],
+            ['hold the bridge', 'get behind enemy lines', 'bring every soldier home'],
+            ['in the trenches of the Somme', 'over the Pacific', 'in occupied France']),
+    37: (['bounty hunter', 'frontier marshal', 'outlaw', 'homesteader'],
+         ['avenge a murdered brother', 'clean up a lawless town', 'drive the herd to market'],
+         ['in the Arizona territory', 'on the Oregon trail', 'along the Mexican border'])
+}
+# Shared words for titles and overviews
+ADJECTIVES = ['Last', 'Silent', 'Broken', 'Golden', 'Hidden', 'Dark', 'Endless', 'Lost', 'Burning', 'Wild',
+              'Crimson', 'Final', 'Forgotten', 'Frozen', 'Secret', 'Savage', 'Distant', 'Electric']
+NOUNS = ['Horizon', 'Empire', 'Road', 'Kingdom', 'Shadow', 'River', 'Promise', 'Storm', 'Legacy', 'Signal',
+         'Frontier', 'Harvest', 'Echo', 'Protocol', 'Covenant', 'Orbit', 'Lullaby', 'Verdict']
+DESCRIPTORS = ['determined', 'reluctant', 'brilliant', 'young', 'retired', 'fearless', 'grieving', 'disgraced']
+OPENINGS = ['When', 'After', 'Just as']
+INCITING = ['a mysterious stranger arrives', 'a fatal accident changes everything', 'a long-buried secret surfaces',
+            'an unexpected inheritance arrives', 'a daring escape goes wrong', 'a chance encounter turns deadly']
+TWISTS = ['Nothing is what it seems.', 'Time is running out.', 'Old loyalties are put to the test.',
+          'The price of victory may be too high.', 'Some secrets refuse to stay buried.',
+          'Only one of them can make it out.']
+
+CHAT_PROMPTS = ['Can you recommend something like {title}?', 'What should I watch tonight?',
+                'I loved {title}, what else would I like?', 'Give me a good {genre} movie.',
+                'Tell me about {title}.', 'Something {genre} but not too long?']
+CHAT_REPLIES = ['Since you enjoyed {title}, you might like another {genre} pick with a similar tone.',
+                'Based on your ratings, {title} is a great choice for tonight.',
+                '{title} is a {genre} title with strong reviews from viewers like you.']
+
+def _movie_rows(rng, first_id, count, tv_share, vote_average, vote_count, popularity):
+    """Movie rows in movies-table column order, their (movie_id, genre_id) rows and niches.
+
+    The first genre picks the story the overview is written from; a title's
+    niche numbers that genre together with the protagonist of its overview.
+
+    vote_average, vote_count and popularity are per-title arrays indexed by movie_id - 1.
+    """
+    genre_ids = list(GENRES)
+    movies, genre_rows, niches = [], [], []
+    for movie_id in range(first_id, first_id + count):
+        genres = rng.sample(genre_ids, rng.choice((1, 1, 2, 2, 3)))
+        heroes, goals, settings = GENRE_STORIES[genres[0]]
+        hero = rng.randrange(len(heroes))
+        overview = (f"{rng.choice(OPENINGS)} {rng.choice(INCITING)}, a {rng.choice(DESCRIPTORS)} "
+                    f"{heroes[hero]} must {rng.choice(goals)} {rng.choice(settings)}. {rng.choice(TWISTS)}")
+        title = f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+        if rng.random() < 0.1:
+            title += f" {rng.randint(2, 4)}"
+        media_type = 'tv' if rng.random() < tv_share else 'movie'
+        release_date = f"{rng.randint(1950, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        movies.append((movie_id, None, None, 'en', title, overview, release_date, vote_average[movie_id - 1],
+                       vote_count[movie_id - 1], popularity[movie_id - 1], media_type))
+        genre_rows.extend((movie_id, genre_id) for genre_id in genres)
+        niches.append(genre_ids.index(genres[0]) * 16 + hero)
+    return movies, genre_rows, niches
+
+def _rating_rows(np_rng, users, popularity_cdf, niche_cdfs, niche, quality, ratings_per_user,
+                 holdout_users=0, taste=0.6):
+    """(user_id, movie_id, rating) rows for a block of consecutive user ids, plus held-out ratings.
+
+    How many titles each user rates is geometric around ratings_per_user, and
+    which titles follows the Zipf popularity distribution (popularity_cdf over
+    movie ids 1..n). Every user favours one niche: a `taste` share of their
+    picks come from it (niche_cdfs maps a niche to its movie ids and their
+    popularity CDF) and they rate its titles higher. Repeat picks of the same
+    title are dropped. For user ids up to holdout_users one liked title of the
+    favourite niche is left out of the rows and returned as {user_id: movie_id}.
+    """
+    niches = np.array(sorted(niche_cdfs))
+    favourite = niches[np_rng.integers(len(niches), size=len(users))]
+    counts = np_rng.geometric(1.0 / max(ratings_per_user, 1), size=len(users))
+    user_ids = np.repeat(users, counts)
+    movie_ids = np.searchsorted(popularity_cdf, np_rng.random(len(user_ids)), side='right') + 1
+    liked_niche = favourite[user_ids - users[0]]
+    from_taste = np_rng.random(len(user_ids)) < taste
+    for niche_id, (niche_movies, niche_cdf) in niche_cdfs.items():
+        picks = from_taste & (liked_niche == niche_id)
+        positions = np.searchsorted(niche_cdf, np_rng.random(int(picks.sum())), side='right')
+        movie_ids[picks] = niche_movies[np.minimum(positions, len(niche_movies) - 1)]
+    movie_ids = np.minimum(movie_ids, len(popularity_cdf))
+    keys = np.unique(user_ids * (len(popularity_cdf) + 1) + movie_ids)
+    user_ids, movie_ids = np.divmod(keys, len(popularity_cdf) + 1)
+    # Each user rates around the title's quality, shifted by their own leniency and taste
+    bias = np_rng.normal(0, 1, size=len(users))
+    noise = np_rng.normal(0, 1.5, size=len(keys))
+    liked = niche[movie_ids - 1] == favourite[user_ids - users[0]]
+    ratings = np.clip(np.rint(quality[movie_ids - 1] + bias[user_ids - users[0]] + noise + np.where(liked, 2, -1)),
+                      1, 10)
+
+    # The first liked title of each held-out user, if they rated more than one title
+    held_out = {}
+    candidates = np.flatnonzero(liked & (ratings >= 7) & (user_ids <= holdout_users))
+    held_users, first = np.unique(user_ids[candidates], return_index=True)
+    rated = np.bincount(user_ids - users[0], minlength=len(users))
+    keep = np.ones(len(keys), dtype=bool)
+    for user_id, row in zip(held_users.tolist(), candidates[first].tolist()):
+        if rated[user_id - users[0]] > 1:
+            held_out[user_id] = int(movie_ids[row])
+            keep[row] = False
+    rows = zip(user_ids[keep].tolist(), movie_ids[keep].tolist(), ratings[keep].tolist())
+    return rows, held_out
+
+def _chat_rows(rng, user_ids, titles, sessions_per_user=2, turns_per_session=3):
+    """chat_history rows (user_id, session_id, role, message) alternating user and assistant turns"""
+    genre_names = list(GENRES.values())
+    for user_id in user_ids:
+        for _ in range(rng.randint(1, sessions_per_user)):
+            session_id = uuid.UUID(int=rng.getrandbits(128)).hex
+            for _ in range(rng.randint(1, turns_per_session)):
+                words = {'title': rng.choice(titles), 'genre': rng.choice(genre_names).lower()}
+                yield (user_id, session_id, 'user', rng.choice(CHAT_PROMPTS).format(**words))
+                yield (user_id, session_id, 'assistant', rng.choice(CHAT_REPLIES).format(**words))
+
+def generate(db_path, n_movies=10000, n_users=1000, ratings_per_user=20, zipf_exponent=1.1, tv_share=0.2,
+             chat_share=0.1, batch_size=50000, seed=0, holdout_users=0, held_out=None):
+    """Fill a new database at db_path with synthetic data; returns the row count of each table.
+
+    Inserts run in large executemany batches inside single transactions with
+    the journal and fsyncs turned off, which only suits scratch databases.
+    With holdout_users, one liked rating of each of the first holdout_users
+    users is left out of the database and written into the held_out dict.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    database.MovieRankerDB(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    # Popularity falls off as 1 / rank ** zipf_exponent; ids are shuffled ranks,
+    # so the most popular titles are spread across the catalog
+    ranks = np_rng.permutation(n_movies) + 1
+    weights = 1.0 / ranks ** zipf_exponent
+    popularity_cdf = np.cumsum(weights) / weights.sum()
+    quality = np.clip(np_rng.normal(6.5, 1.2, n_movies), 1, 10)
+    vote_average = np.round(quality, 1).tolist()
+    vote_count = (weights / weights.sum() * n_users * ratings_per_user * 100).astype(np.int64).tolist()
+    popularity = np.round(weights * 1000, 3).tolist()
+
+    titles = []
+    niche = np.empty(n_movies, dtype=np.int64)
+    with conn:
+        for start in range(0, n_movies, batch_size):
+            movies, genre_rows, niches = _movie_rows(rng, start + 1, min(batch_size, n_movies - start), tv_share,
+                                                     vote_average, vote_count, popularity)
+            niche[start:start + len(movies)] = niches
+            if len(titles) < 1000:
+                titles.extend(movie[4] for movie in movies[:1000 - len(titles)])
+            conn.executemany("INSERT INTO movies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", movies)
+            conn.executemany("INSERT INTO genre_map (movie_id, genre_id) VALUES (?, ?)", genre_rows)
+
+    # Zipf popularity within each niche, for the picks users make from their favourite one
+    niche_cdfs = {}
+    for niche_id in np.unique(niche).tolist():
+        niche_movies = np.flatnonzero(niche == niche_id) + 1
+        niche_weights = weights[niche_movies - 1]
+        niche_cdfs[niche_id] = (niche_movies, np.cumsum(niche_weights) / niche_weights.sum())
+
+    from werkzeug.security import generate_password_hash
+    # Every synthetic user logs in with the password "password"
+    password = generate_password_hash('password')
+    with conn:
+        conn.executemany("INSERT INTO users (id, name, password) VALUES (?, ?, ?)",
+                         ((user_id, f"loadtest{user_id}", password) for user_id in range(1, n_users + 1)))
+        users_per_batch = max(batch_size // max(ratings_per_user, 1), 1)
+        for start in range(1, n_users + 1, users_per_batch):
+            users = np.arange(start, min(start + users_per_batch, n_users + 1))
+            rows, block_held_out = _rating_rows(np_rng, users, popularity_cdf, niche_cdfs, niche, quality,
+                                                ratings_per_user, holdout_users)
+            conn.executemany("INSERT INTO user_movies (user_id, movie_id, rating) VALUES (?, ?, ?)", rows)
+            if held_out is not None:
+                held_out.update(block_held_out)
+        conn.execute("""INSERT INTO user_rating_watermarks (user_id, watermark)
+                        SELECT DISTINCT user_id, 1 FROM user_movies""")
+
+    chat_users = [user_id for user_id in range(1, n_users + 1) if rng.random() < chat_share]
+    with conn:
+        conn.executemany("INSERT INTO chat_history (user_id, session_id, role, message) VALUES (?, ?, ?, ?)",
+                         _chat_rows(rng, chat_users, titles or ['a classic']))
+
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('movies', 'genre_map', 'users', 'user_movies', 'chat_history')}
+    conn.close()
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic movie_ranker database for load testing")
+    parser.add_argument('--db', default='load_test.db', help="SQLite file to create")
+    parser.add_argument('--movies', type=int, default=10000, help="Number of movies and TV shows")
+    parser.add_argument('--users', type=int, default=1000, help="Number of users")
+    parser.add_argument('--ratings-per-user', type=int, default=20, help="Mean ratings per user")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of title popularity")
+    parser.add_argument('--tv-share', type=float, default=0.2, help="Share of titles that are TV shows")
+    parser.add_argument('--chat-share', type=float, default=0.1, help="Share of users with chat history")
+    parser.add_argument('--batch-size', type=int, default=50000, help="Rows per executemany batch")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    parser.add_argument('--overwrite', action='store_true', help="Replace the database if it already exists")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        if not args.overwrite:
+            parser.error(f"{args.db} already exists (pass --overwrite to replace it)")
+        os.remove(args.db)
+    start = time.perf_counter()
+    counts = generate(args.db, n_movies=args.movies, n_users=args.users, ratings_per_user=args.ratings_per_user,
+                      zipf_exponent=args.zipf, tv_share=args.tv_share, chat_share=args.chat_share,
+                      batch_size=args.batch_size, seed=args.seed)
+    summary = ', '.join(f"{count} {table}" for table, count in counts.items())
+    print(f"Generated {summary} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
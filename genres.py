@@ -0,0 +1,54 @@
+import database
+from refresher import PeriodicRefresher
+
+class GenreRefresher(PeriodicRefresher):
+    """Keeps a TMDBClient's genre maps in sync with the locally stored genres table.
+
+    start() loads the stored genres straight away (a database read, no HTTP)
+    and a daemon thread fetches them from TMDB again every refresh_interval
+    seconds, so requests never wait on a genre fetch. While the stored list is
+    fresh the thread reloads the table instead, picking up refreshes made by
+    other processes; a failed fetch is retried with backoff (see PeriodicRefresher).
+    """
+
+    description = 'genres'
+    thread_name = 'genre-refresh'
+
+    def __init__(self, db_path='movie_ranker.db', refresh_interval=24 * 60 * 60, retry_delay=30,
+                 max_retry_delay=15 * 60):
+        super().__init__(db_path, refresh_interval, retry_delay, max_retry_delay)
+
+    def load(self, client):
+        """Copy the stored genres into the client; returns False if none are stored yet"""
+        movie_genres, tv_genres = database.MovieRankerDB(self.db_path).get_genres()
+        if not movie_genres and not tv_genres:
+            return False
+        client.set_genres(movie_genres, tv_genres)
+        return True
+
+    def refresh(self, client):
+        """Fetch the genres from TMDB and store them; returns the number of genres stored"""
+        if not client.fetch_genres():
+            # Keep serving the stored genres when TMDB is unreachable
+            print("Genre refresh failed, keeping the stored genres")
+            return 0
+        database.MovieRankerDB(self.db_path).replace_genres(client.movie_genre_map, client.tv_genre_map)
+        print(f"Genres refreshed: {len(client.movie_genre_map)} movie, {len(client.tv_genre_map)} TV")
+        return len(client.movie_genre_map) + len(client.tv_genre_map)
+
+    def refreshed_at(self):
+        return database.MovieRankerDB(self.db_path).get_genres_refreshed_at()
+
+    def on_fresh(self, client):
+        # Another process may have refreshed the table since we last looked
+        self.load(client)
+
+    def start(self, client):
+        """Load the stored genres and start the background refresh thread (no-op if already running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        try:
+            self.load(client)
+        except Exception as e:
+            print(f"Error loading stored genres: {e}")
+        super().start(client)
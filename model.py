@@ -1,51 +1,648 @@
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
 import sqlite3
 import joblib
+import time
+import copy
+import itertools
+import threading
+import hashlib
+import json
+import os
+import shutil
+import argparse
+import contextlib
+import uuid
+from collections import Counter
+from datetime import datetime
+from cachetools import LRUCache
+from catalog import MovieCatalog, CATALOG_FIELDS, RESULT_FIELDS, movie_content
+
+MOVIE_COLUMNS = ", ".join(CATALOG_FIELDS)
+
+# Ratings run from 1 to 10; a rating's weight in a user profile is its distance from
+# the midpoint, so liked movies pull the profile towards them and disliked ones push away
+RATING_MIDPOINT = 5.5
+
+def rating_weight(rating):
+    return float(rating) - RATING_MIDPOINT
+
+# Every build or incremental update gets a new version number within the process
+_model_versions = itertools.count(1)
+
+# Bump whenever the on-disk artifact layout or the model-building code changes
+ARTIFACT_FORMAT_VERSION = 4
+ARTIFACT_ARRAYS = ['tfidf_data', 'tfidf_indices', 'tfidf_indptr', 'neighbor_indices', 'neighbor_scores']
+
+# File in the artifact directory naming the artifact every serving process should use
+CURRENT_POINTER = 'CURRENT'
+_held_build_locks = threading.local()
+
+def read_current_artifact(artifact_dir):
+    """Name of the artifact the CURRENT pointer names, or None if nothing is published"""
+    try:
+        with open(os.path.join(artifact_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish_artifact(artifact_dir, name):
+    """Point CURRENT at a saved artifact; os.replace makes the switch atomic for readers"""
+    tmp_path = os.path.join(artifact_dir, f".{CURRENT_POINTER}-{os.getpid()}-{threading.get_ident()}")
+    with open(tmp_path, 'w') as f:
+        f.write(name + '\n')
+    os.replace(tmp_path, os.path.join(artifact_dir, CURRENT_POINTER))
+
+@contextlib.contextmanager
+def build_lock(artifact_dir):
+    """Exclusive lock across processes so only one of them builds and publishes at a time.
+
+    Re-entrant within a thread, so code holding the lock can construct models
+    that take it too.
+    """
+    import fcntl
+    os.makedirs(artifact_dir, exist_ok=True)
+    key = os.path.abspath(artifact_dir)
+    held = _held_build_locks.__dict__.setdefault('dirs', set())
+    if key in held:
+        yield
+        return
+    with open(os.path.join(artifact_dir, '.build.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def catalog_fingerprint(conn, model_signature):
+    """Hash the movie rows the model is built from, plus the options it is built with"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'format': ARTIFACT_FORMAT_VERSION, **model_signature}, sort_keys=True).encode())
+    cursor = conn.execute(f"""
+    SELECT {MOVIE_COLUMNS}
+    FROM movies
+    WHERE overview IS NOT NULL AND title IS NOT NULL
+    ORDER BY id
+    """)
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            digest.update(repr(row).encode())
+    return digest.hexdigest()[:16]
+
+def catalog_watermark(conn):
+    """Row count and highest id of the movies table: cheap, but blind to edits of existing rows"""
+    return list(conn.execute("SELECT COUNT(*), MAX(id) FROM movies").fetchone())
+
+def read_artifact_meta(artifact_dir, name):
+    """The meta.json of a saved artifact, or None if there is no such artifact"""
+    try:
+        with open(os.path.join(artifact_dir, name, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
 
 class MovieRecommender:
-    def __init__(self, db_path='movie_ranker.db'):
+    def __init__(self, db_path='movie_ranker.db', n_neighbors=50, chunk_size=256,
+                 rebuild_interval=24 * 60 * 60, drift_threshold=0.2, drift_min_tokens=1000, max_features=5000,
+                 artifact_dir=None, profile_cache_size=10000, cf_weight=0.0,
+                 ann_tables=0, ann_bits=None, ann_probes=1, embedding_dim=None, artifact_name=None,
+                 build_batch_size=5000, stored_neighbors=20):
         self.db_path = db_path
+        # Neighbours per movie written to the movie_neighbors table when a model is
+        # published (see store_changed_neighbors()); building a model never writes it.
+        # unstored_rows lists the rows whose lists changed since then, None for all rows.
+        self.stored_neighbors = stored_neighbors
+        self.unstored_rows = np.empty(0, dtype=np.int64)
+        # Catalog rows fetched per cursor batch while building, see _build_model()
+        self.build_batch_size = build_batch_size
+        # With embedding_dim set, movies are also projected onto that many LSA
+        # (truncated SVD) dimensions as a contiguous float32 matrix with unit-length
+        # rows, and neighbours, profiles and scoring use it instead of TF-IDF
+        self.embedding_dim = embedding_dim
+        self.svd = None
+        self.embeddings = None
+        # With ann_tables > 0 a random-projection LSH index (ann.py) builds the
+        # neighbour lists and supplies candidates for user scoring, instead of
+        # exact cosine over every movie
+        self.ann_tables = ann_tables
+        self.ann_bits = ann_bits
+        self.ann_probes = ann_probes
+        self.ann_index = None
+        # Share of the final score taken from item-item collaborative filtering
+        # (collaborative.py); 0 disables it and uses content similarity only.
+        # The CF model is built on first use, see the collaborative property.
+        self.cf_weight = cf_weight
+        self._collaborative = None
+        self._collaborative_lock = threading.Lock()
+        self.n_neighbors = n_neighbors
+        self.chunk_size = chunk_size
+        self.max_features = max_features
+        # When set, a saved artifact matching the current catalog is loaded instead
+        # of retraining, and freshly built models are saved there; artifact_name
+        # picks a specific saved artifact instead (e.g. the published one)
+        self.artifact_dir = artifact_dir
+        self.artifact_name = None
+        self.fingerprint = None
+        # catalog_watermark() of the database the model was built or last updated from,
+        # saved with the artifact so startup can check it without hashing the catalog
+        self.catalog_watermark = None
+        # A full refit happens when the model is older than rebuild_interval seconds or
+        # when the share of out-of-vocabulary tokens seen by incremental updates passes
+        # drift_threshold; otherwise update_movies() works against the frozen vocabulary.
+        # Drift is only measured once drift_min_tokens tokens have been seen, and only
+        # counts terms seen at least vocabulary_cutoff times (the count of the rarest
+        # term that made the max_features cut), i.e. terms a refit would actually keep.
+        self.rebuild_interval = rebuild_interval
+        self.drift_threshold = drift_threshold
+        self.drift_min_tokens = drift_min_tokens
+        self.vocabulary_cutoff = 1
+        self.built_at = None
+        self.version = None
+        self.oov_counts = Counter()
+        self.seen_tokens = 0
         self.vectorizer = None
         self.tfidf_matrix = None
-        self.title_to_index = None
-        self.similarity_matrix = None
-        self.movies_df = None
-        self._build_model()
-    
-    def _build_model(self):
-        """Build the recommendation model from database data"""
-        print("Building recommendation model from fresh database data...")
-        # Get movies from database
+        # Top-k neighbour index: row i holds the positions and cosine scores of
+        # the n_neighbors titles most similar to movie i (itself excluded).
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+        # Columnar movie metadata (catalog.py); row i is row i of the TF-IDF matrix
+        self.catalog = None
+        # Movie id of every catalog row, for vectorised exclusion masks, and the reverse lookup
+        self.movie_ids = None
+        self.id_to_row = {}
+        # Catalog rows ordered by popularity score (best first), rebuilt with every model
+        # version, plus the same ranking restricted to each media type and each genre
+        self.popular_order = None
+        self.popular_by_media_type = {}
+        self.popular_by_genre = {}
+        # Genres of every catalog row as a uint64 bitset, from genre_map; genre_bit maps
+        # a genre id to its bit. Genre filters become vectorised masks over these.
+        self.genre_bits = None
+        self.genre_bit = {}
+        # Rating-weighted user profile vectors in TF-IDF space, see get_user_profile()
+        self.profile_cache_size = profile_cache_size
+        self.user_profiles = LRUCache(maxsize=profile_cache_size)
+        self._profiles_lock = threading.Lock()
+        if artifact_dir is None:
+            self._build_model()
+        elif artifact_name is not None:
+            if not self._load_artifact(artifact_dir, artifact_name):
+                raise FileNotFoundError(os.path.join(artifact_dir, artifact_name))
+        else:
+            self._load_or_build(artifact_dir)
+
+    def _index_catalog(self):
+        """Refresh the id lookups after the catalog changes; cached profiles belong to the old vectors"""
+        self.movie_ids = self.catalog.ids
+        self.id_to_row = self.catalog.id_to_row
+        self.user_profiles = LRUCache(maxsize=self.profile_cache_size)
+        self._profiles_lock = threading.Lock()
+        self._build_genre_index()
+        self._build_popularity_index()
+
+    def _build_genre_index(self):
+        """Build the per-row genre bitsets from genre_map"""
         conn = sqlite3.connect(self.db_path)
-        query = """
-        SELECT id, title, overview, vote_average, vote_count, popularity, poster_path
+        try:
+            genre_rows = conn.execute("SELECT movie_id, genre_id FROM genre_map").fetchall()
+        except sqlite3.OperationalError:
+            # No genre table yet
+            genre_rows = []
+        finally:
+            conn.close()
+        genre_rows = np.array(genre_rows, dtype=np.int64).reshape(-1, 2)
+        genre_ids = np.unique(genre_rows[:, 1])
+        if len(genre_ids) > 64:
+            print(f"Warning: {len(genre_ids)} genres do not fit a 64-bit genre index, ignoring the rest")
+            genre_ids = genre_ids[:64]
+        self.genre_bit = {genre_id: np.uint64(1) << np.uint64(bit) for bit, genre_id in enumerate(genre_ids.tolist())}
+        genre_bits = np.zeros(len(self.movie_ids), dtype=np.uint64)
+        if len(genre_rows) and len(self.movie_ids):
+            # Map movie ids to catalog rows and genre ids to bits with sorted lookups, not per-row dict gets
+            id_order = np.argsort(self.movie_ids, kind='stable')
+            sorted_ids = np.asarray(self.movie_ids)[id_order]
+            positions = np.minimum(np.searchsorted(sorted_ids, genre_rows[:, 0]), len(sorted_ids) - 1)
+            bits = np.searchsorted(genre_ids, genre_rows[:, 1])
+            known = (sorted_ids[positions] == genre_rows[:, 0]) & (bits < len(genre_ids))
+            np.bitwise_or.at(genre_bits, id_order[positions[known]],
+                             np.left_shift(np.uint64(1), bits[known].astype(np.uint64)))
+        self.genre_bits = genre_bits
+
+    def _genre_bitmask(self, genre_ids):
+        mask = np.uint64(0)
+        for genre_id in genre_ids:
+            mask |= self.genre_bit.get(genre_id, np.uint64(0))
+        return mask
+
+    def genre_filter_mask(self, include_genres=None, exclude_genres=None):
+        """Boolean mask over catalog rows that is True for movies the genre filters rule out.
+
+        A movie passes when it has at least one of include_genres (if any are
+        given) and none of exclude_genres.
+        """
+        filtered = np.zeros(len(self.movie_ids), dtype=bool)
+        if include_genres:
+            filtered |= (self.genre_bits & self._genre_bitmask(include_genres)) == 0
+        if exclude_genres:
+            filtered |= (self.genre_bits & self._genre_bitmask(exclude_genres)) != 0
+        return filtered
+
+    def _build_popularity_index(self):
+        """Rank the catalog by vote_average * vote_count * popularity, overall and per slice"""
+        columns = self.catalog.columns
+        scores = np.nan_to_num(columns['vote_average'] * columns['vote_count'] * columns['popularity'])
+        order = np.argsort(-scores, kind='stable').astype(np.int32)
+        self.popular_order = order
+
+        media_types = columns['media_type'][order]
+        self.popular_by_media_type = {
+            media_type: order[media_types == media_type] for media_type in pd.unique(media_types)
+        }
+        ordered_genres = self.genre_bits[order]
+        self.popular_by_genre = {
+            genre_id: order[(ordered_genres & bit) != 0] for genre_id, bit in self.genre_bit.items()
+        }
+
+    def popularity_ranking(self, media_type=None, genre_id=None):
+        """Catalog rows in popularity order, optionally restricted to a media type and/or genre"""
+        if genre_id is not None:
+            order = self.popular_by_genre.get(genre_id, np.empty(0, dtype=np.int32))
+            if media_type is not None:
+                order = order[self.catalog.columns['media_type'][order] == media_type]
+            return order
+        if media_type is not None:
+            return self.popular_by_media_type.get(media_type, np.empty(0, dtype=np.int32))
+        return self.popular_order
+
+    def model_signature(self):
+        """Options that change what gets built, and so belong in the artifact fingerprint"""
+        return {'n_neighbors': self.n_neighbors, 'max_features': self.max_features,
+                'ann': [self.ann_tables, self.ann_bits, self.ann_probes] if self.ann_tables else None,
+                'embedding_dim': self.embedding_dim}
+
+    def item_vectors(self):
+        """The matrix movies are compared in: SVD embeddings if built, otherwise TF-IDF"""
+        return self.embeddings if self.embeddings is not None else self.tfidf_matrix
+
+    def _fit_embeddings(self):
+        """Fit the truncated SVD projection of the TF-IDF matrix when embedding_dim is set"""
+        self.svd = None
+        self.embeddings = None
+        if not self.embedding_dim:
+            return
+        # TruncatedSVD needs fewer components than there are terms
+        n_components = min(self.embedding_dim, self.tfidf_matrix.shape[1] - 1)
+        if n_components < 1:
+            return
+        self.svd = TruncatedSVD(n_components=n_components, random_state=42)
+        self.svd.fit(self.tfidf_matrix)
+        self.embeddings = self._embed(self.tfidf_matrix)
+        print(f"Projected TF-IDF vectors onto {n_components} SVD dimensions")
+
+    def _embed(self, tfidf_rows):
+        """Project TF-IDF rows with the fitted SVD into L2-normalised float32 rows"""
+        return np.ascontiguousarray(normalize(self.svd.transform(tfidf_rows)), dtype=np.float32)
+
+    def current_fingerprint(self):
+        """Fingerprint of the catalog as it is in the database right now"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return catalog_fingerprint(conn, self.model_signature())
+        finally:
+            conn.close()
+
+    def current_watermark(self):
+        """catalog_watermark() of the database right now"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return catalog_watermark(conn)
+        finally:
+            conn.close()
+
+    def _catalog_batches(self, conn):
+        """Yield the catalog rows in fixed-size cursor batches, ordered by id"""
+        cursor = conn.execute(f"""
+        SELECT {MOVIE_COLUMNS}
         FROM movies 
         WHERE overview IS NOT NULL AND title IS NOT NULL
+        ORDER BY id
+        """)
+        while True:
+            rows = cursor.fetchmany(self.build_batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def _build_model(self):
+        """Build the recommendation model from database data.
+
+        The catalog is streamed from SQLite in build_batch_size batches, twice:
+        the first pass counts terms to pick the max_features most frequent as
+        the vocabulary, the second vectorises against that fixed vocabulary.
+        Only the sparse TF-IDF matrix and the movie metadata are ever held in
+        memory, never the whole table as text plus a concatenated copy.
         """
-        self.movies_df = pd.read_sql_query(query, conn)
-        conn.close()
+        print("Building recommendation model from fresh database data...")
+        # Fingerprint and both passes read the same snapshot in one read transaction
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute("BEGIN")
+        try:
+            self.fingerprint = catalog_fingerprint(conn, self.model_signature())
+            self.catalog_watermark = catalog_watermark(conn)
+            self.artifact_name = self.fingerprint
+            analyzer = TfidfVectorizer(stop_words='english').build_analyzer()
+            term_counts = Counter()
+            n_rows = 0
+            for rows in self._catalog_batches(conn):
+                n_rows += len(rows)
+                for row in rows:
+                    term_counts.update(analyzer(movie_content(row[1], row[2])))
+
+            metadata = []
+            def documents():
+                for rows in self._catalog_batches(conn):
+                    metadata.extend(rows)
+                    for row in rows:
+                        yield movie_content(row[1], row[2])
+
+            if n_rows and term_counts:
+                # Most frequent terms first, ties broken alphabetically for a stable vocabulary
+                terms = sorted(term_counts.items(), key=lambda item: (-item[1], item[0]))[:self.max_features]
+                vocabulary = {term: index for index, term in enumerate(sorted(term for term, _ in terms))}
+                self.vocabulary_cutoff = terms[-1][1] if len(term_counts) > self.max_features else 1
+                del term_counts
+                self.vectorizer = TfidfVectorizer(stop_words='english', vocabulary=vocabulary)
+                self.tfidf_matrix = self.vectorizer.fit_transform(documents())
+            else:
+                metadata = [row for rows in self._catalog_batches(conn) for row in rows]
+        finally:
+            conn.execute("COMMIT")
+            conn.close()
+
+        self.catalog = MovieCatalog.from_rows(metadata)
+        del metadata
+        self._index_catalog()
+        self.built_at = time.time()
+        self.version = next(_model_versions)
+        self.oov_counts = Counter()
+        self.seen_tokens = 0
         
-        if self.movies_df.empty:
+        if not len(self.catalog):
             print("No movies found in database. Please add some movies first.")
             return
         
-        print(f"Loaded {len(self.movies_df)} movies from database")
-        
-        # Create content for vectorization
-        self.movies_df['content'] = self.movies_df['title'] + ' ' + self.movies_df['overview'].fillna('')
+        print(f"Loaded {len(self.catalog)} movies from database")
+        self._fit_embeddings()
         
-        # Create TF-IDF vectors
-        self.vectorizer = TfidfVectorizer(stop_words='english', max_features=5000)
-        self.tfidf_matrix = self.vectorizer.fit_transform(self.movies_df['content'])
-        
-        # Create title to index mapping
-        self.title_to_index = pd.Series(self.movies_df.index, index=self.movies_df['title']).drop_duplicates()
-        
-        # Calculate similarity matrix
-        self.similarity_matrix = cosine_similarity(self.tfidf_matrix)
+        # Keep only the top-k neighbours of each title instead of the dense N x N matrix
+        if self.ann_tables > 0:
+            from ann import RandomProjectionLSH
+            self.ann_index = RandomProjectionLSH(self.ann_tables, self.ann_bits, self.ann_probes).fit(self.item_vectors())
+            k = min(self.n_neighbors, len(self.catalog) - 1)
+            self.neighbor_indices, self.neighbor_scores = self.ann_index.neighbor_index(max(k, 0), self.chunk_size)
+        else:
+            self.ann_index = None
+            self.neighbor_indices, self.neighbor_scores = self._build_neighbor_index(self.item_vectors())
+        self.unstored_rows = None
+        # Rebuilt from the ratings table on first use
+        self._collaborative = None
         print("Model built successfully!")
+
+    def _build_neighbor_index(self, matrix):
+        """Compute the top-k most similar rows for every row of an L2-normalised matrix.
+
+        Similarities are computed one block of rows at a time so memory stays
+        O(chunk_size * N + N * k) instead of O(N^2).
+        """
+        n_movies = matrix.shape[0]
+        k = min(self.n_neighbors, n_movies - 1)
+        neighbor_indices = np.empty((n_movies, max(k, 0)), dtype=np.int32)
+        neighbor_scores = np.empty((n_movies, max(k, 0)), dtype=np.float32)
+        if k <= 0:
+            return neighbor_indices, neighbor_scores
+
+        matrix_t = self._transpose(matrix)
+        for start in range(0, n_movies, self.chunk_size):
+            end = min(start + self.chunk_size, n_movies)
+            rows = np.arange(start, end)
+            block = self._similarity_block(matrix[rows], matrix_t, rows)
+            neighbor_indices[start:end], neighbor_scores[start:end] = self._top_k(block, k)
+
+        return neighbor_indices, neighbor_scores
+
+    @staticmethod
+    def _transpose(matrix):
+        """Transpose laid out for row-block products: CSC for sparse, contiguous for dense"""
+        return matrix.T.tocsc() if sp.issparse(matrix) else np.ascontiguousarray(matrix.T)
+
+    @staticmethod
+    def _similarity_block(rows_matrix, matrix_t, positions):
+        """Dense float32 cosine scores of some rows against every movie, self-matches masked out"""
+        block = rows_matrix @ matrix_t
+        block = block.toarray() if hasattr(block, 'toarray') else np.asarray(block)
+        block = block.astype(np.float32, copy=False)
+        # Never list a movie as its own neighbour
+        block[np.arange(len(positions)), positions] = -np.inf
+        return block
+
+    @staticmethod
+    def _top_k(scores, k, candidates=None):
+        """Pick the k best columns of each row, ordered by descending score"""
+        top = np.argpartition(scores, -k, axis=1)[:, -k:]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        if candidates is not None:
+            top = np.take_along_axis(candidates, top, axis=1)
+        return top, np.take_along_axis(top_scores, order, axis=1)
+
+    def store_neighbors(self, rows=None):
+        """Write the top stored_neighbors neighbours of catalog rows to the movie_neighbors table.
+
+        Replaces the table for a full build (rows=None), or just the given rows'
+        lists after an incremental update, in one transaction.
+        """
+        import database
+        database.MovieRankerDB(self.db_path)
+        replace_all = rows is None
+        rows = np.arange(len(self.movie_ids)) if replace_all else np.asarray(rows, dtype=np.int64)
+        k = min(self.stored_neighbors, self.neighbor_indices.shape[1])
+        indices = np.asarray(self.neighbor_indices[rows, :k])
+        scores = np.asarray(self.neighbor_scores[rows, :k])
+        valid = (indices >= 0) & (scores > 0)
+        movie_ids = np.repeat(self.movie_ids[rows], valid.sum(axis=1)).tolist()
+        ranks = np.broadcast_to(np.arange(k), indices.shape)[valid].tolist()
+        neighbor_ids = self.movie_ids[indices[valid]].tolist()
+        records = zip(movie_ids, ranks, neighbor_ids, scores[valid].astype(float).tolist())
+
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        with conn:
+            if replace_all:
+                conn.execute("DELETE FROM movie_neighbors")
+            else:
+                conn.executemany("DELETE FROM movie_neighbors WHERE movie_id = ?",
+                                 [(movie_id,) for movie_id in self.movie_ids[rows].tolist()])
+            conn.executemany(
+                "INSERT INTO movie_neighbors (movie_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)", records
+            )
+        conn.close()
+
+    def store_changed_neighbors(self):
+        """Write the neighbour lists built or updated since they were last stored (see store_neighbors())"""
+        if self.movie_ids is None or not len(self.movie_ids):
+            return
+        if self.unstored_rows is not None and not len(self.unstored_rows):
+            return
+        self.store_neighbors(self.unstored_rows)
+        self.unstored_rows = np.empty(0, dtype=np.int64)
+
+    def needs_full_rebuild(self):
+        """True once the scheduled refit is due or the vocabulary has drifted too far"""
+        if self.vectorizer is None or self.built_at is None:
+            return True
+        if time.time() - self.built_at >= self.rebuild_interval:
+            return True
+        return self.vocabulary_drift() > self.drift_threshold
+
+    def vocabulary_drift(self):
+        """Share of tokens seen by incremental updates whose terms a refit would add to the vocabulary"""
+        if not self.seen_tokens or self.seen_tokens < self.drift_min_tokens:
+            return 0.0
+        oov_tokens = sum(count for count in self.oov_counts.values() if count >= self.vocabulary_cutoff)
+        return oov_tokens / self.seen_tokens
+
+    def update_movies(self, movie_ids):
+        """Add or refresh specific movies without refitting the vectorizer.
+
+        New and changed movies are vectorised with the frozen vocabulary, their
+        neighbour lists are recomputed, and every other movie's list is patched
+        where one of the changed movies now belongs in its top-k. Falls back to
+        force_rebuild() when a full refit is due.
+        """
+        movie_ids = list(dict.fromkeys(movie_ids))
+        if not movie_ids:
+            return
+        if self.catalog is None or not len(self.catalog) or self.needs_full_rebuild():
+            self.force_rebuild()
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        placeholders = ', '.join('?' for _ in movie_ids)
+        query = f"""
+        SELECT {MOVIE_COLUMNS}
+        FROM movies
+        WHERE overview IS NOT NULL AND title IS NOT NULL AND id IN ({placeholders})
+        """
+        rows = conn.execute(query, movie_ids).fetchall()
+        watermark = catalog_watermark(conn)
+        conn.close()
+
+        # Skip movies whose text has not changed since they were vectorised
+        changed_rows, existing, contents = [], [], []
+        for row in rows:
+            position = self.catalog.row_of(row[0])
+            content = movie_content(row[1], row[2])
+            if position is not None and self.catalog.content(position) == content:
+                continue
+            changed_rows.append(row)
+            existing.append(-1 if position is None else position)
+            contents.append(content)
+        existing = np.array(existing, dtype=np.int64)
+        if not changed_rows:
+            return
+
+        n_old = len(self.catalog)
+        n_new = n_old + int((existing < 0).sum())
+        if self.neighbor_indices.shape[1] < min(self.n_neighbors, n_new - 1):
+            # The catalog has outgrown the neighbour lists built for a tiny catalog
+            self.force_rebuild()
+            return
+
+        analyzer = self.vectorizer.build_analyzer()
+        # A fresh Counter, as the model this one was copied from may still be serving
+        oov_counts = self.oov_counts.copy()
+        for content in contents:
+            tokens = analyzer(content)
+            self.seen_tokens += len(tokens)
+            oov_counts.update(token for token in tokens if token not in self.vectorizer.vocabulary_)
+        self.oov_counts = oov_counts
+        if self.vocabulary_drift() > self.drift_threshold:
+            print(f"Vocabulary drift {self.vocabulary_drift():.2f} exceeds threshold, refitting model")
+            self.force_rebuild()
+            return
+
+        print(f"Incrementally updating model with {len(changed_rows)} movies...")
+        new_vectors = self.vectorizer.transform(contents)
+
+        # Replaced movies keep their row, new movies are appended at the end
+        changed_positions = existing.copy()
+        changed_positions[existing < 0] = np.arange(n_old, n_new)
+        row_source = np.arange(n_new)
+        row_source[changed_positions] = n_old + np.arange(len(changed_rows))
+        tfidf_matrix = sp.vstack([self.tfidf_matrix, new_vectors]).tocsr()[row_source]
+        embeddings = None
+        if self.embeddings is not None:
+            embeddings = np.vstack([self.embeddings, self._embed(new_vectors)])[row_source]
+        item_vectors = embeddings if embeddings is not None else tfidf_matrix
+
+        catalog = self.catalog.with_rows(changed_rows, changed_positions.tolist())
+
+        # Neighbour lists of the changed movies are recomputed against the whole catalog
+        k = self.neighbor_indices.shape[1]
+        block = self._similarity_block(item_vectors[changed_positions], self._transpose(item_vectors), changed_positions)
+        neighbor_indices = np.empty((n_new, k), dtype=np.int32)
+        neighbor_scores = np.empty((n_new, k), dtype=np.float32)
+        neighbor_indices[:n_old] = self.neighbor_indices
+        neighbor_scores[:n_old] = self.neighbor_scores
+
+        # Other movies only change where a changed movie enters or leaves their top-k.
+        # This is exact for additions; a changed movie dropping out of a list is not
+        # backfilled beyond the stored k candidates until the next full refit.
+        others = np.setdiff1d(np.arange(n_new), changed_positions)
+        old_lists = neighbor_indices[others]
+        old_scores = neighbor_scores[others].copy()
+        stale = np.isin(old_lists, changed_positions)
+        new_scores = block[:, others].T
+        affected = stale.any(axis=1) | (new_scores.max(axis=1) > old_scores[:, -1])
+        rows = np.empty(0, dtype=np.int64)
+        if affected.any():
+            old_scores[stale] = -np.inf
+            candidates = np.hstack([
+                old_lists[affected],
+                np.broadcast_to(changed_positions, (int(affected.sum()), len(changed_positions)))
+            ])
+            scores = np.hstack([old_scores[affected], new_scores[affected]])
+            rows = others[affected]
+            neighbor_indices[rows], neighbor_scores[rows] = self._top_k(scores, k, candidates)
+
+        neighbor_indices[changed_positions], neighbor_scores[changed_positions] = self._top_k(block, k)
+
+        self.catalog = catalog
+        self._index_catalog()
+        self.tfidf_matrix = tfidf_matrix
+        self.embeddings = embeddings
+        if self.ann_index is not None:
+            self.ann_index = self.ann_index.with_rows(item_vectors, changed_positions)
+        self.neighbor_indices = neighbor_indices
+        self.neighbor_scores = neighbor_scores
+        if self.unstored_rows is not None:
+            self.unstored_rows = np.union1d(self.unstored_rows, np.concatenate([changed_positions, rows]))
+        self.catalog_watermark = watermark
+        self.version = next(_model_versions)
+        # The model no longer corresponds to a full build of any catalog snapshot
+        self.fingerprint = None
+        self.artifact_name = f"update-{uuid.uuid4().hex[:16]}"
+        print("Incremental model update completed!")
     
     def get_user_rated_movies(self, user_id):
         """Get movies rated by a specific user"""
@@ -75,36 +672,170 @@ class MovieRecommender:
         conn.close()
         return user_movies
     
-    def recommend_for_user(self, user_id, top_n=10, random_seed=None):
-        """Generate recommendations for a specific user based on their ratings"""
+    def load_user_ratings(self, user_id):
+        """All of a user's ratings as {movie_id: rating}"""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT movie_id, rating FROM user_movies WHERE user_id = ?", (user_id,)).fetchall()
+        conn.close()
+        return {movie_id: rating for movie_id, rating in rows}
+
+    def get_user_profile(self, user_id, watermark=None):
+        """Return the user's cached rating-weighted profile, building it if needed.
+
+        The profile is the sum of each rated movie's item vector times
+        rating_weight(rating), keyed by movie id, so scoring the user is a single
+        product (score_profile). A cached profile is reused unless the
+        caller passes a rating watermark it was not built at.
+        """
+        with self._profiles_lock:
+            profile = self.user_profiles.get(user_id)
+        if profile is not None and (watermark is None or profile['watermark'] == watermark):
+            return profile
+        profile = self._build_profile(self.load_user_ratings(user_id), watermark)
+        with self._profiles_lock:
+            self.user_profiles[user_id] = profile
+        return profile
+
+    def _build_profile(self, ratings, watermark=None):
+        rated = [(self.id_to_row[movie_id], rating_weight(rating))
+                 for movie_id, rating in ratings.items() if movie_id in self.id_to_row]
+        rows = [row for row, _ in rated]
+        weights = np.array([weight for _, weight in rated])
+        profile = {'ratings': dict(ratings), 'watermark': watermark, 'vector': None,
+                   'positive_weight': 0.0, 'total_weight': 0.0}
+        if rows and self.tfidf_matrix is not None:
+            weighted = sp.csr_matrix((weights, (np.zeros(len(rows), dtype=np.int64), rows)),
+                                     shape=(1, len(self.movie_ids)))
+            profile['vector'] = self._profile_vector(weighted @ self.item_vectors())
+            profile['positive_weight'] = float(weights[weights > 0].sum())
+            profile['total_weight'] = float(np.abs(weights).sum())
+        return profile
+
+    @staticmethod
+    def _profile_vector(vector):
+        """Profiles are 1 x d rows: CSR in TF-IDF space, a float32 array in embedding space"""
+        if sp.issparse(vector):
+            return vector.tocsr()
+        return np.asarray(vector, dtype=np.float32).reshape(1, -1)
+
+    @property
+    def collaborative(self):
+        """The item-item CF model (None when cf_weight is 0), built from user_movies on first use"""
+        return self.load_collaborative()
+
+    def load_collaborative(self):
+        """Build the CF model now if it is enabled and not built yet; returns it"""
+        if self._collaborative is None and self.cf_weight > 0:
+            with self._collaborative_lock:
+                if self._collaborative is None:
+                    from collaborative import CollaborativeRecommender
+                    self._collaborative = CollaborativeRecommender(self.db_path, n_neighbors=self.n_neighbors)
+        return self._collaborative
+
+    def share_collaborative(self, other):
+        """Reuse another model's CF model when both come from the same full build.
+
+        CF depends on the ratings only, and incremental updates keep built_at,
+        so models published by update_movies() need not re-read every rating.
+        A full rebuild starts a fresh CF model, picking up ratings other
+        processes have added since.
+        """
+        if other is not None and other is not self and other.built_at == self.built_at:
+            self._collaborative = other._collaborative
+
+    def blend_scores(self, content_scores, ratings):
+        """Mix collaborative-filtering scores for the given ratings into content scores"""
+        if self.collaborative is None:
+            return content_scores
+        cf_ids, cf_scores = self.collaborative.score_ratings(ratings)
+        rows = np.array([self.id_to_row.get(movie_id, -1) for movie_id in cf_ids.tolist()], dtype=np.int64)
+        in_catalog = rows >= 0
+        blended = (1 - self.cf_weight) * content_scores
+        blended[rows[in_catalog]] += self.cf_weight * cf_scores[in_catalog]
+        return blended
+
+    def update_user_rating(self, user_id, movie_id, rating, watermark=None):
+        """Fold one rating change (rating=None for a removal) into a cached profile"""
+        # A CF model built later reads the rating from the database
+        if self._collaborative is not None:
+            self._collaborative.add_rating(user_id, movie_id, rating)
+        with self._profiles_lock:
+            profile = self.user_profiles.get(user_id)
+            if profile is None:
+                # Built lazily with the new rating on the next request
+                return
+            ratings = dict(profile['ratings'])
+            old_rating = ratings.pop(movie_id, None)
+            if rating is not None:
+                ratings[movie_id] = rating
+            updated = dict(profile, ratings=ratings, watermark=watermark)
+            row = self.id_to_row.get(movie_id)
+            if row is not None:
+                old_weight = rating_weight(old_rating) if old_rating is not None else 0.0
+                new_weight = rating_weight(rating) if rating is not None else 0.0
+                delta = (new_weight - old_weight) * self.item_vectors()[row]
+                updated['vector'] = self._profile_vector(delta if profile['vector'] is None else profile['vector'] + delta)
+                updated['positive_weight'] += max(new_weight, 0.0) - max(old_weight, 0.0)
+                updated['total_weight'] += abs(new_weight) - abs(old_weight)
+            self.user_profiles[user_id] = updated
+
+    def score_profile(self, profile):
+        """Cosine-style score of every catalog movie against a user profile.
+
+        With embeddings this is a single dense float32 matrix-vector product. With
+        an ANN index only the candidate movies it returns are scored; the rest
+        score 0.
+        """
+        items = self.item_vectors()
+        if self.ann_index is None:
+            scores = self._matvec(items, profile['vector'])
+        else:
+            rows = self.ann_index.candidates(profile['vector'])
+            scores = np.zeros(len(self.movie_ids))
+            scores[rows] = self._matvec(items[rows], profile['vector'])
+        return scores / max(profile['total_weight'], 1e-9)
+
+    @staticmethod
+    def _matvec(matrix, vector):
+        """Scores of every row of an item matrix against one 1 x d profile vector"""
+        if sp.issparse(matrix):
+            return (matrix @ vector.T).toarray().ravel()
+        return matrix @ vector.ravel()
+
+    def recommend_for_user(self, user_id, top_n=10, random_seed=None, watermark=None,
+                           include_genres=None, exclude_genres=None):
+        """Generate recommendations for a specific user based on their ratings.
+
+        include_genres / exclude_genres (TMDB genre ids) restrict every source of
+        results, see genre_filter_mask().
+        """
+        genre_filters = {'include_genres': include_genres, 'exclude_genres': exclude_genres}
         print(f"Debug: Getting recommendations for user {user_id}")
-        user_movies = self.get_user_rated_movies(user_id)
-        print(f"Debug: Found {len(user_movies)} rated movies for user")
+        profile = self.get_user_profile(user_id, watermark)
         
         # Get ALL movies the user has rated (to exclude them from recommendations)
-        all_rated_movies = self.get_user_all_rated_movies(user_id)
-        rated_movie_ids = set(all_rated_movies['id'].tolist())
+        rated_movie_ids = set(profile['ratings'])
         print(f"Debug: User has rated {len(rated_movie_ids)} movies total (to exclude from recommendations)")
         
-        if user_movies.empty:
-            print("Debug: User has no ratings, returning popular movies")
+        if profile['vector'] is None or profile['positive_weight'] <= 0:
+            print("Debug: User has no liked movies in the model, returning popular movies")
             # If user has no ratings, return popular movies
-            popular = self.get_popular_movies(top_n, random_seed=random_seed)
+            popular = self.get_popular_movies(top_n, rated_movie_ids, random_seed=random_seed, **genre_filters)
             print(f"Debug: Returning {len(popular)} popular movies")
             return popular
         
-        # Get titles of user's highly rated movies
-        user_titles = user_movies['title'].tolist()
-        print(f"Debug: User's highly rated movies: {user_titles}")
-        
-        # Get recommendations based on user's movies
-        recommendations = self.recommend(user_titles, top_n, rated_movie_ids, random_seed=random_seed)
+        # Get recommendations based on the user's rating-weighted profile
+        scores = self.blend_scores(self.score_profile(profile), profile['ratings'])
+        excluded = self.exclusion_mask(rated_movie_ids)
+        if include_genres or exclude_genres:
+            excluded |= self.genre_filter_mask(include_genres, exclude_genres)
+        recommendations = self._pick_recommendations(scores, excluded, top_n, random_seed)
         print(f"Debug: Generated {len(recommendations)} recommendations")
         
         # If we don't have enough recommendations, add popular movies (excluding rated)
         if len(recommendations) < top_n:
             print(f"Debug: Only got {len(recommendations)} recommendations, adding popular movies")
-            popular_movies = self.get_popular_movies(top_n * 2, rated_movie_ids, random_seed=random_seed)  # Get more popular movies, excluding rated
+            popular_movies = self.get_popular_movies(top_n * 2, rated_movie_ids, random_seed=random_seed, **genre_filters)  # Get more popular movies, excluding rated
             
             # Filter out movies that are already in recommendations
             existing_ids = {rec['id'] for rec in recommendations}
@@ -115,154 +846,12 @@ class MovieRecommender:
             recommendations.extend(new_popular[:needed])
             print(f"Debug: Added {min(needed, len(new_popular))} popular movies, total: {len(recommendations)}")
         
-        # If still not enough recommendations, fetch popular movies from TMDB API
+        # If still not enough, top up from the cold-start pool that fallback.py keeps fresh
         if len(recommendations) < top_n:
-            print(f"Debug: Still only got {len(recommendations)} recommendations, fetching from TMDB API")
-            try:
-                from search import TMDBClient
-                import os
-                from dotenv import load_dotenv
-                
-                load_dotenv()
-                api_key = os.getenv("TMDB_API_KEY")
-                if api_key:
-                    tmdb_client = TMDBClient(api_key=api_key)
-                    # Fetch popular movies from TMDB
-                    tmdb_movies = tmdb_client.discover_movies(page=1)
-                    
-                    # Filter out movies already in database and user's rated movies
-                    existing_ids = {rec['id'] for rec in recommendations}
-                    new_tmdb_movies = []
-                    
-                    for movie in tmdb_movies:
-                        if movie['id'] not in existing_ids and movie['id'] not in rated_movie_ids:
-                            # Convert TMDB format to our format
-                            new_movie = {
-                                'id': movie['id'],
-                                'title': movie['title'],
-                                'overview': movie.get('overview', ''),
-                                'vote_average': movie.get('vote_average', 0),
-                                'vote_count': movie.get('vote_count', 0),
-                                'popularity': movie.get('popularity', 0),
-                                'poster_path': movie.get('poster_path', '')
-                            }
-                            new_tmdb_movies.append(new_movie)
-                    
-                    # Add enough to reach top_n
-                    needed = top_n - len(recommendations)
-                    recommendations.extend(new_tmdb_movies[:needed])
-                    print(f"Debug: Added {min(needed, len(new_tmdb_movies))} TMDB movies, total: {len(recommendations)}")
-                    
-                    # Add these movies to the database for future use
-                    import database
-                    db = database.MovieRankerDB()
-                    for movie in new_tmdb_movies[:needed]:
-                        movie_data = {
-                            'id': movie['id'],
-                            'title': movie['title'],
-                            'overview': movie['overview'],
-                            'vote_average': movie['vote_average'],
-                            'vote_count': movie['vote_count'],
-                            'popularity': movie['popularity'],
-                            'poster_path': movie['poster_path'],
-                            'release_date': movie.get('release_date'),
-                            'original_language': movie.get('original_language', 'en'),
-                            'media_type': 'movie'
-                        }
-                        db.add_media(movie_data)
-                    print(f"Debug: Added {min(needed, len(new_tmdb_movies))} movies to database")
-                    
-                    # Also search for specific popular movies like Avengers and Batman
-                    popular_search_terms = ['Avengers', 'Batman', 'Spider-Man', 'Iron Man', 'Captain America', 'Wonder Woman']
-                    for search_term in popular_search_terms:
-                        try:
-                            search_results = tmdb_client.search_media(title=search_term)
-                            for movie in search_results[:2]:  # Get top 2 results for each search
-                                if movie['id'] not in existing_ids and movie['id'] not in rated_movie_ids:
-                                    # Convert TMDB format to our format
-                                    new_movie = {
-                                        'id': movie['id'],
-                                        'title': movie['title'],
-                                        'overview': movie.get('overview', ''),
-                                        'vote_average': movie.get('vote_average', 0),
-                                        'vote_count': movie.get('vote_count', 0),
-                                        'popularity': movie.get('popularity', 0),
-                                        'poster_path': movie.get('poster_path', ''),
-                                        'media_type': movie.get('media_type', 'movie')
-                                    }
-                                    
-                                    # Add to recommendations if we still need more
-                                    if len(recommendations) < top_n:
-                                        recommendations.append(new_movie)
-                                        existing_ids.add(movie['id'])
-                                    
-                                    # Add to database
-                                    movie_data = {
-                                        'id': movie['id'],
-                                        'title': movie['title'],
-                                        'overview': movie.get('overview', ''),
-                                        'vote_average': movie.get('vote_average', 0),
-                                        'vote_count': movie.get('vote_count', 0),
-                                        'popularity': movie.get('popularity', 0),
-                                        'poster_path': movie.get('poster_path', ''),
-                                        'release_date': movie.get('release_date'),
-                                        'original_language': movie.get('original_language', 'en'),
-                                        'media_type': movie.get('media_type', 'movie')
-                                    }
-                                    db.add_media(movie_data)
-                        except Exception as e:
-                            print(f"Debug: Error searching for {search_term}: {e}")
-                    
-                    print(f"Debug: Final recommendations after adding popular movies: {len(recommendations)}")
-                    
-                    # Ensure all recommended movies are in the database
-                    self._ensure_movies_in_database(recommendations)
-                    
-                    # Also search for specific popular movies like Avengers and Batman
-                    popular_search_terms = ['Avengers', 'Batman', 'Spider-Man', 'Iron Man', 'Captain America', 'Wonder Woman']
-                    for search_term in popular_search_terms:
-                        try:
-                            search_results = tmdb_client.search_media(title=search_term)
-                            for movie in search_results[:2]:  # Get top 2 results for each search
-                                if movie['id'] not in existing_ids and movie['id'] not in rated_movie_ids:
-                                    # Convert TMDB format to our format
-                                    new_movie = {
-                                        'id': movie['id'],
-                                        'title': movie['title'],
-                                        'overview': movie.get('overview', ''),
-                                        'vote_average': movie.get('vote_average', 0),
-                                        'vote_count': movie.get('vote_count', 0),
-                                        'popularity': movie.get('popularity', 0),
-                                        'poster_path': movie.get('poster_path', ''),
-                                        'media_type': movie.get('media_type', 'movie')
-                                    }
-                                    
-                                    # Add to recommendations if we still need more
-                                    if len(recommendations) < top_n:
-                                        recommendations.append(new_movie)
-                                        existing_ids.add(movie['id'])
-                                    
-                                    # Add to database
-                                    movie_data = {
-                                        'id': movie['id'],
-                                        'title': movie['title'],
-                                        'overview': movie.get('overview', ''),
-                                        'vote_average': movie.get('vote_average', 0),
-                                        'vote_count': movie.get('vote_count', 0),
-                                        'popularity': movie.get('popularity', 0),
-                                        'poster_path': movie.get('poster_path', ''),
-                                        'release_date': movie.get('release_date'),
-                                        'original_language': movie.get('original_language', 'en'),
-                                        'media_type': movie.get('media_type', 'movie')
-                                    }
-                                    db.add_media(movie_data)
-                        except Exception as e:
-                            print(f"Debug: Error searching for {search_term}: {e}")
-                    
-                    print(f"Debug: Final recommendations after adding popular movies: {len(recommendations)}")
-                    
-            except Exception as e:
-                print(f"Debug: Error fetching from TMDB API: {e}")
+            existing_ids = rated_movie_ids | {rec['id'] for rec in recommendations}
+            pool_movies = self.get_fallback_candidates(top_n - len(recommendations), existing_ids, **genre_filters)
+            recommendations.extend(pool_movies)
+            print(f"Debug: Added {len(pool_movies)} cold-start pool movies, total: {len(recommendations)}")
         
         # Final check: if we have fewer than requested, that's okay (limited database)
         if len(recommendations) < top_n:
@@ -272,49 +861,48 @@ class MovieRecommender:
     
     def recommend(self, saved_titles, top_n=5, exclude_movie_ids=None, random_seed=None):
         """Recommend movies based on a list of movie titles"""
-        if self.similarity_matrix is None:
-            print("Debug: No similarity matrix available")
+        if self.neighbor_indices is None:
+            print("Debug: No neighbour index available")
             return []
         
         # Find indices of the input movies
         indices = []
         for title in saved_titles:
-            if title in self.title_to_index:
-                indices.append(self.title_to_index[title])
+            if title in self.catalog.title_to_row:
+                indices.append(self.catalog.title_to_row[title])
         
-        print(f"Debug: Found {len(indices)} movies in similarity matrix")
+        print(f"Debug: Found {len(indices)} movies in neighbour index")
         
         if not indices:
-            print("Debug: No matching movies found in similarity matrix")
+            print("Debug: No matching movies found in neighbour index")
             return []
 
-        # Calculate average similarity scores
-        avg_scores = sum(self.similarity_matrix[i] for i in indices) / len(indices)
-        
-        # Get top similar movies (excluding the input movies AND user's rated movies)
-        ranked = sorted(list(enumerate(avg_scores)), key=lambda x: x[1], reverse=True)
+        # Calculate average similarity scores over the neighbour lists of the input movies
+        neighbors = self.neighbor_indices[indices].ravel()
+        valid = neighbors >= 0  # ANN-built lists may be padded with -1
+        avg_scores = np.bincount(
+            neighbors[valid],
+            weights=self.neighbor_scores[indices].ravel()[valid],
+            minlength=len(self.catalog)
+        ) / len(indices)
         
         # Filter out both input movies and user's rated movies
-        if exclude_movie_ids:
-            all_candidates = []
-            for idx, score in ranked:
-                if idx not in indices:
-                    # Get the movie ID for this index
-                    movie_id = self.movies_df.iloc[idx]['id']
-                    if movie_id not in exclude_movie_ids:
-                        all_candidates.append(idx)
-        else:
-            all_candidates = [i for i, score in ranked if i not in indices]
-        
-        print(f"Debug: Found {len(all_candidates)} candidate movies (excluding rated)")
+        excluded = self.exclusion_mask(exclude_movie_ids)
+        excluded[indices] = True
+        return self._pick_recommendations(avg_scores, excluded, top_n, random_seed)
+
+    def _pick_recommendations(self, scores, excluded, top_n, random_seed=None):
+        """Sample top_n of the best 3 * top_n non-excluded movies and return their details"""
+        available = len(excluded) - int(excluded.sum())
+        print(f"Debug: Found {available} candidate movies (excluding rated)")
         
         # If no unrated candidates, we can't recommend anything (don't include rated movies)
-        if not all_candidates:
+        if not available:
             print("Debug: No unrated candidates available - user has rated all similar movies")
             return []
         
         # Get more candidates than needed for randomization
-        recommendations = all_candidates[:min(top_n * 3, len(all_candidates))]
+        recommendations = self.top_candidates(scores, excluded, top_n * 3).tolist()
         
         # Add some randomization to ensure variety
         import random
@@ -326,41 +914,229 @@ class MovieRecommender:
         print(f"Debug: Selected {len(recommendations)} movies for recommendations")
         
         # Return recommended movies with additional info
-        recommended_movies = self.movies_df.iloc[recommendations][['id', 'title', 'overview', 'vote_average', 'vote_count', 'popularity', 'poster_path']]
-        return recommended_movies.to_dict(orient='records')
+        return self._movie_records(recommendations)
+
+    def _movie_records(self, rows):
+        """Result dicts for the given catalog rows"""
+        return self.catalog.records(rows)
     
-    def get_popular_movies(self, top_n=10, exclude_movie_ids=None, random_seed=None):
-        """Get popular movies based on vote_average and vote_count"""
+    def batch_recommend(self, top_n=20, chunk_size=1000, shard=0, num_shards=1):
+        """Precompute recommendations for every user with ratings into user_recommendations.
+
+        Users are scored a chunk at a time: a (users x movies) matrix of rating
+        weights times the item matrix (TF-IDF or embeddings) gives the user-profile matrix, and profiles
+        times the transposed item matrix gives the scores, the same as
+        recommend_for_user() computes one user at a time. Rated movies are masked
+        out before picking the top_n. Only users with
+        user_id % num_shards == shard are processed, so shards can run in separate
+        processes. Returns the number of users written.
+        """
+        import database
+        if self.tfidf_matrix is None or not len(self.movie_ids):
+            print("No model available for batch recommendations")
+            return 0
+        database.MovieRankerDB(self.db_path)
+
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        ratings = pd.read_sql_query(
+            "SELECT user_id, movie_id, rating FROM user_movies WHERE user_id % ? = ? ORDER BY user_id",
+            conn, params=(num_shards, shard)
+        )
+        ratings['row'] = pd.Index(self.movie_ids).get_indexer(ratings['movie_id'])
+        ratings = ratings[ratings['row'] >= 0]
+        if ratings.empty:
+            conn.close()
+            return 0
+
+        user_ids, user_positions = np.unique(ratings['user_id'].to_numpy(), return_inverse=True)
+        rows = ratings['row'].to_numpy()
+        n_users, n_movies = len(user_ids), len(self.movie_ids)
+        weights = ratings['rating'].to_numpy(dtype=np.float64) - RATING_MIDPOINT
+        liked_counts = np.bincount(user_positions[weights > 0], minlength=n_users)
+        total_weights = np.bincount(user_positions, weights=np.abs(weights), minlength=n_users)
+        weight_matrix = sp.csr_matrix(
+            (weights / total_weights[user_positions], (user_positions, rows)), shape=(n_users, n_movies)
+        )
+        rated_matrix = sp.csr_matrix(
+            (np.ones(len(rows), dtype=bool), (user_positions, rows)), shape=(n_users, n_movies)
+        )
+        items = self.item_vectors()
+        if not sp.issparse(items):
+            # Keep the dense profile and score products in float32
+            weight_matrix = weight_matrix.astype(items.dtype)
+        item_matrix_t = items.T.tocsr() if sp.issparse(items) else np.ascontiguousarray(items.T)
+        if self.collaborative is not None:
+            # Same weights in the collaborative model's movie space, and a 0/1 matrix
+            # mapping its movies onto catalog rows
+            cf_neighbors = self.collaborative.neighbor_matrix()
+            cf_ids = self.collaborative.item_ids
+            cf_columns = pd.Index(cf_ids).get_indexer(self.movie_ids[rows])
+            cf_weights = sp.csr_matrix(
+                (np.where(cf_columns >= 0, weights / total_weights[user_positions], 0.0),
+                 (user_positions, np.maximum(cf_columns, 0))),
+                shape=(n_users, len(cf_ids))
+            )
+            cf_rows = np.array([self.id_to_row.get(movie_id, -1) for movie_id in cf_ids.tolist()], dtype=np.int64)
+            cf_to_catalog = sp.csr_matrix(
+                (np.ones(int((cf_rows >= 0).sum())), (np.flatnonzero(cf_rows >= 0), cf_rows[cf_rows >= 0])),
+                shape=(len(cf_ids), n_movies)
+            )
+
+        written = 0
+        for start in range(0, n_users, chunk_size):
+            end = min(start + chunk_size, n_users)
+            profiles = weight_matrix[start:end] @ items
+            scores = profiles @ item_matrix_t
+            scores = scores.toarray() if sp.issparse(scores) else np.asarray(scores)
+            if self.collaborative is not None:
+                cf_scores = (cf_weights[start:end] @ cf_neighbors @ cf_to_catalog).toarray()
+                scores = (1 - self.cf_weight) * scores + self.cf_weight * cf_scores
+            scores[rated_matrix[start:end].toarray()] = -np.inf
+            k = min(top_n, n_movies)
+            top, top_scores = self._top_k(scores, k)
+
+            records = []
+            for offset in range(end - start):
+                if not liked_counts[start + offset]:
+                    continue
+                user_id = int(user_ids[start + offset])
+                valid = np.isfinite(top_scores[offset])
+                records.extend(
+                    (user_id, rank, int(self.movie_ids[row]), float(score))
+                    for rank, (row, score) in enumerate(zip(top[offset][valid], top_scores[offset][valid]))
+                )
+            chunk_users = [(int(user_id),) for user_id in user_ids[start:end]]
+            with conn:
+                conn.executemany("DELETE FROM user_recommendations WHERE user_id = ?", chunk_users)
+                conn.executemany(
+                    "INSERT INTO user_recommendations (user_id, rank, movie_id, score) VALUES (?, ?, ?, ?)",
+                    records
+                )
+            written += int((liked_counts[start:end] > 0).sum())
+            print(f"Batch recommendations: {end}/{n_users} users scored")
+
+        conn.close()
+        return written
+
+    def embedding_report(self, k=10, n_queries=200, n_users=100, seed=0):
+        """Compare the SVD embeddings with the TF-IDF vectors they were projected from.
+
+        Reports the memory of both item matrices, the mean overlap between the
+        top-k neighbours of sampled movies and between the top-k recommendations
+        of sampled users computed both ways (1.0 means identical sets), and the
+        mean time to score the whole catalog for one user.
+        """
+        if self.embeddings is None:
+            raise ValueError("Model was built without embedding_dim")
+        tfidf = self.tfidf_matrix.tocsr()
+        n_movies = tfidf.shape[0]
+        k = min(k, n_movies - 1)
+        if k < 1:
+            raise ValueError("Catalog is too small to compare rankings")
+        rng = np.random.default_rng(seed)
+
+        queries = rng.choice(n_movies, size=min(n_queries, n_movies), replace=False)
+        tfidf_t, embeddings_t = self._transpose(tfidf), self._transpose(self.embeddings)
+        neighbor_overlap = []
+        for start in range(0, len(queries), self.chunk_size):
+            rows = queries[start:start + self.chunk_size]
+            exact, _ = self._top_k(self._similarity_block(tfidf[rows], tfidf_t, rows), k)
+            approx, _ = self._top_k(self._similarity_block(self.embeddings[rows], embeddings_t, rows), k)
+            neighbor_overlap.extend(len(np.intersect1d(a, b)) / k for a, b in zip(exact, approx))
+
+        conn = sqlite3.connect(self.db_path)
+        user_ids = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM user_movies").fetchall()]
+        conn.close()
+        user_ids = rng.permutation(user_ids)[:n_users].tolist() if user_ids else []
+        user_overlap, tfidf_times, embedding_times = [], [], []
+        for user_id in user_ids:
+            ratings = self.load_user_ratings(user_id)
+            rated = [(self.id_to_row[movie_id], rating_weight(rating))
+                     for movie_id, rating in ratings.items() if movie_id in self.id_to_row]
+            if not rated:
+                continue
+            rows, weights = zip(*rated)
+            weighted = sp.csr_matrix((weights, (np.zeros(len(rows), dtype=np.int64), rows)), shape=(1, n_movies))
+            tfidf_profile = self._profile_vector(weighted @ tfidf)
+            embedding_profile = self._profile_vector(weighted @ self.embeddings)
+
+            start = time.perf_counter()
+            tfidf_scores = self._matvec(tfidf, tfidf_profile)
+            tfidf_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            embedding_scores = self._matvec(self.embeddings, embedding_profile)
+            embedding_times.append(time.perf_counter() - start)
+
+            excluded = self.exclusion_mask(ratings)
+            expected = self.top_candidates(tfidf_scores, excluded, k)
+            if len(expected):
+                actual = self.top_candidates(embedding_scores, excluded, k)
+                user_overlap.append(len(np.intersect1d(expected, actual)) / len(expected))
+
+        tfidf_bytes = tfidf.data.nbytes + tfidf.indices.nbytes + tfidf.indptr.nbytes
+        return {
+            'k': k,
+            'embedding_dim': self.embeddings.shape[1],
+            'tfidf_bytes': int(tfidf_bytes),
+            'embedding_bytes': int(self.embeddings.nbytes),
+            'memory_ratio': tfidf_bytes / max(self.embeddings.nbytes, 1),
+            'neighbor_overlap': float(np.mean(neighbor_overlap)),
+            'users': len(user_overlap),
+            'user_overlap': float(np.mean(user_overlap)) if user_overlap else None,
+            'tfidf_score_ms': 1000 * float(np.mean(tfidf_times)) if tfidf_times else None,
+            'embedding_score_ms': 1000 * float(np.mean(embedding_times)) if embedding_times else None
+        }
+
+    def exclusion_mask(self, exclude_movie_ids=None):
+        """Boolean mask over catalog rows that is True for the given movie ids"""
+        if not exclude_movie_ids:
+            return np.zeros(len(self.movie_ids), dtype=bool)
+        exclude = np.fromiter(exclude_movie_ids, dtype=np.int64, count=len(exclude_movie_ids))
+        return np.isin(self.movie_ids, exclude)
+
+    @staticmethod
+    def top_candidates(scores, excluded, count):
+        """Row positions of the `count` best non-excluded scores, best first.
+
+        Uses argpartition so the cost is O(N) rather than sorting the whole catalog.
+        """
+        count = min(count, len(scores) - int(excluded.sum()))
+        if count <= 0:
+            return np.empty(0, dtype=np.intp)
+        scores = np.where(excluded, -np.inf, scores)
+        top = np.argpartition(-scores, count - 1)[:count]
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def get_popular_movies(self, top_n=10, exclude_movie_ids=None, random_seed=None,
+                           media_type=None, genre_id=None, include_genres=None, exclude_genres=None):
+        """Get popular movies based on vote_average, vote_count and popularity.
+
+        Walks the precomputed popularity ranking (see _build_popularity_index)
+        past excluded movies, then samples top_n of the best 2 * top_n for variety.
+        """
         print(f"Debug: Getting {top_n} popular movies")
-        if self.movies_df is None or self.movies_df.empty:
-            print("Debug: No movies dataframe available")
+        if self.popular_order is None or not len(self.popular_order):
+            print("Debug: No movies available")
             return []
         
-        print(f"Debug: Movies dataframe has {len(self.movies_df)} movies")
-        
-        # Calculate popularity score
-        self.movies_df['popularity_score'] = (
-            self.movies_df['vote_average'] * self.movies_df['vote_count'] * 
-            self.movies_df['popularity']
-        )
-        
-        # Filter out user's rated movies if provided
-        if exclude_movie_ids:
-            available_movies = self.movies_df[~self.movies_df['id'].isin(exclude_movie_ids)]
-            print(f"Debug: After excluding rated movies, {len(available_movies)} movies available")
-        else:
-            available_movies = self.movies_df
+        order = self.popularity_ranking(media_type, genre_id)
+        if include_genres or exclude_genres:
+            order = order[~self.genre_filter_mask(include_genres, exclude_genres)[order]]
+        exclude = exclude_movie_ids or ()
+        # However the exclusions fall, this prefix holds 2 * top_n allowed movies if the slice does
+        candidates = order[:top_n * 2 + len(exclude)]
+        if exclude:
+            candidates = candidates[~self.exclusion_mask(exclude)[candidates]]
+        popular = candidates[:top_n * 2].tolist()
         
-        # Get top popular movies with some randomization
-        popular_movies = available_movies.nlargest(top_n * 2, 'popularity_score')  # Get more movies
         # Randomly sample from top movies to add variety
         import random
         if random_seed:
             random.seed(random_seed)
-        if len(popular_movies) > top_n:
-            popular_movies = popular_movies.sample(n=top_n, random_state=random.randint(1, 1000))
+        if len(popular) > top_n:
+            popular = random.sample(popular, top_n)
         
-        result = popular_movies[['id', 'title', 'overview', 'vote_average', 'vote_count', 'popularity', 'poster_path']].to_dict(orient='records')
+        result = self._movie_records(popular)
         print(f"Debug: Returning {len(result)} popular movies")
         return result
     
@@ -381,74 +1157,563 @@ class MovieRecommender:
         
         return self.recommend_for_user(user_id, top_n, random_seed=random_seed)
     
-    def _ensure_movies_in_database(self, recommendations):
-        """Ensure all recommended movies are properly added to the database"""
-        import database
-        db = database.MovieRankerDB()
-        
-        for movie in recommendations:
-            try:
-                # Check if movie exists in database
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT id FROM movies WHERE id = ?", (movie['id'],))
-                exists = cursor.fetchone()
-                conn.close()
-                
-                if not exists:
-                    # Add movie to database
-                    movie_data = {
-                        'id': movie['id'],
-                        'title': movie['title'],
-                        'overview': movie.get('overview', ''),
-                        'vote_average': movie.get('vote_average', 0),
-                        'vote_count': movie.get('vote_count', 0),
-                        'popularity': movie.get('popularity', 0),
-                        'poster_path': movie.get('poster_path', ''),
-                        'release_date': movie.get('release_date'),
-                        'original_language': movie.get('original_language', 'en'),
-                        'media_type': movie.get('media_type', 'movie')
-                    }
-                    db.add_media(movie_data)
-                    print(f"Debug: Added movie {movie['title']} to database")
-            except Exception as e:
-                print(f"Debug: Error ensuring movie {movie.get('title', 'Unknown')} in database: {e}")
+    def get_fallback_candidates(self, count, exclude_movie_ids=None, include_genres=None, exclude_genres=None):
+        """Movies from the stored cold-start pool (see fallback.py), best first, skipping excluded ids"""
+        exclude = set(exclude_movie_ids or ())
+        conditions, params = [], []
+        for genre_ids, operator in ((include_genres, 'EXISTS'), (exclude_genres, 'NOT EXISTS')):
+            if genre_ids:
+                placeholders = ', '.join('?' for _ in genre_ids)
+                conditions.append(f"{operator} (SELECT 1 FROM genre_map g WHERE g.movie_id = m.id "
+                                  f"AND g.genre_id IN ({placeholders}))")
+                params.extend(genre_ids)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(f"""
+            SELECT {', '.join('m.' + field for field in RESULT_FIELDS)}
+            FROM fallback_candidates fc
+            JOIN movies m ON m.id = fc.movie_id
+            {where}
+            ORDER BY fc.rank
+            LIMIT ?
+            """, (*params, count + len(exclude))).fetchall()
+        except sqlite3.OperationalError:
+            # The pool table has not been created yet
+            rows = []
+        finally:
+            conn.close()
+        return [dict(zip(RESULT_FIELDS, row)) for row in rows if row[0] not in exclude][:count]
     
-    def save_model(self, filepath='movie_recommender.pkl'):
-        """Save the trained model"""
-        model_data = {
+    def save_model(self, artifact_dir='model_artifacts', keep=3):
+        """Save the trained model as a versioned artifact directory.
+
+        Numeric arrays and the catalog columns are written as .npy files so
+        load_model() can memory-map them read-only; only the vectorizer and the
+        SVD projection go into a joblib file.
+        The directory is named after the catalog fingerprint (or a unique name
+        for incrementally updated models), written under a temporary name and
+        renamed into place so readers never see a partial artifact. Only the
+        newest `keep` artifacts are kept, plus the published one.
+        """
+        if self.vectorizer is None or self.artifact_name is None:
+            print("Model has no build to save")
+            return None
+        os.makedirs(artifact_dir, exist_ok=True)
+        path = os.path.join(artifact_dir, self.artifact_name)
+        if os.path.isdir(path):
+            return path
+
+        tmp_path = os.path.join(artifact_dir, f".tmp-{self.artifact_name}-{os.getpid()}-{threading.get_ident()}")
+        os.makedirs(tmp_path)
+        tfidf_matrix = self.tfidf_matrix.tocsr()
+        arrays = {
+            'tfidf_data': tfidf_matrix.data,
+            'tfidf_indices': tfidf_matrix.indices,
+            'tfidf_indptr': tfidf_matrix.indptr,
+            'neighbor_indices': self.neighbor_indices,
+            'neighbor_scores': self.neighbor_scores
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+        if self.embeddings is not None:
+            np.save(os.path.join(tmp_path, 'embeddings.npy'), self.embeddings)
+        if self.ann_index is not None:
+            self.ann_index.save(os.path.join(tmp_path, 'ann.npz'))
+        self.catalog.save(tmp_path)
+        joblib.dump({
             'vectorizer': self.vectorizer,
-            'tfidf_matrix': self.tfidf_matrix,
-            'title_to_index': self.title_to_index,
-            'similarity_matrix': self.similarity_matrix,
-            'movies_df': self.movies_df
+            'svd': self.svd
+        }, os.path.join(tmp_path, 'objects.joblib'))
+        meta = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'fingerprint': self.fingerprint,
+            'name': self.artifact_name,
+            'signature': self.model_signature(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'built_at': self.built_at,
+            'catalog_watermark': self.catalog_watermark,
+            'vocabulary_cutoff': self.vocabulary_cutoff,
+            'n_movies': len(self.catalog),
+            'tfidf_shape': list(tfidf_matrix.shape)
         }
-        joblib.dump(model_data, filepath)
-    
-    def load_model(self, filepath='movie_recommender.pkl'):
-        """Load a trained model"""
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
         try:
-            model_data = joblib.load(filepath)
-            self.vectorizer = model_data['vectorizer']
-            self.tfidf_matrix = model_data['tfidf_matrix']
-            self.title_to_index = model_data['title_to_index']
-            self.similarity_matrix = model_data['similarity_matrix']
-            self.movies_df = model_data['movies_df']
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process saved the same fingerprint first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        print(f"Saved model artifact {path}")
+        self._prune_artifacts(artifact_dir, keep)
+        return path
+
+    @staticmethod
+    def _prune_artifacts(artifact_dir, keep):
+        current = read_current_artifact(artifact_dir)
+        artifacts = [
+            os.path.join(artifact_dir, name) for name in os.listdir(artifact_dir)
+            if not name.startswith('.') and name != current
+            and os.path.isfile(os.path.join(artifact_dir, name, 'meta.json'))
+        ]
+        artifacts.sort(key=os.path.getmtime, reverse=True)
+        for path in artifacts[keep:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def load_model(self, artifact_dir='model_artifacts', fingerprint=None):
+        """Load the artifact matching the current catalog, memory-mapping its arrays.
+
+        Builds (without saving) and returns False when no matching artifact exists.
+        """
+        if fingerprint is None:
+            fingerprint = self.current_fingerprint()
+        if self._load_artifact(artifact_dir, fingerprint):
             return True
-        except FileNotFoundError:
-            print(f"Model file {filepath} not found. Building new model...")
+        print(f"No model artifact for catalog {fingerprint} in {artifact_dir}. Building new model...")
+        self._build_model()
+        return False
+
+    def _load_or_build(self, artifact_dir):
+        """Load the artifact for the current catalog, or build and save it.
+
+        The build happens under build_lock(), so when several processes start
+        together one builds while the rest wait and then map its artifact.
+        """
+        fingerprint = self.current_fingerprint()
+        if self._load_artifact(artifact_dir, fingerprint):
+            return
+        with build_lock(artifact_dir):
+            if self._load_artifact(artifact_dir, fingerprint):
+                return
+            print(f"No model artifact for catalog {fingerprint} in {artifact_dir}. Building new model...")
             self._build_model()
+            self.save_model(artifact_dir)
+
+    def _load_artifact(self, artifact_dir, name):
+        """Memory-map a saved artifact; returns False when it does not exist"""
+        path = os.path.join(artifact_dir, name)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta['format_version'] != ARTIFACT_FORMAT_VERSION:
+                raise FileNotFoundError(path)
+            arrays = {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                for name in ARTIFACT_ARRAYS
+            }
+            objects = joblib.load(os.path.join(path, 'objects.joblib'))
+            catalog = MovieCatalog.load(path)
+        except FileNotFoundError:
             return False
 
-# Example usage and model training
-if __name__ == "__main__":
-    # Create and train the model
-    recommender = MovieRecommender()
-    
-    # Save the model
-    recommender.save_model()
-    
-    # Test recommendations
-    test_recommendations = recommender.get_popular_movies(5)
-    print("Popular movies:", test_recommendations)
+        self.vectorizer = objects['vectorizer']
+        self.catalog = catalog
+        self._index_catalog()
+        self.tfidf_matrix = sp.csr_matrix(
+            (arrays['tfidf_data'], arrays['tfidf_indices'], arrays['tfidf_indptr']),
+            shape=tuple(meta['tfidf_shape'])
+        )
+        self.neighbor_indices = arrays['neighbor_indices']
+        self.neighbor_scores = arrays['neighbor_scores']
+        self.svd = objects.get('svd')
+        self.embeddings = None
+        if os.path.exists(os.path.join(path, 'embeddings.npy')):
+            self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        self.ann_index = None
+        if os.path.exists(os.path.join(path, 'ann.npz')):
+            from ann import RandomProjectionLSH
+            self.ann_index = RandomProjectionLSH.load(os.path.join(path, 'ann.npz'), self.item_vectors())
+        self.fingerprint = meta['fingerprint']
+        self.artifact_name = name
+        self.built_at = meta['built_at']
+        self.catalog_watermark = meta.get('catalog_watermark')
+        self.version = next(_model_versions)
+        self.vocabulary_cutoff = meta.get('vocabulary_cutoff', 1)
+        self.oov_counts = Counter()
+        self.seen_tokens = 0
+        # Whoever built and published the artifact stored its neighbour lists
+        self.unstored_rows = np.empty(0, dtype=np.int64)
+        self._collaborative = None
+        print(f"Loaded model artifact {path}")
+        return True
+
+class RecommendationCache:
+    """Size-bounded, thread-safe LRU of recent per-user recommendation lists.
+
+    Entries are keyed by (user_id, model version, rating watermark), so a new
+    model or a rating change simply stops matching old entries; invalidate()
+    additionally drops a user's entries as soon as their ratings change.
+    """
+
+    def __init__(self, maxsize=1024):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id, model_version, watermark):
+        with self._lock:
+            result = self._entries.get((user_id, model_version, watermark))
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Callers decorate the dicts (e.g. genre names), so hand out copies
+        return [dict(movie) for movie in result]
+
+    def put(self, user_id, model_version, watermark, recommendations):
+        with self._lock:
+            self._entries[(user_id, model_version, watermark)] = [dict(movie) for movie in recommendations]
+
+    def invalidate(self, user_id):
+        """Drop every cached list for a user"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self._entries.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations
+            }
+
+class ModelManager:
+    """Serves the live MovieRecommender and rebuilds it on a background thread.
+
+    Requests read `recommender`, which always points at a complete model. The
+    worker builds a new recommender (or updates a copy of the current one) off
+    to the side and swaps the reference in a single assignment, so readers keep
+    using the previous version until the swap. Requests that arrive while a
+    rebuild is pending are coalesced into it.
+
+    With an artifact_dir the model is shared between processes (e.g. gunicorn
+    workers): every new model is saved there and published through the CURRENT
+    pointer, its arrays are memory-mapped so all processes share one copy in
+    the page cache, and idle workers poll the pointer every poll_interval
+    seconds and map in whatever another process published. Builds and updates
+    run under build_lock() and start from the published model, so concurrent
+    updates from different processes are applied one after another.
+
+    Only models going live here write their neighbour lists to the
+    movie_neighbors table; constructing a MovieRecommender never does.
+
+    Incremental updates are batched: the worker waits update_delay seconds
+    after the first pending update so a burst of changes becomes one update
+    and one published artifact. Models following the same full build share
+    one collaborative-filtering model, and a new one is built on the worker
+    thread before the swap rather than by the first request.
+
+    At startup the published model is mapped in straight away when its
+    options and catalog watermark still match the database; the full catalog
+    fingerprint, which also catches edits to existing rows, is checked on the
+    worker thread afterwards and triggers a rebuild if it differs.
+    """
+
+    def __init__(self, db_path='movie_ranker.db', poll_interval=5.0, update_delay=2.0, **model_options):
+        self.db_path = db_path
+        self.model_options = model_options
+        self.artifact_dir = model_options.get('artifact_dir')
+        self.poll_interval = poll_interval
+        self.update_delay = update_delay
+        self._update_due = 0.0
+        self.recommender = None
+        self.last_update = None
+        self._condition = threading.Condition()
+        self._full_rebuild_pending = False
+        self._pending_movie_ids = set()
+        self._busy = False
+        self._worker = None
+        # Model loaded at startup whose catalog fingerprint the worker still has to check
+        self._unverified = None
+
+    def load(self):
+        """Load or build the first model synchronously (used at startup)"""
+        recommender = None
+        if self.artifact_dir is not None:
+            recommender = self._load_current()
+        if recommender is None:
+            recommender = MovieRecommender(self.db_path, **self.model_options)
+            if self.artifact_dir is not None:
+                with build_lock(self.artifact_dir):
+                    self._publish(recommender)
+            else:
+                recommender.store_changed_neighbors()
+        elif recommender.fingerprint is not None:
+            self._unverified = recommender
+        recommender.load_collaborative()
+        with self._condition:
+            self._swap(recommender)
+            if self.artifact_dir is not None:
+                # Checks the fingerprint, then keeps polling for models published by other processes
+                self._busy = self._unverified is not None
+                self._start_worker()
+        return self.recommender
+
+    def _load_current(self):
+        """The published model if it was built with our options from a catalog with the same watermark, else None"""
+        name = read_current_artifact(self.artifact_dir)
+        meta = read_artifact_meta(self.artifact_dir, name) if name is not None else None
+        if meta is None or meta.get('catalog_watermark') is None:
+            return None
+        try:
+            recommender = MovieRecommender(self.db_path, artifact_name=name, **self.model_options)
+        except FileNotFoundError:
+            # Pruned between reading the pointer and loading it
+            return None
+        if meta['signature'] != recommender.model_signature() or meta['catalog_watermark'] != recommender.current_watermark():
+            return None
+        return recommender
+
+    def _verify_catalog(self):
+        """Rebuild if the catalog changed since the model loaded at startup was built"""
+        recommender, self._unverified = self._unverified, None
+        if recommender is None:
+            return
+        try:
+            fingerprint = recommender.current_fingerprint()
+        except Exception as e:
+            print(f"Error fingerprinting the movie catalog: {e}")
+            return
+        if fingerprint != recommender.fingerprint:
+            print(f"Catalog changed since model {recommender.artifact_name} was built, rebuilding...")
+            self.request_rebuild()
 
+    def request_rebuild(self):
+        """Schedule a full rebuild; returns immediately"""
+        with self._condition:
+            self._full_rebuild_pending = True
+            self._start_worker()
+            self._condition.notify_all()
+
+    def request_update(self, movie_ids):
+        """Schedule an incremental update for the given movies; returns immediately"""
+        with self._condition:
+            if not self._pending_movie_ids:
+                self._update_due = time.monotonic() + self.update_delay
+            self._pending_movie_ids.update(movie_ids)
+            self._start_worker()
+            self._condition.notify_all()
+
+    def wait_until_idle(self, timeout=None):
+        """Block until no rebuild is running or pending. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not (self._busy or self._full_rebuild_pending or self._pending_movie_ids),
+                timeout=timeout
+            )
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='model-rebuild', daemon=True)
+            self._worker.start()
+
+    def _swap(self, recommender):
+        self.recommender = recommender
+        self.last_update = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _has_work(self):
+        return self._full_rebuild_pending or bool(self._pending_movie_ids)
+
+    def _publish(self, recommender):
+        """Save a model, point CURRENT at it and store its neighbour lists; the caller holds build_lock()"""
+        if recommender.save_model(self.artifact_dir) is not None:
+            publish_artifact(self.artifact_dir, recommender.artifact_name)
+        recommender.store_changed_neighbors()
+
+    def _load_published(self, current):
+        """The published model if it differs from `current`, otherwise `current`"""
+        name = read_current_artifact(self.artifact_dir)
+        if name is None or (current is not None and name == current.artifact_name):
+            return current
+        recommender = MovieRecommender(self.db_path, artifact_name=name, **self.model_options)
+        recommender.share_collaborative(current)
+        return recommender
+
+    def _follow_published(self):
+        """Swap in a model another process published since we last looked"""
+        current = self.recommender
+        try:
+            candidate = self._load_published(current)
+        except Exception as e:
+            # e.g. the artifact was pruned between reading the pointer and loading it
+            print(f"Error loading published recommendation model: {e}")
+            return
+        if candidate is current:
+            return
+        # Build (or reuse) the CF model here rather than in the first request
+        candidate.load_collaborative()
+        with self._condition:
+            self._swap(candidate)
+        print(f"Loaded published recommendation model {candidate.artifact_name}")
+
+    def _rebuilt(self, current, full_rebuild, movie_ids):
+        if full_rebuild or current is None:
+            return MovieRecommender(self.db_path, **self.model_options)
+        # update_movies() only ever rebinds attributes, so a shallow copy
+        # leaves the arrays the current model is serving from untouched
+        candidate = copy.copy(current)
+        candidate.update_movies(movie_ids)
+        return candidate
+
+    def _run(self):
+        self._verify_catalog()
+        while True:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+                timeout = self.poll_interval if self.artifact_dir is not None else None
+                if not self._condition.wait_for(self._has_work, timeout=timeout):
+                    poll = True
+                else:
+                    poll = False
+                    if not self._full_rebuild_pending:
+                        # Give further updates update_delay seconds to join this batch
+                        self._condition.wait_for(lambda: self._full_rebuild_pending,
+                                                 timeout=max(self._update_due - time.monotonic(), 0))
+                    current = self.recommender
+                    full_rebuild = self._full_rebuild_pending or current is None
+                    movie_ids = self._pending_movie_ids
+                    self._full_rebuild_pending = False
+                    self._pending_movie_ids = set()
+                    self._busy = True
+            if poll:
+                self._follow_published()
+                continue
+
+            try:
+                if self.artifact_dir is None:
+                    candidate = self._rebuilt(current, full_rebuild, movie_ids)
+                    candidate.store_changed_neighbors()
+                else:
+                    with build_lock(self.artifact_dir):
+                        # Apply the change on top of whatever was published last
+                        current = self._load_published(current)
+                        candidate = self._rebuilt(current, full_rebuild, movie_ids)
+                        if current is None or candidate.version != current.version:
+                            self._publish(candidate)
+                candidate.load_collaborative()
+            except Exception as e:
+                print(f"Error rebuilding recommendation model: {e}")
+                continue
+
+            with self._condition:
+                self._swap(candidate)
+            print(f"Recommendation model version {candidate.version} is now live")
+
+def _batch_recommend_shard(options):
+    """Run one shard of the batch job in its own process"""
+    recommender = MovieRecommender(db_path=options['db'], n_neighbors=options['neighbors'],
+                                   cf_weight=options['cf_weight'], embedding_dim=options['embedding_dim'],
+                                   artifact_dir=options['artifact_dir'])
+    return recommender.batch_recommend(top_n=options['top_n'], chunk_size=options['chunk_size'],
+                                       shard=options['shard'], num_shards=options['num_shards'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Movie recommendation model tools")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    build = subcommands.add_parser('build-artifacts', help="Build and save a model artifact offline")
+    build.add_argument('--db', default='movie_ranker.db', help="SQLite database to build from")
+    build.add_argument('--artifact-dir', default='model_artifacts', help="Directory to write artifacts to")
+    build.add_argument('--neighbors', type=int, default=50, help="Neighbours kept per movie")
+    build.add_argument('--keep', type=int, default=3, help="Number of artifacts to keep")
+    build.add_argument('--embedding-dim', type=int, default=int(os.getenv("MODEL_EMBEDDING_DIM", "0")) or None,
+                       help="Build SVD embeddings of this size")
+    build.add_argument('--no-publish', action='store_true', help="Save the artifact without pointing CURRENT at it")
+
+    batch = subcommands.add_parser('batch-recommend', help="Precompute recommendations for all users")
+    batch.add_argument('--db', default='movie_ranker.db', help="SQLite database to read ratings from and write to")
+    batch.add_argument('--artifact-dir', default='model_artifacts', help="Load or save the model artifact here")
+    batch.add_argument('--neighbors', type=int, default=50, help="Neighbours kept per movie")
+    # Defaults follow the environment variables app.py builds its model with
+    batch.add_argument('--cf-weight', type=float, default=float(os.getenv("CF_BLEND_WEIGHT", "0.2")),
+                       help="Share of the score from collaborative filtering")
+    batch.add_argument('--embedding-dim', type=int, default=int(os.getenv("MODEL_EMBEDDING_DIM", "0")) or None,
+                       help="Score with SVD embeddings of this size")
+    batch.add_argument('--top-n', type=int, default=20, help="Recommendations stored per user")
+    batch.add_argument('--chunk-size', type=int, default=1000, help="Users scored per sparse product")
+    batch.add_argument('--shard', type=int, default=None, help="Only process this shard (0-based)")
+    batch.add_argument('--num-shards', type=int, default=1, help="Total number of shards")
+    batch.add_argument('--workers', type=int, default=1, help="Processes to run shards in parallel")
+
+    recall = subcommands.add_parser('ann-recall', help="Check ANN recall and latency against exact search")
+    recall.add_argument('--db', default='movie_ranker.db', help="SQLite database to build from")
+    recall.add_argument('--tables', type=int, default=8, help="LSH hash tables")
+    recall.add_argument('--bits', type=int, default=None, help="Hyperplanes per table (default: from catalog size)")
+    recall.add_argument('--probes', type=int, default=1, help="Extra one-bit-flip buckets probed per table")
+    recall.add_argument('--k', type=int, default=10, help="Neighbours compared per query")
+    recall.add_argument('--queries', type=int, default=200, help="Number of sampled query movies")
+
+    compare = subcommands.add_parser('compare-embeddings', help="Compare SVD embeddings with TF-IDF")
+    compare.add_argument('--db', default='movie_ranker.db', help="SQLite database to build from")
+    compare.add_argument('--dim', type=int, default=128, help="SVD embedding dimensions")
+    compare.add_argument('--k', type=int, default=10, help="Size of the rankings compared")
+    compare.add_argument('--queries', type=int, default=200, help="Number of sampled query movies")
+    compare.add_argument('--users', type=int, default=100, help="Number of sampled users")
+
+    bench = subcommands.add_parser('bench-catalog', help="Time result assembly: DataFrame vs columnar catalog")
+    bench.add_argument('--db', default='movie_ranker.db', help="SQLite database to build from")
+    bench.add_argument('--results', type=int, default=10, help="Movies per assembled result list")
+    bench.add_argument('--repeats', type=int, default=1000, help="Result lists assembled per path")
+
+    args = parser.parse_args(argv)
+    if args.command == 'ann-recall':
+        recommender = MovieRecommender(db_path=args.db, ann_tables=args.tables, ann_bits=args.bits,
+                                       ann_probes=args.probes)
+        if recommender.ann_index is None:
+            return
+        report = recommender.ann_index.recall_at_k(k=args.k, n_queries=args.queries)
+        print(json.dumps(report, indent=2))
+    elif args.command == 'bench-catalog':
+        from catalog import benchmark_catalog
+        recommender = MovieRecommender(db_path=args.db)
+        if not len(recommender.catalog):
+            return
+        print(json.dumps(benchmark_catalog(recommender.catalog, args.results, args.repeats), indent=2))
+    elif args.command == 'compare-embeddings':
+        recommender = MovieRecommender(db_path=args.db, embedding_dim=args.dim)
+        if recommender.embeddings is None:
+            return
+        report = recommender.embedding_report(k=args.k, n_queries=args.queries, n_users=args.users)
+        print(json.dumps(report, indent=2))
+    elif args.command == 'build-artifacts':
+        recommender = MovieRecommender(db_path=args.db, n_neighbors=args.neighbors,
+                                       embedding_dim=args.embedding_dim)
+        with build_lock(args.artifact_dir):
+            path = recommender.save_model(args.artifact_dir, keep=args.keep)
+            if path is not None and not args.no_publish:
+                # Serving processes pick the new artifact up within their poll interval
+                publish_artifact(args.artifact_dir, recommender.artifact_name)
+                recommender.store_changed_neighbors()
+        print(f"Artifact ready: {path}")
+    elif args.command == 'batch-recommend':
+        # Build (or load) the artifact once so worker processes only have to map it in
+        MovieRecommender(db_path=args.db, n_neighbors=args.neighbors, embedding_dim=args.embedding_dim,
+                         artifact_dir=args.artifact_dir)
+        num_shards = max(args.num_shards, args.workers)
+        shards = [args.shard] if args.shard is not None else list(range(num_shards))
+        jobs = [
+            {'db': args.db, 'artifact_dir': args.artifact_dir, 'neighbors': args.neighbors, 'top_n': args.top_n,
+             'cf_weight': args.cf_weight, 'embedding_dim': args.embedding_dim,
+             'chunk_size': args.chunk_size, 'shard': shard, 'num_shards': num_shards}
+            for shard in shards
+        ]
+        if args.workers > 1 and len(jobs) > 1:
+            import multiprocessing
+            with multiprocessing.Pool(min(args.workers, len(jobs))) as pool:
+                counts = pool.map(_batch_recommend_shard, jobs)
+        else:
+            counts = [_batch_recommend_shard(job) for job in jobs]
+        print(f"Stored recommendations for {sum(counts)} users")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import threading
+from datetime import datetime, timezone
+
+class PeriodicRefresher:
+    """Base class for locally stored TMDB data that a daemon thread refreshes periodically.
+
+    Subclasses implement refresh(client), which returns the number of items
+    stored (0 when the fetch failed or came back empty), and refreshed_at(),
+    the stored data's UTC "YYYY-MM-DD HH:MM:SS" timestamp or None. When several
+    processes share the database, a process skips the refresh while the stored
+    data is younger than refresh_interval and calls on_fresh() instead. A
+    failed or empty refresh is retried after retry_delay seconds, doubling up
+    to max_retry_delay, rather than a whole refresh_interval later.
+    """
+
+    # Used in log messages and as the thread name
+    description = 'data'
+    thread_name = 'periodic-refresh'
+
+    def __init__(self, db_path='movie_ranker.db', refresh_interval=24 * 60 * 60, retry_delay=30,
+                 max_retry_delay=15 * 60):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self, client):
+        raise NotImplementedError
+
+    def refreshed_at(self):
+        raise NotImplementedError
+
+    def on_fresh(self, client):
+        """Called by the refresh thread while the stored data is not yet due for a refresh"""
+
+    def seconds_until_stale(self):
+        """Seconds before the stored data is due for a refresh (0 if it is due now)"""
+        refreshed_at = self.refreshed_at()
+        if refreshed_at is None:
+            return 0
+        refreshed_at = datetime.strptime(refreshed_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        age = (datetime.now(timezone.utc) - refreshed_at).total_seconds()
+        return max(self.refresh_interval - age, 0)
+
+    def seconds_until_retry(self):
+        """Backoff after the latest run of consecutive failures, never beyond refresh_interval"""
+        delay = self.retry_delay * 2 ** max(self.failures - 1, 0)
+        return min(delay, self.max_retry_delay, self.refresh_interval)
+
+    def start(self, client):
+        """Start the background refresh thread (no-op if already running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(client,), name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, client):
+        while not self._stop.is_set():
+            try:
+                wait = self.seconds_until_stale()
+                if wait > 0:
+                    self.on_fresh(client)
+                elif self.refresh(client):
+                    self.failures = 0
+                    wait = self.refresh_interval
+                else:
+                    self.failures += 1
+                    wait = self.seconds_until_retry()
+            except Exception as e:
+                print(f"Error refreshing {self.description}: {e}")
+                self.failures += 1
+                wait = self.seconds_until_retry()
+            self._stop.wait(wait)
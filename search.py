@@ -1,12 +1,26 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import math
+import random
+from concurrent.futures import ThreadPoolExecutor
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import quote
 from dotenv import load_dotenv
 import os
+import threading
+from throttle import SingleFlight, TokenBucket
+
+# Responses worth retrying: rate limited or a transient server-side failure
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 
 
 class TMDBClient:
-    def __init__(self, api_key=None, language="en-US", include_adult=False):
+    def __init__(self, api_key=None, language="en-US", include_adult=False, base_url="https://api.themoviedb.org/3",
+                 pool_size=10, connect_timeout=3.05, read_timeout=10, max_retries=3, backoff_factor=0.5,
+                 max_backoff=30, cache=None, max_concurrency=4, rate_limit=40, rate_burst=10):
         # Get API key
         self.api_key = api_key
         if not self.api_key:
@@ -14,22 +28,117 @@ class TMDBClient:
         
         self.language = language
         self.include_adult = str(include_adult).lower()
-        self.base_url = "https://api.themoviedb.org/3"
+        self.base_url = base_url
         # Remove Bearer token, use simple headers
         self.headers = {
             "accept": "application/json"
         }
-        self.fetch_genres()
+        # One keep-alive session for every call, so requests reuse pooled
+        # connections instead of paying a new TCP/TLS handshake each time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        # Connection errors, timeouts and RETRY_STATUSES responses are retried up to
+        # max_retries times, waiting Retry-After when TMDB sends it and otherwise a
+        # random time up to backoff_factor * 2 ** attempt seconds (capped at max_backoff)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        # Optional tmdb_cache.ResponseCache for discover, search, details and videos lookups
+        self.cache = cache
+        # Filled from the genres table (genres.py) or fetch_genres(); never fetched on a lookup
+        self.set_genres({}, {})
+        # Independent requests (both halves of discover_mixed_media, the pages of a
+        # multi-page search) run on this pool; it is shared by every caller of the
+        # client, so at most max_concurrency fan-out requests are in flight at once
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='tmdb-fetch')
+        # Identical requests in flight at the same time share one upstream call, and
+        # every upstream attempt (retries included) takes a token from a bucket that
+        # refills at rate_limit requests per second; rate_limit=None turns it off
+        self._single_flight = SingleFlight()
+        self.rate_limiter = TokenBucket(rate_limit, rate_burst) if rate_limit else None
 
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
 
-    def _make_request(self, endpoint, params=None):
+    def _fan_out(self, calls):
+        '''Run independent request callables concurrently; results in call order, None for any that raised.'''
+        futures = [self._executor.submit(call) for call in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"TMDB request failed, continuing with partial results: {e}")
+                results.append(None)
+        return results
+
+    def _backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt + 1"""
+        if retry_after:
+            try:
+                seconds = float(retry_after)
+            except ValueError:
+                # Retry-After may also be an HTTP date
+                try:
+                    seconds = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    seconds = None
+            if seconds is not None:
+                return min(max(seconds, 0), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def _get(self, endpoint, params=None):
+        """GET an endpoint through the pooled session, retrying transient failures.
+
+        Returns the last response (which may still be an error status) and
+        re-raises the connection error or timeout once retries run out.
+        Concurrent calls for the same endpoint and parameters share one request
+        and its response.
+        """
+        key = (endpoint, tuple(sorted((name, str(value)) for name, value in (params or {}).items())))
+        return self._single_flight.do(key, lambda: self._send(endpoint, params))
+
+    def _send(self, endpoint, params=None):
         url = f"{self.base_url}{endpoint}"
-        if params is None:
-            params = {}
-        params['api_key'] = self.api_key
-    
+        params = dict(params or {}, api_key=self.api_key)
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, headers=self.headers, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"TMDB request to {endpoint} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                print(f"TMDB request to {endpoint} returned {response.status_code}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+    def stats(self):
+        """Request coalescing and rate limiter metrics"""
+        return {
+            'single_flight': self._single_flight.stats(),
+            'rate_limiter': self.rate_limiter.stats() if self.rate_limiter is not None else None
+        }
+
+    def _make_request(self, endpoint, params=None):
+        if self.cache is not None:
+            return self.cache.get(endpoint, params, lambda: self._fetch_json(endpoint, params))
+        return self._fetch_json(endpoint, params)
+
+    def _fetch_json(self, endpoint, params=None):
         try:
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self._get(endpoint, params)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -37,8 +146,8 @@ class TMDBClient:
             return None
 
 
-    def search_media(self, title, year=None, page=1, get_all_pages=False, max_results=1000):
-        '''Used TMDB's search endpoint to find movies by title.'''
+    def _search_page(self, title, page):
+        '''One page of /search/multi as (movie and TV results, total_pages, raw result count), or None.'''
         params = {
         "query": title,
         "page": page,
@@ -48,7 +157,7 @@ class TMDBClient:
         data = self._make_request("/search/multi", params=params)
     
         if not data or 'results' not in data:
-            return []
+            return None
         results = [
             item for item in data['results'] 
             if item.get('media_type') in ['movie', 'tv']
@@ -59,7 +168,34 @@ class TMDBClient:
             if item.get('media_type') == 'tv':
                 item['title'] = item.get('name')
     
-        return results
+        return results, data.get('total_pages', 1), len(data['results'])
+
+
+    def search_media(self, title, year=None, page=1, get_all_pages=False, max_results=1000):
+        '''Used TMDB's search endpoint to find movies by title.
+
+        With get_all_pages the pages after `page` are fetched concurrently, a
+        batch of at most max_concurrency at a time, stopping once max_results
+        results are in. Results keep page order; a page that fails is skipped.
+        '''
+        first = self._search_page(title, page)
+        if first is None:
+            return []
+        results, total_pages, per_page = first
+        next_page = page + 1
+        while get_all_pages and len(results) < max_results and next_page <= total_pages:
+            # Only request the pages still needed to reach max_results
+            needed = math.ceil((max_results - len(results)) / max(per_page, 1))
+            batch = list(range(next_page, min(next_page + min(self.max_concurrency, needed), total_pages + 1)))
+            pages = self._fan_out([lambda batch_page=batch_page: self._search_page(title, batch_page)
+                                   for batch_page in batch])
+            for batch_page, fetched in zip(batch, pages):
+                if fetched is None:
+                    print(f"Skipping search page {batch_page} for '{title}'")
+                    continue
+                results.extend(fetched[0])
+            next_page = batch[-1] + 1
+        return results[:max_results]
 
 
     def discover_movies(self, sort_by="popularity.desc", page=1):
@@ -84,6 +220,9 @@ class TMDBClient:
             "language": self.language,
         }
         data = self._make_request("/discover/tv", params=params)
+        if not data or 'results' not in data:
+            return []
+        
         for item in data["results"]:
             item['media_type'] = 'tv'
         
@@ -91,10 +230,14 @@ class TMDBClient:
 
 
     def discover_mixed_media(self, page=1):
-        '''Fetches both popular movies and TV shows, combines and sorts them by popularity.'''
+        '''Fetches both popular movies and TV shows, combines and sorts them by popularity.
+
+        The two lists are fetched concurrently; if one fails the other is still returned.
+        '''
         
-        movies = self.discover_movies(page=page)
-        tv_shows = self.discover_tv_shows(page=page)
+        movies, tv_shows = self._fan_out([lambda: self.discover_movies(page=page),
+                                          lambda: self.discover_tv_shows(page=page)])
+        movies, tv_shows = movies or [], tv_shows or []
         
         
         for tv_show in tv_shows:
@@ -109,38 +252,38 @@ class TMDBClient:
 
 
     def fetch_genres(self):
-        '''Fetches the list of movie and TV genres from TMDB and stores them in dictionaries.'''
-     
-        movie_url = f"{self.base_url}/genre/movie/list?api_key={self.api_key}&language={self.language}"
-        movie_response = requests.get(movie_url, headers=self.headers)
-        
-    
-        tv_url = f"{self.base_url}/genre/tv/list?api_key={self.api_key}&language={self.language}"
-        tv_response = requests.get(tv_url, headers=self.headers)
-        
-        self.movie_genre_map = {}
-        self.tv_genre_map = {}
-        self.genre_map = {}  
-
-        if movie_response.status_code == 200:
-            data = movie_response.json()
-            self.movie_genre_map = {genre['id']: genre['name'] for genre in data.get('genres', [])}
-            self.genre_map.update(self.movie_genre_map)
-        else:
-            print(f"Error fetching movie genres: {movie_response.status_code}")
+        '''Fetches the list of movie and TV genres from TMDB and stores them in dictionaries.
 
-        if tv_response.status_code == 200:
-            data = tv_response.json()
-            self.tv_genre_map = {genre['id']: genre['name'] for genre in data.get('genres', [])}
-            self.genre_map.update(self.tv_genre_map)
-        else:
+        Returns True when both lists were fetched; otherwise the current maps are kept.
+        '''
+        try:
+            movie_response = self._get("/genre/movie/list", {"language": self.language})
+            tv_response = self._get("/genre/tv/list", {"language": self.language})
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching genres: {e}")
+            return False
+
+        if movie_response.status_code != 200:
+            print(f"Error fetching movie genres: {movie_response.status_code}")
+            return False
+        if tv_response.status_code != 200:
             print(f"Error fetching TV genres: {tv_response.status_code}")
+            return False
+        self.set_genres({genre['id']: genre['name'] for genre in movie_response.json().get('genres', [])},
+                        {genre['id']: genre['name'] for genre in tv_response.json().get('genres', [])})
+        return True
+
+    def set_genres(self, movie_genre_map, tv_genre_map):
+        '''Replace the genre maps; genre_map is swapped in whole so readers never see it half-built.'''
+        genre_map = dict(movie_genre_map)
+        genre_map.update(tv_genre_map)
+        self.movie_genre_map = dict(movie_genre_map)
+        self.tv_genre_map = dict(tv_genre_map)
+        self.genre_map = genre_map
 
 
     def genre_ids_to_names(self, genre_ids):
         '''Convert a list of genre IDs to their names using the combined genre_map.'''
-        if not hasattr(self, 'genre_map'):
-            self.fetch_genres()
         return [self.genre_map.get(genre_id, "Unknown") for genre_id in genre_ids]
 
 
@@ -156,12 +299,15 @@ class TMDBClient:
         from TMDb, then sort by our type preference.
         """
         endpoint = f"/{media_type}/{media_id}/videos"
-        url = f"{self.base_url}{endpoint}"
-        params = {"api_key": self.api_key, "language": self.language}
-        resp = requests.get(url, headers=self.headers, params=params)
-        resp.raise_for_status()
+        params = {"language": self.language}
+
+        def fetch():
+            resp = self._get(endpoint, params)
+            resp.raise_for_status()
+            return resp.json()
 
-        videos = resp.json().get("results", [])
+        data = self.cache.get(endpoint, params, fetch) if self.cache is not None else fetch()
+        videos = data.get("results", [])
         # Keep only YouTube
         yt = [v for v in videos if v.get("site") == "YouTube"]
 
@@ -175,4 +321,21 @@ class TMDBClient:
         Fetch YouTube video data (trailers, teasers, etc.) for a specific movie
         from TMDb, then sort by our type preference.
         """
-        return self.get_media_videos(movie_id, "movie")
\ No newline at end of file
+        return self.get_media_videos(movie_id, "movie")
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client(**options):
+    """The process-wide TMDBClient, created on first use from TMDB_API_KEY (None without a key).
+
+    options are passed to TMDBClient by the call that creates it and ignored afterwards.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            load_dotenv()
+            api_key = os.getenv("TMDB_API_KEY")
+            if api_key:
+                _client = TMDBClient(api_key=api_key, **options)
+        return _client
@@ -4,7 +4,518 @@ Test script for the movie recommendation model
 """
 
 import sqlite3
-from model import MovieRecommender
+import time
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from model import MovieRecommender, ModelManager, RecommendationCache
+
+SAMPLE_MOVIES = [
+    (1, 'Space Voyage', 'Astronauts travel through space to a distant planet'),
+    (2, 'Planet Rescue', 'A crew must rescue astronauts stranded on a distant planet'),
+    (3, 'Haunted Manor', 'A family moves into a haunted manor full of ghosts'),
+    (4, 'Ghost Hunters', 'Friends investigate ghosts in an old haunted house'),
+    (5, 'Kitchen Wars', 'Rival chefs compete in a cooking competition'),
+    (6, 'Baking Season', 'An amateur baker enters a cooking competition'),
+]
+
+def make_test_db(path, movies=SAMPLE_MOVIES, ratings=()):
+    """Create a small movie_ranker-style database for tests"""
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE movies (id INTEGER PRIMARY KEY, backdrop_path TEXT, poster_path TEXT,
+        original_language TEXT, title TEXT NOT NULL, overview TEXT, release_date TEXT, vote_average REAL,
+        vote_count INTEGER, popularity REAL, media_type TEXT NOT NULL)""")
+    conn.execute("CREATE TABLE user_movies (user_id INTEGER, movie_id INTEGER, rating REAL NOT NULL, PRIMARY KEY (user_id, movie_id))")
+    conn.executemany(
+        "INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) VALUES (?, ?, ?, ?, ?, ?, 'movie')",
+        [(movie_id, title, overview, 5.0 + movie_id, 100 * movie_id, 10.0 * movie_id) for movie_id, title, overview in movies]
+    )
+    conn.executemany("INSERT INTO user_movies (user_id, movie_id, rating) VALUES (?, ?, ?)", ratings)
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def test_neighbor_index_matches_exact_similarity(tmp_path):
+    """The top-k neighbour index should agree with a dense cosine similarity ranking"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2, chunk_size=4)
+
+    dense = cosine_similarity(recommender.tfidf_matrix)
+    np.fill_diagonal(dense, -1)
+    expected_scores = -np.sort(-dense, axis=1)[:, :2]
+
+    assert recommender.neighbor_indices.shape == (len(SAMPLE_MOVIES), 2)
+    assert np.allclose(recommender.neighbor_scores, expected_scores, atol=1e-6)
+    assert recommender.neighbor_indices[0][0] == 1
+    assert recommender.neighbor_indices[2][0] == 3
+
+def test_update_movies_matches_full_rebuild(tmp_path):
+    """Incrementally adding a movie should give the same neighbours as a rebuild on the same vocabulary"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (7, 'Ghost Planet', 'Astronauts find ghosts haunted on a distant planet', 7, 10, 1, 'movie')")
+    conn.commit()
+    conn.close()
+
+    vectorizer = recommender.vectorizer
+    recommender.update_movies([7])
+    assert recommender.vectorizer is vectorizer
+    assert len(recommender.catalog) == len(SAMPLE_MOVIES) + 1
+    assert recommender.tfidf_matrix.shape[0] == len(SAMPLE_MOVIES) + 1
+
+    dense = cosine_similarity(recommender.tfidf_matrix)
+    np.fill_diagonal(dense, -1)
+    expected_scores = -np.sort(-dense, axis=1)[:, :2]
+    assert np.allclose(recommender.neighbor_scores, expected_scores, atol=1e-6)
+
+    # Unknown words push the drift past the threshold and trigger a full refit
+    recommender.drift_threshold = 0.0
+    recommender.drift_min_tokens = 0
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE movies SET overview = 'zebras juggle marmalade' WHERE id = 7")
+    conn.commit()
+    conn.close()
+    recommender.update_movies([7])
+    assert recommender.vectorizer is not vectorizer
+    assert 'zebras' in recommender.vectorizer.vocabulary_
+
+def test_vocabulary_drift_ignores_small_samples_and_rare_terms(tmp_path):
+    """Only enough new tokens, of terms frequent enough to make the max_features cut, trigger a refit"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2, max_features=3, drift_threshold=0.0)
+    vectorizer = recommender.vectorizer
+    assert recommender.vocabulary_cutoff == 2
+
+    def set_movie_7(overview):
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT OR REPLACE INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                     "VALUES (7, 'Zebra Planet', ?, 7, 10, 1, 'movie')", (overview,))
+        conn.commit()
+        conn.close()
+        recommender.update_movies([7])
+
+    # Below drift_min_tokens nothing counts yet
+    set_movie_7('Astronauts meet marmalade zebras')
+    assert recommender.vectorizer is vectorizer and recommender.vocabulary_drift() == 0.0
+
+    # Terms seen fewer times than the rarest vocabulary term would not survive a refit either
+    recommender.drift_min_tokens = 0
+    assert recommender.vocabulary_drift() == 0.0
+    set_movie_7('Zebras juggle on a planet')
+    assert recommender.vectorizer is not vectorizer
+
+def test_model_manager_swaps_in_new_version(tmp_path):
+    """Background updates build a separate model and leave the served version untouched"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    manager = ModelManager(db_path=db_path, update_delay=0, n_neighbors=2)
+    first = manager.load()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (7, 'Chef Ghosts', 'Ghosts enter a cooking competition', 7, 10, 1, 'movie')")
+    conn.commit()
+    conn.close()
+
+    manager.request_update([7])
+    manager.request_update([7])
+    assert manager.wait_until_idle(timeout=30)
+
+    assert manager.recommender is not first
+    assert manager.recommender.version > first.version
+    assert len(first.catalog) == len(SAMPLE_MOVIES)
+    assert len(manager.recommender.catalog) == len(SAMPLE_MOVIES) + 1
+
+def test_artifacts_are_reused_and_memory_mapped(tmp_path):
+    """A saved artifact is loaded for an unchanged catalog and ignored once the catalog changes"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    artifact_dir = str(tmp_path / 'artifacts')
+    built = MovieRecommender(db_path=db_path, n_neighbors=2, artifact_dir=artifact_dir)
+    loaded = MovieRecommender(db_path=db_path, n_neighbors=2, artifact_dir=artifact_dir)
+
+    assert loaded.fingerprint == built.fingerprint
+    assert isinstance(loaded.neighbor_indices, np.memmap)
+    assert not loaded.neighbor_indices.flags.writeable
+    assert np.array_equal(loaded.neighbor_indices, built.neighbor_indices)
+    assert (loaded.tfidf_matrix != built.tfidf_matrix).nnz == 0
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE movies SET vote_count = 1 WHERE id = 1")
+    conn.commit()
+    conn.close()
+    assert loaded.current_fingerprint() != built.fingerprint
+
+    # The offline build publishes its artifact for serving processes to pick up
+    from model import main, read_current_artifact
+    main(['build-artifacts', '--db', db_path, '--artifact-dir', artifact_dir, '--neighbors', '2'])
+    assert read_current_artifact(artifact_dir) == loaded.current_fingerprint()
+
+def test_recommend_excludes_inputs_and_rated_movies(tmp_path):
+    """Ranking returns the best-scoring movies that are neither inputs nor excluded"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=3)
+
+    scores = np.array([0.9, 0.1, 0.5, 0.7, 0.0, 0.3])
+    excluded = np.array([True, False, False, False, False, True])
+    assert recommender.top_candidates(scores, excluded, 2).tolist() == [3, 2]
+    assert recommender.top_candidates(scores, excluded, 10).tolist() == [3, 2, 1, 4]
+
+    results = recommender.recommend(['Space Voyage'], top_n=5, exclude_movie_ids={2, 3})
+    ids = {movie['id'] for movie in results}
+    assert ids == {4, 5, 6}
+
+def test_batch_recommend_writes_top_unrated_movies(tmp_path):
+    """The batch job stores each user's best unrated movies, sharded by user id"""
+    db_path = make_test_db(tmp_path / 'movies.db', ratings=[(1, 1, 9.0), (1, 3, 2.0), (2, 3, 8.0), (3, 5, 1.0)])
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=3)
+
+    assert recommender.batch_recommend(top_n=2, shard=1, num_shards=2) == 1
+    assert recommender.batch_recommend(top_n=2, shard=0, num_shards=2) == 1
+
+    import database
+    db = database.MovieRankerDB(db_path)
+    first = [row['id'] for row in db.get_user_recommendations(1)]
+    second = [row['id'] for row in db.get_user_recommendations(2)]
+    assert first[0] == 2 and 1 not in first and 3 not in first
+    assert second[0] == 4 and 3 not in second
+    assert db.get_user_recommendations(3) == []
+
+    # A new rating invalidates the user's precomputed list
+    db.add_user_movies_by_id(1, 2, 7.0)
+    assert db.get_user_recommendations(1) == []
+
+def test_recommendation_cache_follows_rating_watermark(tmp_path):
+    """Rating changes bump the watermark and evict the user's cached lists"""
+    import database
+    db = database.MovieRankerDB(make_test_db(tmp_path / 'movies.db'))
+    cache = RecommendationCache(maxsize=2)
+    database.MovieRankerDB.add_rating_listener(cache.invalidate)
+    try:
+        watermark = db.get_rating_watermark(1)
+        assert cache.get(1, 1, watermark) is None
+        cache.put(1, 1, watermark, [{'id': 2}])
+        cache.put(2, 1, 0, [{'id': 3}])
+        assert cache.get(1, 1, watermark) == [{'id': 2}]
+
+        db.add_user_movies_by_id(1, 4, 8.0)
+        assert db.get_rating_watermark(1) == watermark + 1
+        assert cache.get(1, 1, watermark) is None
+        assert cache.get(2, 1, 0) == [{'id': 3}]
+        assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 2
+    finally:
+        database.MovieRankerDB.rating_listeners.remove(cache.invalidate)
+
+def test_user_profile_is_rating_weighted_and_updated_incrementally(tmp_path):
+    """Profiles weight movies by rating and absorb rating changes without a rebuild"""
+    db_path = make_test_db(tmp_path / 'movies.db', ratings=[(1, 1, 10.0), (1, 3, 2.0)])
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=3)
+
+    profile = recommender.get_user_profile(1, watermark=0)
+    scores = recommender.score_profile(profile)
+    assert scores[1] > 0 > scores[3]
+
+    recommender.update_user_rating(1, 5, 9.0, watermark=1)
+    updated = recommender.get_user_profile(1, watermark=1)
+    rebuilt = recommender._build_profile({1: 10.0, 3: 2.0, 5: 9.0})
+    assert updated['ratings'] == rebuilt['ratings']
+    assert np.allclose(recommender.score_profile(updated), recommender.score_profile(rebuilt))
+
+    ids = {movie['id'] for movie in recommender.recommend_for_user(1, top_n=3, watermark=1)}
+    assert ids.isdisjoint({1, 3}) and 2 in ids
+
+def test_collaborative_similarities_and_incremental_ratings(tmp_path):
+    """Item-item similarities follow co-ratings, and add_rating matches a rebuild"""
+    from collaborative import CollaborativeRecommender
+    ratings = [(1, 1, 9.0), (1, 2, 8.0), (2, 1, 10.0), (2, 2, 9.0), (2, 5, 2.0), (3, 5, 9.0), (3, 6, 8.0)]
+    db_path = make_test_db(tmp_path / 'movies.db', ratings=ratings)
+    collaborative = CollaborativeRecommender(db_path=db_path, n_neighbors=2)
+
+    movie_ids, scores = collaborative.score_ratings({1: 10.0})
+    scores = dict(zip(movie_ids.tolist(), scores))
+    assert scores[2] > 0 and scores[6] == 0
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO user_movies VALUES (4, 6, 9.0)")
+    conn.execute("INSERT INTO user_movies VALUES (4, 2, 9.0)")
+    conn.commit()
+    conn.close()
+    collaborative.add_rating(4, 6, 9.0)
+    collaborative.add_rating(4, 2, 9.0)
+    rebuilt = CollaborativeRecommender(db_path=db_path, n_neighbors=2)
+    assert np.allclose(collaborative.neighbor_matrix().toarray(), rebuilt.neighbor_matrix().toarray(), atol=1e-6)
+
+    # Changed and removed ratings only patch the stored columns, and still match a rebuild
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE user_movies SET rating = 3.0 WHERE user_id = 1 AND movie_id = 2")
+    conn.execute("DELETE FROM user_movies WHERE user_id = 2 AND movie_id = 5")
+    conn.commit()
+    conn.close()
+    collaborative.add_rating(1, 2, 3.0)
+    collaborative.add_rating(2, 5, None)
+    rebuilt = CollaborativeRecommender(db_path=db_path, n_neighbors=2)
+    assert np.allclose(collaborative.neighbor_matrix().toarray(), rebuilt.neighbor_matrix().toarray(), atol=1e-6)
+    assert np.allclose(collaborative.item_sq_norms, rebuilt.item_sq_norms)
+
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2, cf_weight=0.5)
+    assert recommender.collaborative is not None
+    content = np.zeros(len(recommender.movie_ids))
+    blended = recommender.blend_scores(content, {1: 10.0})
+    assert blended[recommender.id_to_row[2]] > 0
+
+def test_ann_index_recall_and_persistence(tmp_path):
+    """LSH candidates recover most exact neighbours and survive a save/load round trip"""
+    from ann import RandomProjectionLSH
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 32))
+    vectors = centers[rng.integers(0, 20, 2000)] + 0.3 * rng.standard_normal((2000, 32))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    index = RandomProjectionLSH(n_tables=8, n_probes=1).fit(vectors)
+    assert index.recall_at_k(k=10, n_queries=50)['recall'] > 0.8
+
+    index.save(tmp_path / 'ann.npz')
+    loaded = RandomProjectionLSH.load(tmp_path / 'ann.npz', vectors)
+    assert np.array_equal(loaded.candidates(vectors[0]), index.candidates(vectors[0]))
+
+    db_path = make_test_db(tmp_path / 'movies.db')
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2, ann_tables=4, ann_bits=1)
+    assert recommender.ann_index is not None
+    assert recommender.recommend(['Space Voyage'], top_n=5)
+
+def test_svd_embeddings_score_like_tfidf(tmp_path):
+    """Float32 SVD embeddings keep the ranking, survive artifacts, and update incrementally"""
+    db_path = make_test_db(tmp_path / 'movies.db', ratings=[(1, 1, 10.0), (1, 3, 2.0)])
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2, embedding_dim=4,
+                                   artifact_dir=str(tmp_path / 'artifacts'))
+    assert recommender.embeddings.dtype == np.float32
+    assert recommender.embeddings.flags['C_CONTIGUOUS']
+    assert np.allclose(np.linalg.norm(recommender.embeddings, axis=1), 1.0, atol=1e-5)
+    assert recommender.neighbor_indices[0][0] == 1
+
+    scores = recommender.score_profile(recommender.get_user_profile(1))
+    assert scores[1] > 0 > scores[3]
+    report = recommender.embedding_report(k=2)
+    assert report['neighbor_overlap'] > 0.5 and report['users'] == 1
+
+    loaded = MovieRecommender(db_path=db_path, n_neighbors=2, embedding_dim=4,
+                              artifact_dir=str(tmp_path / 'artifacts'))
+    assert isinstance(loaded.embeddings, np.memmap)
+    assert np.allclose(loaded.score_profile(loaded.get_user_profile(1)), scores, atol=1e-6)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (7, 'Ghost Manor', 'A haunted manor full of ghosts', 7, 10, 1, 'movie')")
+    conn.commit()
+    conn.close()
+    loaded.update_movies([7])
+    assert loaded.embeddings.shape == (7, 4)
+    assert loaded.neighbor_indices[6][0] in (2, 3)
+
+def test_model_managers_share_published_artifacts(tmp_path):
+    """Processes sharing an artifact dir publish batched updates and pick up each other's models"""
+    import os
+    from model import read_current_artifact
+    db_path = make_test_db(tmp_path / 'movies.db', ratings=[(1, 1, 9.0), (1, 2, 8.0), (2, 3, 9.0)])
+    artifact_dir = str(tmp_path / 'artifacts')
+    options = dict(poll_interval=0.05, update_delay=0.3, artifact_dir=artifact_dir, n_neighbors=2, cf_weight=0.5)
+    first = ModelManager(db_path, **options)
+    second = ModelManager(db_path, **options)
+    first.load()
+    second.load()
+    assert read_current_artifact(artifact_dir) == first.recommender.artifact_name
+    assert isinstance(second.recommender.neighbor_indices, np.memmap)
+    assert isinstance(second.recommender.catalog.ids, np.memmap)
+    assert second.recommender.catalog.records([0]) == first.recommender.catalog.records([0])
+    collaborative = second.recommender.collaborative
+    # second has finished checking the catalog fingerprint of the model it mapped in
+    assert second.wait_until_idle(timeout=30)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (7, 'Ghost Planet', 'Astronauts find ghosts on a distant planet', 7, 10, 1, 'movie')")
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (8, 'Ghost Kitchen', 'Chefs find ghosts in a cooking competition', 7, 10, 1, 'movie')")
+    conn.commit()
+    conn.close()
+    first.request_update([7])
+    first.request_update([8])
+    assert first.wait_until_idle(timeout=30)
+    published = read_current_artifact(artifact_dir)
+    assert published == first.recommender.artifact_name and 8 in first.recommender.id_to_row
+    # Both updates went into one incremental build and one artifact
+    assert len([name for name in os.listdir(artifact_dir) if name.startswith('update-')]) == 1
+
+    deadline = time.time() + 10
+    while second.recommender.artifact_name != published and time.time() < deadline:
+        time.sleep(0.05)
+    assert 7 in second.recommender.id_to_row
+    # The incremental update reuses the CF model instead of re-reading every rating
+    assert second.recommender.collaborative is collaborative
+
+def test_startup_maps_published_model_and_fingerprints_catalog_later(tmp_path, monkeypatch):
+    """Startup loads the published artifact without hashing the catalog; the worker hashes it afterwards"""
+    import threading
+    import model
+    from model import read_current_artifact
+    db_path = make_test_db(tmp_path / 'movies.db')
+    options = dict(poll_interval=0.05, update_delay=0, artifact_dir=str(tmp_path / 'artifacts'), n_neighbors=2)
+    published = ModelManager(db_path, **options).load()
+
+    fingerprint_threads = []
+    catalog_fingerprint = model.catalog_fingerprint
+    def recording_fingerprint(conn, model_signature):
+        fingerprint_threads.append(threading.current_thread().name)
+        return catalog_fingerprint(conn, model_signature)
+    monkeypatch.setattr(model, 'catalog_fingerprint', recording_fingerprint)
+
+    # An edit in place keeps the watermark, so the published model is served until the check
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE movies SET overview = 'Chefs cook for ghosts in a haunted kitchen' WHERE id = 5")
+    conn.commit()
+    conn.close()
+    manager = ModelManager(db_path, **options)
+    assert manager.load().artifact_name == published.artifact_name
+    assert isinstance(manager.recommender.neighbor_indices, np.memmap)
+    assert manager.wait_until_idle(timeout=30)
+    assert 'MainThread' not in fingerprint_threads and fingerprint_threads
+    assert manager.recommender.fingerprint != published.fingerprint
+    assert read_current_artifact(options['artifact_dir']) == manager.recommender.artifact_name
+
+    # A new title changes the watermark, so startup builds instead of serving the stale model
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (7, 'Ghost Planet', 'Astronauts find ghosts on a distant planet', 7, 10, 1, 'movie')")
+    conn.commit()
+    conn.close()
+    assert 7 in ModelManager(db_path, **options).load().id_to_row
+
+def test_streaming_build_matches_in_memory_tfidf(tmp_path):
+    """Building in small cursor batches gives the same vectors as fitting the whole table at once"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    db_path = make_test_db(tmp_path / 'movies.db')
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2, build_batch_size=4)
+
+    documents = [f"{title} {overview}" for _, title, overview in SAMPLE_MOVIES]
+    vectorizer = TfidfVectorizer(stop_words='english')
+    expected = vectorizer.fit_transform(documents)
+    assert recommender.vectorizer.vocabulary_ == vectorizer.vocabulary_
+    assert np.allclose(recommender.tfidf_matrix.toarray(), expected.toarray())
+    assert recommender.movie_ids.tolist() == [movie_id for movie_id, _, _ in SAMPLE_MOVIES]
+
+def test_popular_movies_walk_precomputed_ranking(tmp_path):
+    """Popular picks come from the precomputed ranking and its slices"""
+    db_path = make_test_db(tmp_path / 'movies.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE genre_map (movie_id INTEGER, genre_id INTEGER, PRIMARY KEY (movie_id, genre_id))")
+    conn.executemany("INSERT INTO genre_map VALUES (?, ?)", [(1, 878), (2, 878), (3, 27), (4, 27)])
+    conn.execute("UPDATE movies SET media_type = 'tv' WHERE id IN (2, 5)")
+    conn.commit()
+    conn.close()
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2)
+
+    # Test movies get more popular with their id
+    assert recommender.movie_ids[recommender.popular_order].tolist() == [6, 5, 4, 3, 2, 1]
+    popular = recommender.get_popular_movies(top_n=2, exclude_movie_ids={6}, random_seed=1)
+    assert {movie['id'] for movie in popular} <= {5, 4, 3, 2}
+    assert len(popular) == 2
+
+    assert recommender.movie_ids[recommender.popularity_ranking(genre_id=27)].tolist() == [4, 3]
+    assert recommender.movie_ids[recommender.popularity_ranking(media_type='tv')].tolist() == [5, 2]
+    assert recommender.movie_ids[recommender.popularity_ranking('tv', 878)].tolist() == [2]
+    ids = [movie['id'] for movie in recommender.get_popular_movies(top_n=5, genre_id=878, exclude_movie_ids={2})]
+    assert ids == [1]
+
+def test_catalog_records_match_dataframe_path(tmp_path):
+    """The columnar catalog gives the same result dicts as the old DataFrame path, with O(1) id lookup"""
+    from catalog import MovieCatalog, RESULT_FIELDS
+    rows = [(1, 'Space Voyage', 'Astronauts travel', 7.5, 120, 30.5, '/a.jpg', 'movie'),
+            (2, 'Ghost Hunters', 'Friends investigate ghosts', None, None, 2.0, None, 'tv')]
+    catalog = MovieCatalog.from_rows(rows)
+    expected = catalog.to_dataframe().iloc[[1, 0]][list(RESULT_FIELDS)].to_dict(orient='records')
+    records = catalog.records([1, 0])
+    assert records[1] == expected[1]
+    assert records[0]['vote_count'] == 0 and records[0]['poster_path'] is None
+    assert catalog.get(2).title == 'Ghost Hunters' and catalog.get(3) is None
+    assert catalog.get(1).to_dict() == expected[1]
+
+    updated = catalog.with_rows([(3, 'Baking Season', 'Bakers compete', 6.0, 10, 1.0, None, 'movie')], [2])
+    assert len(updated) == 3 and len(catalog) == 2
+    assert updated.row_of(3) == 2 and updated.title_to_row['Baking Season'] == 2
+
+class FakeTMDBClient:
+    """Stands in for search.TMDBClient and counts the API calls made"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def discover_movies(self, page=1):
+        self.calls += 1
+        return [{'id': 100 + i, 'title': f'Popular {i}', 'overview': 'A blockbuster', 'popularity': 50.0 - i,
+                 'genre_ids': [28], 'media_type': 'movie'} for i in range(3)]
+
+    def search_media(self, title):
+        self.calls += 1
+        return [{'id': 200, 'title': 'Avengers', 'overview': 'Heroes assemble', 'media_type': 'movie'}]
+
+def test_fallback_pool_is_refreshed_offline_and_read_locally(tmp_path):
+    """Short recommendation lists are topped up from the stored pool without any API calls"""
+    from fallback import FallbackCandidatePool
+    db_path = make_test_db(tmp_path / 'movies.db', movies=SAMPLE_MOVIES[:2], ratings=[(1, 1, 9.0)])
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=1)
+    client = FakeTMDBClient()
+    pool = FallbackCandidatePool(db_path=db_path, search_terms=['Avengers'])
+    assert pool.seconds_until_stale() == 0
+    assert pool.refresh(client) == 4
+    assert pool.seconds_until_stale() > 0
+
+    calls = client.calls
+    ids = [movie['id'] for movie in recommender.recommend_for_user(1, top_n=4)]
+    assert client.calls == calls
+    assert ids == [2, 100, 101, 102]
+
+def test_fallback_pool_retries_soon_after_an_empty_refresh(tmp_path):
+    """An empty fetch is retried after a short, growing backoff instead of a whole refresh_interval"""
+    from fallback import FallbackCandidatePool
+    db_path = make_test_db(tmp_path / 'movies.db')
+    client = FakeTMDBClient()
+    results = {'discover': []}
+    client.discover_movies = lambda page=1: results['discover']
+    pool = FallbackCandidatePool(db_path=db_path, search_terms=[], retry_delay=0.05, max_retry_delay=0.2)
+    pool.start(client)
+    try:
+        deadline = time.time() + 5
+        while pool.failures < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert pool.failures >= 2 and 0.05 < pool.seconds_until_retry() <= 0.2
+
+        results['discover'] = FakeTMDBClient().discover_movies()
+        while (pool.failures or pool.seconds_until_stale() == 0) and time.time() < deadline:
+            time.sleep(0.01)
+        assert pool.seconds_until_stale() > 0 and pool.failures == 0
+    finally:
+        pool.stop()
+
+def test_genre_filters_mask_recommendations(tmp_path):
+    """Genre bitsets from genre_map filter live recommendations and popular fallbacks"""
+    db_path = make_test_db(tmp_path / 'movies.db', ratings=[(1, 1, 10.0), (1, 3, 9.0)])
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE genre_map (movie_id INTEGER, genre_id INTEGER, PRIMARY KEY (movie_id, genre_id))")
+    conn.executemany("INSERT INTO genre_map VALUES (?, ?)",
+                     [(1, 878), (2, 878), (2, 12), (3, 27), (4, 27), (5, 35), (6, 35)])
+    conn.commit()
+    conn.close()
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=2)
+
+    rows = recommender.id_to_row
+    mask = recommender.genre_filter_mask(include_genres=[878, 27], exclude_genres=[12])
+    assert [movie_id for movie_id, row in rows.items() if not mask[row]] == [1, 3, 4]
+
+    ids = {movie['id'] for movie in recommender.recommend_for_user(1, top_n=3, exclude_genres=[27])}
+    assert ids and ids.isdisjoint({1, 3, 4})
+    ids = {movie['id'] for movie in recommender.recommend_for_user(1, top_n=3, include_genres=[35])}
+    assert ids == {5, 6}
+    assert recommender.recommend_for_user(1, top_n=3, include_genres=[99]) == []
 
 def test_model():
     """Test the recommendation model"""
@@ -67,5 +578,77 @@ def test_model():
     except Exception as e:
         print(f"Error testing model: {e}")
 
+def test_similar_titles_table_follows_published_models(tmp_path):
+    """The movie_neighbors table mirrors the live model's neighbour index; building a model never writes it"""
+    import database
+    db_path = make_test_db(tmp_path / 'movies.db')
+    db = database.MovieRankerDB(db_path)
+    MovieRecommender(db_path=db_path, n_neighbors=2)
+    assert db.get_movie_neighbors(1) == []
+
+    manager = ModelManager(db_path=db_path, update_delay=0, n_neighbors=2)
+    recommender = manager.load()
+
+    similar = [row['id'] for row in db.get_movie_neighbors(1)]
+    expected = [recommender.movie_ids[index] for index, score
+                in zip(recommender.neighbor_indices[0], recommender.neighbor_scores[0]) if index >= 0 and score > 0]
+    assert similar == expected
+    assert similar[0] == 2
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO movies (id, title, overview, vote_average, vote_count, popularity, media_type) "
+                 "VALUES (7, 'Ghost Planet', 'Astronauts rescue a crew on a distant planet', 7, 10, 1, 'movie')")
+    conn.commit()
+    conn.close()
+    manager.request_update([7])
+    assert manager.wait_until_idle(timeout=30)
+
+    assert [row['id'] for row in db.get_movie_neighbors(7)][0] in {1, 2}
+    assert 7 in [row['id'] for row in db.get_movie_neighbors(2)]
+    # A negative or zero limit returns one title rather than every stored neighbour
+    assert len(db.get_movie_neighbors(2, limit=-1)) == 1
+    assert len(db.get_movie_neighbors(2, limit=0)) == 1
+
+def test_benchmark_reports_latency_and_held_out_recall(tmp_path):
+    """The benchmark harness should hold ratings out of the database and find them well above chance"""
+    from benchmark import make_synthetic_db, run_benchmark
+    held_out = make_synthetic_db(str(tmp_path / 'bench.db'), 200, holdout_users=20)
+    conn = sqlite3.connect(tmp_path / 'bench.db')
+    stored = conn.execute("SELECT COUNT(*) FROM user_movies WHERE user_id = ? AND movie_id = ?",
+                          next(iter(held_out.items()))).fetchone()[0]
+    # Same generator as generate_data.py, genres included
+    assert conn.execute("SELECT COUNT(DISTINCT movie_id) FROM genre_map").fetchone()[0] == 200
+    conn.close()
+    assert 15 <= len(held_out) <= 20 and stored == 0
+
+    [result] = run_benchmark([200], isolate=False, k=10, queries=20, ratings_per_user=10, neighbors=10,
+                             ann_tables=0, embedding_dim=None, seed=0)
+    assert 15 <= result['queries'] <= 20
+    assert result['build_seconds'] > 0 and result['p99_ms'] >= result['p50_ms'] > 0
+    # Random picks would find about 10 / 190 of them
+    assert result['recall_at_k'] > 0.1
+
+def test_generated_database_is_zipf_skewed_and_buildable(tmp_path):
+    """Synthetic data should use the app schema, skew ratings towards popular titles and build a model"""
+    from generate_data import generate, GENRES
+    db_path = str(tmp_path / 'load.db')
+    counts = generate(db_path, n_movies=500, n_users=200, ratings_per_user=10, chat_share=0.5)
+    assert counts['movies'] == 500 and counts['users'] == 200
+    assert counts['user_movies'] > 1000 and counts['chat_history'] > 0
+
+    conn = sqlite3.connect(db_path)
+    assert {row[0] for row in conn.execute("SELECT DISTINCT genre_id FROM genre_map")} <= set(GENRES)
+    per_movie = sorted((row[0] for row in conn.execute("SELECT COUNT(*) FROM user_movies GROUP BY movie_id")),
+                       reverse=True)
+    ratings = [row[0] for row in conn.execute("SELECT rating FROM user_movies")]
+    conn.close()
+    # The 10% most rated titles get far more than 10% of the ratings
+    assert sum(per_movie[:50]) > 0.4 * counts['user_movies']
+    assert min(ratings) >= 1 and max(ratings) <= 10
+
+    recommender = MovieRecommender(db_path=db_path, n_neighbors=5)
+    assert len(recommender.catalog) == 500
+    assert len(recommender.recommend_for_user(1, top_n=5)) == 5
+
 if __name__ == "__main__":
     test_model() 
\ No newline at end of file
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Tests for the TMDB client against a local stub HTTP server
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from search import TMDBClient
+from tmdb_cache import ResponseCache
+from genres import GenreRefresher
+from throttle import TokenBucket
+
+GENRES = {'/genre/movie/list': {'genres': [{'id': 28, 'name': 'Action'}]},
+          '/genre/tv/list': {'genres': [{'id': 10759, 'name': 'Action & Adventure'}]}}
+
+class StubTMDBHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the client can reuse one connection
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path
+        page = parse_qs(url.query).get('page', ['1'])[0]
+        self.server.requests.append((path, self.client_address[1]))
+        # Responses queued for one page ("/search/multi?page=2") win over those for the whole path
+        queued = self.server.responses.get(f"{path}?page={page}") or self.server.responses.get(path)
+        status, headers, body, delay = queued.pop(0) if queued else (200, {}, GENRES.get(path, {'results': []}), 0)
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        time.sleep(delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    """Stub TMDB API; queue (status, headers, body, delay) responses per path (or path?page=N) in server.responses"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTMDBHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.responses = {}
+    # Most requests the stub was handling at the same time
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def make_client(server, **options):
+    options.setdefault('backoff_factor', 0.01)
+    return TMDBClient(api_key='test-key', base_url=f"http://127.0.0.1:{server.server_port}", **options)
+
+def test_requests_share_one_keep_alive_connection(stub_server):
+    """Genre lookups and later calls should all go over the same pooled connection"""
+    stub_server.responses['/discover/movie'] = [(200, {}, {'results': [{'id': 1, 'title': 'Iron Man'}]}, 0)] * 3
+    client = make_client(stub_server)
+    assert client.fetch_genres()
+    for _ in range(3):
+        assert [movie['id'] for movie in client.discover_movies()] == [1]
+
+    assert client.genre_map == {28: 'Action', 10759: 'Action & Adventure'}
+    assert len(stub_server.requests) == 5
+    assert len({port for _, port in stub_server.requests}) == 1
+
+def test_retries_server_errors_and_honours_retry_after(stub_server):
+    """429/5xx responses are retried, waiting as long as Retry-After asks"""
+    client = make_client(stub_server)
+    stub_server.responses['/discover/movie'] = [
+        (503, {}, {}, 0),
+        (429, {'Retry-After': '1'}, {}, 0),
+        (200, {}, {'results': [{'id': 7}]}, 0)
+    ]
+    start = time.perf_counter()
+    assert [movie['id'] for movie in client.discover_movies()] == [7]
+    assert time.perf_counter() - start >= 1.0
+    assert [path for path, _ in stub_server.requests].count('/discover/movie') == 3
+
+    # Once retries run out the last error is reported as no results
+    stub_server.responses['/discover/movie'] = [(500, {}, {}, 0)] * 3
+    assert make_client(stub_server, max_retries=2).discover_movies() == []
+    assert not stub_server.responses['/discover/movie']
+
+def test_read_timeouts_are_retried(stub_server):
+    """A response slower than the read timeout counts as a failed attempt"""
+    client = make_client(stub_server, read_timeout=0.2, max_retries=1)
+    stub_server.responses['/discover/movie'] = [(200, {}, {'results': [{'id': 1}]}, 1.0),
+                                                (200, {}, {'results': [{'id': 2}]}, 0)]
+    assert [movie['id'] for movie in client.discover_movies()] == [2]
+
+def test_backoff_is_jittered_and_capped(stub_server):
+    client = make_client(stub_server, backoff_factor=1, max_backoff=5)
+    delays = [client._backoff(3) for _ in range(200)]
+    assert all(0 <= delay <= 5 for delay in delays)
+    assert len(set(delays)) > 1
+    assert client._backoff(0, retry_after='120') == 5
+    assert client._backoff(0, retry_after='Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+def discover_ids(client):
+    return [movie['id'] for movie in client.discover_movies()]
+
+def test_cache_serves_repeats_from_memory_then_disk(stub_server, tmp_path):
+    """Repeat lookups skip TMDB; a second process finds the response in the shared disk tier"""
+    db_path = str(tmp_path / 'cache.db')
+    stub_server.responses['/discover/movie'] = [(200, {}, {'results': [{'id': 1}]}, 0)]
+    client = make_client(stub_server, cache=ResponseCache(db_path))
+    assert discover_ids(client) == discover_ids(client) == [1]
+
+    other_worker = make_client(stub_server, cache=ResponseCache(db_path))
+    assert discover_ids(other_worker) == [1]
+    assert [path for path, _ in stub_server.requests].count('/discover/movie') == 1
+    assert client.cache.stats()['memory_hits'] == 1 and client.cache.stats()['hit_rate'] == 0.5
+    assert other_worker.cache.stats()['disk_hits'] == 1
+
+def test_stale_responses_are_served_while_refreshing(stub_server, tmp_path):
+    """Past its TTL an entry is returned at once and refreshed in the background"""
+    cache = ResponseCache(str(tmp_path / 'cache.db'), ttls={'/discover/': 0}, stale_ttl=60)
+    client = make_client(stub_server, cache=cache)
+    stub_server.responses['/discover/movie'] = [(200, {}, {'results': [{'id': 1}]}, 0)] + \
+        [(200, {}, {'results': [{'id': 2}]}, 0)] * 2
+
+    def wait_for_refresh():
+        deadline = time.time() + 5
+        while cache._refreshing and time.time() < deadline:
+            time.sleep(0.01)
+
+    assert discover_ids(client) == [1]
+    assert discover_ids(client) == [1]
+    wait_for_refresh()
+    assert discover_ids(client) == [2]
+    wait_for_refresh()
+    assert cache.stats()['stale_hits'] == 2
+
+    # Beyond the stale window the response is fetched again, falling back to the old copy on failure
+    cache.stale_ttl = 0
+    stub_server.responses['/discover/movie'] = [(500, {}, {}, 0)] * 4
+    assert discover_ids(client) == [2]
+
+def test_genres_come_from_the_stored_table(stub_server, tmp_path):
+    """Clients never fetch genres themselves; a refresh stores them and other processes load the table"""
+    db_path = str(tmp_path / 'genres.db')
+    client = make_client(stub_server)
+    assert stub_server.requests == []
+    assert client.genre_ids_to_names([28]) == ['Unknown']
+
+    refresher = GenreRefresher(db_path, refresh_interval=60)
+    assert refresher.seconds_until_stale() == 0
+    assert refresher.refresh(client) == 2
+    assert refresher.seconds_until_stale() > 0
+
+    other_worker = make_client(stub_server)
+    assert refresher.load(other_worker)
+    assert other_worker.genre_ids_to_names([10759, 28]) == ['Action & Adventure', 'Action']
+    assert len(stub_server.requests) == 2
+
+    # A failed refresh keeps the stored genres
+    stub_server.responses['/genre/movie/list'] = [(404, {}, {}, 0)]
+    assert refresher.refresh(other_worker) == 0
+    assert other_worker.genre_map == {28: 'Action', 10759: 'Action & Adventure'}
+
+def test_failed_genre_refresh_is_retried_after_a_short_backoff(stub_server, tmp_path):
+    """The refresh thread retries a failed fetch well before the next scheduled refresh"""
+    stub_server.responses['/genre/movie/list'] = [(404, {}, {}, 0)]
+    client = make_client(stub_server)
+    refresher = GenreRefresher(str(tmp_path / 'genres.db'), refresh_interval=60, retry_delay=0.05)
+    refresher.start(client)
+    try:
+        deadline = time.time() + 5
+        while (refresher.failures or refresher.seconds_until_stale() == 0) and time.time() < deadline:
+            time.sleep(0.01)
+        assert refresher.seconds_until_stale() > 0
+        assert client.genre_map == {28: 'Action', 10759: 'Action & Adventure'}
+        assert [path for path, _ in stub_server.requests].count('/genre/movie/list') == 2
+    finally:
+        refresher.stop()
+
+def queue_search_pages(server, total_pages, per_page=20, delay=0):
+    """Queue search pages whose results are numbered by page: ids 100 * page + i"""
+    for page in range(1, total_pages + 1):
+        results = [{'id': 100 * page + i, 'media_type': 'movie'} for i in range(per_page)]
+        server.responses[f"/search/multi?page={page}"] = [
+            (200, {}, {'results': results, 'total_pages': total_pages}, delay)
+        ]
+
+def test_multi_page_search_is_concurrent_ordered_and_stops_at_max_results(stub_server):
+    """Later pages are fetched in parallel batches, keep page order and stop once max_results are in"""
+    client = make_client(stub_server, max_concurrency=4)
+    queue_search_pages(stub_server, total_pages=10, delay=0.3)
+    results = client.search_media('ghost', get_all_pages=True, max_results=90)
+
+    assert [movie['id'] for movie in results] == [100 * page + i for page in range(1, 6) for i in range(20)][:90]
+    # Page 1, then pages 2-5 in parallel, never more than max_concurrency at once
+    assert 1 < stub_server.max_in_flight <= 4
+    assert len(stub_server.requests) == 5
+    # Without get_all_pages only the requested page is fetched
+    assert len(client.search_media('ghost', page=7)) == 20
+
+def test_fan_out_failures_degrade_to_partial_results(stub_server):
+    """A failed page or a failed half of discover_mixed_media leaves the rest of the results intact"""
+    client = make_client(stub_server, max_retries=0)
+    queue_search_pages(stub_server, total_pages=3)
+    stub_server.responses['/search/multi?page=2'] = [(500, {}, {}, 0)]
+    ids = [movie['id'] for movie in client.search_media('ghost', get_all_pages=True)]
+    assert ids == [100 + i for i in range(20)] + [300 + i for i in range(20)]
+
+    stub_server.responses['/discover/movie'] = [(200, {}, {'results': [{'id': 1, 'popularity': 5}]}, 0)]
+    stub_server.responses['/discover/tv'] = [(503, {}, {}, 0)]
+    assert [media['id'] for media in client.discover_mixed_media()] == [1]
+
+def test_identical_concurrent_requests_share_one_upstream_call(stub_server):
+    """Callers asking for the same title at once wait on a single request to TMDB"""
+    client = make_client(stub_server, max_retries=0)
+    stub_server.responses['/movie/5'] = [(200, {}, {'id': 5, 'title': 'Iron Man'}, 0.3)]
+    barrier = threading.Barrier(8)
+    results = []
+
+    def fetch():
+        barrier.wait()
+        results.append(client._make_request('/movie/5'))
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [{'id': 5, 'title': 'Iron Man'}] * 8
+    # Every caller gets its own copy of the decoded response
+    assert len({id(result) for result in results}) == 8
+    assert [path for path, _ in stub_server.requests] == ['/movie/5']
+    assert client.stats()['single_flight'] == {'calls': 1, 'coalesced': 7, 'in_flight': 0}
+
+def test_token_bucket_holds_requests_to_the_configured_rate(stub_server):
+    """After the burst, upstream requests are spaced 1 / rate_limit seconds apart"""
+    client = make_client(stub_server, rate_limit=20, rate_burst=2)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client._make_request, args=(f"/movie/{movie_id}",)) for movie_id in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 2 requests go straight out, the other 10 wait for tokens at 20 per second
+    assert time.perf_counter() - start >= 0.45
+    assert len(stub_server.requests) == 12
+    stats = client.stats()['rate_limiter']
+    assert stats['acquired'] == 12 and stats['queue_depth'] == 0
+    assert stats['max_queue_depth'] >= 5 and stats['max_wait_ms'] >= 450
+
+    bucket = TokenBucket(rate=1, burst=1)
+    assert bucket.acquire(timeout=0.01)
+    assert not bucket.acquire(timeout=0.01)
+    assert bucket.stats()['rejected'] == 1
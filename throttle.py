@@ -0,0 +1,104 @@
+import threading
+import time
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter.
+
+    Tokens refill at `rate` per second up to `burst`. acquire() reserves a
+    token and sleeps until it is due, so callers are served in arrival order
+    and sustained throughput never exceeds rate. Queue depth and wait-time
+    metrics are kept for stats().
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, timeout=None):
+        """Take a token, blocking until one is free; False if that would take longer than timeout"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                self.rejected += 1
+                return False
+            # Reserve the token now (the balance may go negative) so later callers queue behind us
+            self._tokens -= 1
+            self.acquired += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait > 0:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+        if wait > 0:
+            time.sleep(wait)
+            with self._lock:
+                self.waiting -= 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting,
+                'acquired': self.acquired,
+                'rejected': self.rejected,
+                'mean_wait_ms': 1000 * self.total_wait / self.acquired if self.acquired else 0.0,
+                'max_wait_ms': 1000 * self.max_wait
+            }
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait and receive the same result (or exception). Nothing is
+    remembered once the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = function()
+            return call['result']
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
@@ -0,0 +1,171 @@
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+from cachetools import LRUCache
+import database
+
+# Seconds a cached response stays fresh, by endpoint prefix (the longest matching prefix wins)
+DEFAULT_TTLS = {
+    '/discover/': 30 * 60,
+    '/search/': 60 * 60,
+    '/movie/': 12 * 60 * 60,
+    '/tv/': 12 * 60 * 60
+}
+
+class ResponseCache:
+    """Two-tier cache of TMDB JSON responses keyed by endpoint and query parameters.
+
+    A per-process LRU of the response text sits in front of the tmdb_cache
+    table, which every process sharing the database (e.g. gunicorn workers)
+    reads and writes. Entries are fresh for their endpoint's TTL. For stale_ttl
+    seconds after that they are still served while one background refresh
+    fetches a new copy (stale-while-revalidate). Past that they are fetched
+    again before returning, but the old copy is still served if that fails.
+    """
+
+    def __init__(self, db_path='movie_ranker.db', maxsize=1024, ttls=None, default_ttl=60 * 60,
+                 stale_ttl=24 * 60 * 60):
+        self.db_path = db_path
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        # key -> (response JSON text, fetched_at); text so callers always get their own copy
+        self._memory = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        database.MovieRankerDB(db_path)
+
+    @staticmethod
+    def make_key(endpoint, params=None):
+        params = sorted((name, str(value)) for name, value in (params or {}).items() if name != 'api_key')
+        return f"{endpoint}?{urlencode(params)}"
+
+    def ttl_for(self, endpoint):
+        matches = [prefix for prefix in self.ttls if endpoint.startswith(prefix)]
+        return self.ttls[max(matches, key=len)] if matches else self.default_ttl
+
+    def get(self, endpoint, params, fetch):
+        """Cached response for endpoint + params, calling fetch() for it when missing or expired.
+
+        fetch() returns the decoded JSON (None for a failed request, which is
+        not cached) or raises; either way an expired copy is returned instead
+        if there is one.
+        """
+        key = self.make_key(endpoint, params)
+        ttl = self.ttl_for(endpoint)
+        entry, tier = self._lookup(key, ttl)
+        if entry is not None:
+            text, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < ttl:
+                with self._lock:
+                    if tier == 'memory':
+                        self.memory_hits += 1
+                    else:
+                        self.disk_hits += 1
+                return json.loads(text)
+            if age < ttl + self.stale_ttl:
+                with self._lock:
+                    self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return json.loads(text)
+
+        with self._lock:
+            self.misses += 1
+        try:
+            value = fetch()
+        except Exception:
+            if entry is None:
+                raise
+            value = None
+        if value is not None:
+            self._store(key, value)
+            return value
+        return json.loads(entry[0]) if entry is not None else None
+
+    def _lookup(self, key, ttl):
+        """(entry, tier) for a key, or (None, None).
+
+        Disk is only read when memory has no fresh copy, and its copy is
+        moved into memory when newer (another process may have refreshed it).
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and time.time() - entry[1] < ttl:
+            return entry, 'memory'
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        row = conn.execute("SELECT response, fetched_at FROM tmdb_cache WHERE cache_key = ?", (key,)).fetchone()
+        conn.close()
+        if row is None or (entry is not None and row[1] <= entry[1]):
+            return (entry, 'memory') if entry is not None else (None, None)
+        entry = (row[0], row[1])
+        with self._lock:
+            self._memory[key] = entry
+        return entry, 'disk'
+
+    def _store(self, key, value):
+        entry = (json.dumps(value), time.time())
+        with self._lock:
+            self._memory[key] = entry
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO tmdb_cache (cache_key, response, fetched_at) VALUES (?, ?, ?)",
+                         (key, entry[0], entry[1]))
+            if prune:
+                # Nothing older than the longest TTL plus the stale window can be served again
+                oldest = entry[1] - max([self.default_ttl, *self.ttls.values()]) - self.stale_ttl
+                conn.execute("DELETE FROM tmdb_cache WHERE fetched_at < ?", (oldest,))
+        conn.close()
+
+    def _refresh_in_background(self, key, fetch):
+        """Fetch a stale key again on a daemon thread, at most one refresh per key at a time"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                value = fetch()
+                if value is not None:
+                    self._store(key, value)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"Error refreshing cached TMDB response {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='tmdb-cache-refresh', daemon=True).start()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        with conn:
+            conn.execute("DELETE FROM tmdb_cache")
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.stale_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'refresh_errors': self.errors,
+                'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory)
+            }